@@ -0,0 +1,709 @@
+"""Benchmark the stages generating language data on synthetic input files.
+
+The real input files are large and licensed separately, so this script
+writes random input files in the formats expected by the parsers instead,
+scaled by given factors. Each stage of the build is then run on its own in a
+fresh worker process (on a database containing the results of the stages it
+depends on), and its throughput and the peak memory usage of the process are
+compared against the regression budgets in 'benchmark-budgets.json'.
+"""
+
+import io
+import os
+import sys
+import json
+import random
+import shutil
+import sqlite3
+import argparse
+import importlib
+import tempfile
+import contextlib
+import multiprocessing
+import concurrent.futures
+
+from generate_utils import (apply_build_pragmas, run_stage,
+                            run_stage_sequence, BulkWriter, DEFAULT_BATCH_SIZE)
+
+script_path = os.path.dirname(os.path.abspath(__file__))
+
+DEFAULT_SCALES = (1, 5, 20)
+DEFAULT_BUDGETS_PATH = os.path.join(script_path, "benchmark-budgets.json")
+# Throughput is not budgeted for stages finishing faster than this, since
+# their timings vary too much between runs
+MIN_BUDGET_SECONDS = 0.05
+
+english_words = ("to eat drink go come see be rice water fire great big small "
+                 "person house tree make run study read write").split()
+hiragana = [chr(code) for code in range(0x3042, 0x3093)]
+katakana = [chr(code) for code in range(0x30A2, 0x30F3)]
+
+
+def get_japanese_kanji(count):
+    """Return the first given number of kanji which can be encoded in EUC-JP
+    (the encoding of kanjidic, kradfile and enamdict).
+    """
+    kanji = []
+    for code in range(0x4E00, 0x9FA6):
+        try:
+            chr(code).encode("euc_jp")
+        except UnicodeEncodeError:
+            continue
+        kanji.append(chr(code))
+        if len(kanji) == count:
+            break
+    return kanji
+
+
+def write_jmdict(filename, entries, kanji, rnd):
+    """Write given number of random dictionary entries into the file with
+    given name (in the format of 'JMdict_e'). Return the ids, words and
+    readings of the entries.
+    """
+    entities = {
+        "n": "noun (common) (futsuumeishi)",
+        "v1": "Ichidan verb",
+        "vs": "noun or participle which takes the aux. verb suru",
+        "adj-i": "adjective (keiyoushi)",
+        "exp": "expressions (phrases, clauses, etc.)",
+        "uk": "word usually written using kana alone",
+        "comp": "computing",
+        "ksb": "Kansai-ben"
+    }
+    entity_tags = { "uk": "misc", "comp": "field", "ksb": "dial" }
+    words_and_readings = []
+    with open(filename, "w", encoding="utf-8") as f:
+        f.write('<?xml version="1.0" encoding="UTF-8"?>\n<!DOCTYPE JMdict [\n'
+                '<!ELEMENT JMdict (entry*)>\n')
+        for entity, text in entities.items():
+            f.write('<!ENTITY %s "%s">\n' % (entity, text))
+        f.write("]>\n<!-- JMdict created: 2024-01-01 -->\n<JMdict>\n")
+        for number in range(entries):
+            entry_id = 1000000 + number * 7
+            f.write("<entry>\n<ent_seq>%d</ent_seq>\n" % entry_id)
+            words = ["".join(rnd.choice(kanji)
+                             for _ in range(rnd.randint(1, 3)))
+                     for _ in range(rnd.randint(0, 2))]
+            for word in words:
+                f.write("<k_ele>\n<keb>%s</keb>\n" % word)
+                if rnd.random() < 0.3:
+                    f.write("<ke_pri>nf%02d</ke_pri>\n" % rnd.randint(1, 48))
+                if rnd.random() < 0.2:
+                    f.write("<ke_pri>ichi%d</ke_pri>\n" % rnd.randint(1, 2))
+                f.write("</k_ele>\n")
+            readings = ["".join(rnd.choice(hiragana)
+                                for _ in range(rnd.randint(2, 4)))
+                        for _ in range(rnd.randint(1, 2))]
+            for reading in readings:
+                f.write("<r_ele>\n<reb>%s</reb>\n" % reading)
+                if words and rnd.random() < 0.2:
+                    f.write("<re_restr>%s</re_restr>\n" % words[0])
+                if rnd.random() < 0.2:
+                    f.write("<re_pri>spec%d</re_pri>\n" % rnd.randint(1, 2))
+                f.write("</r_ele>\n")
+            for _ in range(rnd.randint(1, 3)):
+                f.write("<sense>\n")
+                for entity in rnd.sample(list(entities), rnd.randint(0, 2)):
+                    tag = entity_tags.get(entity, "pos")
+                    f.write("<%s>&%s;</%s>\n" % (tag, entity, tag))
+                if words and rnd.random() < 0.1:
+                    f.write("<stagk>%s</stagk>\n" % words[0])
+                for _ in range(rnd.randint(1, 3)):
+                    f.write('<gloss xml:lang="eng">%s</gloss>\n' % " ".join(
+                        rnd.choice(english_words)
+                        for _ in range(rnd.randint(1, 3))))
+                f.write("</sense>\n")
+            if rnd.random() < 0.2:
+                f.write('<sense>\n<gloss xml:lang="ger">essen</gloss>\n'
+                        '</sense>\n')
+            f.write("</entry>\n")
+            words_and_readings.append((entry_id, words, readings))
+        f.write("</JMdict>\n")
+    return words_and_readings, entities
+
+
+def write_kanjivg(filename, kanji, rnd):
+    """Write random SVG strokes for given kanji into the file with given name
+    (in the format of 'kanjivg.xml', including some variant entries).
+    """
+    def write_group(f, depth):
+        element = (' kvg:element="%s"' % rnd.choice(kanji[:50])
+                   if rnd.random() < 0.7 else "")
+        f.write('<g id="g"%s kvg:position="left">\n' % element)
+        for number in range(rnd.randint(1, 3)):
+            if depth < 3 and rnd.random() < 0.4:
+                write_group(f, depth + 1)
+                continue
+            f.write('<path id="s%d" kvg:type="㇐" d="M%.2f,%.2f%s"/>\n' % (
+                number, rnd.uniform(0, 109), rnd.uniform(0, 109), "".join(
+                    "c%.2f,%.2f,%.2f,%.2f,%.2f,%.2f" % tuple(
+                        rnd.uniform(-20, 20) for _ in range(6))
+                    for _ in range(rnd.randint(1, 3)))))
+        f.write("</g>\n")
+
+    entries = [(character, "") for character in kanji]
+    entries += [(character, "-Kaisho")
+                for character in rnd.sample(kanji, len(kanji) // 10)]
+    with open(filename, "w", encoding="utf-8") as f:
+        f.write('<?xml version="1.0" encoding="UTF-8"?>\n'
+                '<kanjivg xmlns:kvg="http://kanjivg.tagaini.net">\n')
+        for character, variant in entries:
+            f.write('<kanji id="kvg:kanji_%05x%s">\n'
+                    '<g id="kvg:%05x" kvg:element="%s">\n'
+                    % (ord(character), variant, ord(character), character))
+            for _ in range(rnd.randint(1, 3)):
+                write_group(f, 1)
+            f.write("</g>\n</kanji>\n")
+        f.write("</kanjivg>\n")
+
+
+def write_japanese_data(path, scale, rnd):
+    """Write synthetic input files for the Japanese data into the directory
+    with given path, sized by given scale. Return the input paths (as keyword
+    arguments for `InputPaths`) and the number of entries per stage.
+    """
+    os.makedirs(path, exist_ok=True)
+    kanji = get_japanese_kanji(300 * scale)
+    num_entries = 2000 * scale
+    paths = dict()
+    counts = dict()
+    # Dictionary and improved texts of the info entities
+    paths["dictionary"] = os.path.join(path, "JMdict_e")
+    entries, entities = write_jmdict(
+        paths["dictionary"], num_entries, kanji, rnd)
+    counts["dictionary"] = num_entries
+    paths["dictionary_texts"] = os.path.join(
+        path, "improved-dictionary-texts.json")
+    with open(paths["dictionary_texts"], "w", encoding="utf-8") as f:
+        json.dump({ "English": dict((text, text.capitalize())
+                                    for text in entities.values()),
+                    "Japanese": { entities["n"]: "名詞" } }, f,
+                  ensure_ascii=False)
+    counts["dictionary-texts"] = len(entities)
+    # JLPT vocabulary lists, mostly containing words from the dictionary
+    paths["jlpt_vocab"] = []
+    counts["jlpt-vocab"] = 0
+    for level in range(5, 0, -1):
+        filename = os.path.join(path, "jlpt-vocab-n%d.txt" % level)
+        with open(filename, "w", encoding="utf-8") as f:
+            for _, words, readings in rnd.sample(entries, num_entries // 12):
+                meanings = ", ".join(rnd.sample(english_words, 2))
+                if words and rnd.random() < 0.6:
+                    f.write("*{{l|ja|%s}}, {{l|ja|%s}} -%s\n"
+                            % (words[0], readings[0], meanings))
+                else:
+                    f.write("*{{l|ja|%s}} -%s\n" % (readings[0], meanings))
+            f.write("garbage line\n")
+        paths["jlpt_vocab"].append(filename)
+        counts["jlpt-vocab"] += num_entries // 12
+    filename = os.path.join(path, "jlpt-vocab-manual-assignments.json")
+    with open(filename, "w", encoding="utf-8") as f:
+        json.dump({ "3": [entry_id for entry_id, _, _ in entries[:5]] }, f)
+    paths["jlpt_vocab"].append(filename)
+    # Proper names (in EDICT format) and book frequencies
+    paths["proper_names"] = os.path.join(path, "enamdict")
+    with open(paths["proper_names"], "w", encoding="euc_jp") as f:
+        f.write("header\n")
+        for number in range(num_entries // 2):
+            f.write("%s [%s] /(s,f) Name%d/(p) Place/\n" % (
+                rnd.choice(kanji) + rnd.choice(kanji),
+                "".join(rnd.choice(hiragana) for _ in range(3)), number))
+    counts["proper-names"] = num_entries // 2
+    paths["word_book_frequencies"] = os.path.join(path, "book-frequencies.tsv")
+    with open(paths["word_book_frequencies"], "w", encoding="utf-8") as f:
+        for entry_id, _, _ in rnd.sample(entries, num_entries // 2):
+            f.write("%d\t%d\n" % (entry_id, rnd.randint(1, 1000)))
+    counts["book-frequencies"] = num_entries // 2
+    # Kanji with meanings, radicals, parts, strokes and new JLPT levels
+    paths["kanji"] = os.path.join(path, "kanjidic")
+    with open(paths["kanji"], "w", encoding="euc_jp") as f:
+        f.write("# KANJIDIC\n")
+        for number, character in enumerate(kanji):
+            fields = [character, "3021", "U%x" % ord(character),
+                      "B%d" % rnd.randint(1, 214),
+                      "G%d" % rnd.choice([1, 2, 3, 8, 9, 10]),
+                      "S%d" % rnd.randint(1, 20)]
+            if rnd.random() < 0.7:
+                fields.append("F%d" % (number + 1))
+            if rnd.random() < 0.5:
+                fields.append("J%d" % rnd.randint(1, 4))
+            fields.append(rnd.choice(katakana) + rnd.choice(katakana))
+            fields.append(rnd.choice(hiragana) + "." + rnd.choice(hiragana))
+            fields.append("{%s} {%s}" % tuple(rnd.sample(english_words, 2)))
+            f.write(" ".join(fields) + "\n")
+    for stage in ("kanji", "kanji-lookup-tables", "kanji-parts",
+                  "kanji-jlpt-levels", "kanji-strokes"):
+        counts[stage] = len(kanji)
+    paths["kanji_meanings"] = os.path.join(
+        path, "improved-kanji-meanings.json")
+    with open(paths["kanji_meanings"], "w", encoding="utf-8") as f:
+        json.dump(dict((character, [rnd.choice(english_words)])
+                       for character in kanji[:len(kanji) // 3]), f)
+    counts["kanji-meanings"] = len(kanji) // 3
+    paths["kanji_radicals"] = os.path.join(path, "radical.utf8.txt")
+    with open(paths["kanji_radicals"], "w", encoding="utf-8") as f:
+        f.write("header\n")
+        for number in range(1, 215):
+            f.write("%s [いち イチ] B%d S%d N(name%d) details\n" % (
+                kanji[number % len(kanji)], number, number % 17 + 1, number))
+    counts["radicals"] = 214
+    paths["kanji_parts"] = os.path.join(path, "kradfile")
+    with open(paths["kanji_parts"], "w", encoding="euc_jp") as f:
+        f.write("# KRADFILE\n")
+        for character in kanji:
+            f.write("%s : %s\n"
+                    % (character, " ".join(rnd.sample(kanji[:50], 3))))
+    paths["kanji_strokes"] = os.path.join(path, "kanjivg.xml")
+    write_kanjivg(paths["kanji_strokes"], kanji, rnd)
+    paths["new_jlpt_n3_kanji"] = os.path.join(path, "new-jlpt-n3-kanji.txt")
+    with open(paths["new_jlpt_n3_kanji"], "w", encoding="UTF-16LE") as f:
+        f.write("header\nheader\nheader\n")
+        f.write("".join(character + "\n"
+                        for character in kanji[:len(kanji) // 6]))
+    paths["example_words_index"] = True
+    counts["example-words"] = num_entries
+    return paths, counts
+
+
+def write_chinese_data(path, scale, rnd):
+    """Write synthetic input files for the Chinese data into the directory
+    with given path, sized by given scale. Return the input paths (as keyword
+    arguments for `InputPaths`) and the number of entries per stage.
+    """
+    os.makedirs(os.path.join(path, "Unihan"), exist_ok=True)
+    hanzi = [chr(0x4E00 + number) for number in range(400 * scale)]
+    syllables = ("ma ni hao shi de yi bu ren zhong guo da xiao lu: nu: "
+                 "er").split()
+    num_entries = 3000 * scale
+    paths = dict()
+    counts = dict()
+    # Dictionary (in CEDICT format) with variants and classifiers
+    paths["dictionary"] = os.path.join(path, "cedict_ts.u8")
+    keys = []
+    with open(paths["dictionary"], "w", encoding="utf8") as f:
+        f.write("# CC-CEDICT\n#! version=1\n")
+        for _ in range(num_entries):
+            length = rnd.randint(1, 3)
+            simp = "".join(rnd.choice(hanzi) for _ in range(length))
+            trad = "".join(chr(ord(character) + 1) if rnd.random() < 0.3
+                           else character for character in simp)
+            pinyin = " ".join(rnd.choice(syllables) + str(rnd.randint(1, 5))
+                              for _ in range(length))
+            translations = [" ".join(rnd.choice(english_words)
+                                     for _ in range(rnd.randint(1, 3)))
+                            for _ in range(rnd.randint(1, 3))]
+            kind = rnd.random()
+            if keys and kind < 0.25:
+                other_trad, other_simp, other_pinyin = rnd.choice(keys)
+                if kind < 0.08:
+                    translations.append("variant of %s|%s[%s]"
+                        % (other_trad, other_simp, other_pinyin))
+                elif kind < 0.11:
+                    translations.append("old variant of %s" % other_trad)
+                elif kind < 0.16:
+                    translations.append("CL:%s|%s[%s]"
+                        % (other_trad, other_simp, other_pinyin))
+                else:
+                    translations.append("see also %s|%s[%s]"
+                        % (other_trad, other_simp, other_pinyin))
+            keys.append((trad, simp, pinyin))
+            f.write("%s %s [%s] /%s/\n"
+                    % (trad, simp, pinyin, "/".join(translations)))
+    counts["dictionary"] = num_entries
+    counts["example-words"] = num_entries
+    # HSK vocabulary and word frequencies
+    paths["hsk_vocab"] = os.path.join(path, "hsk-vocab-2021.txt")
+    with open(paths["hsk_vocab"], "w", encoding="utf8") as f:
+        for level in range(1, 8):
+            f.write("// HSK vocab (Level %d)\n" % level)
+            for number in range(num_entries // 50):
+                simp = rnd.choice(keys)[1]
+                if rnd.random() < 0.05:
+                    simp += "｜" + rnd.choice(keys)[1]
+                f.write("%d %s\n" % (number + 1, simp))
+    counts["hsk-vocab"] = 7 * (num_entries // 50)
+    for key, filename, stage in (
+            ("web_word_frequencies", "internet-zh.num", "web-frequencies"),
+            ("lcmc_word_frequencies", "lcmc.num", "lcmc-frequencies")):
+        paths[key] = os.path.join(path, filename)
+        with open(paths[key], "w", encoding="utf8") as f:
+            f.write("header\nheader\nheader\nheader\n")
+            for number in range(num_entries // 5):
+                f.write("%d %.2f %s\n" % (number + 1, 100 - number * 0.001,
+                                          rnd.choice(keys)[1]))
+        counts[stage] = num_entries // 5
+    # Unihan database (tab separated files sorted by code point and field)
+    paths["hanzi"] = os.path.join(path, "Unihan")
+    files = dict((name, []) for name in ("Variants", "Readings",
+                 "DictionaryLikeData", "IRGSources"))
+    for character in hanzi:
+        code = "U+%X" % ord(character)
+        if rnd.random() < 0.3:
+            files["Variants"].append(
+                (code, "kTraditionalVariant", "U+%X" % (ord(character) + 1)))
+        if rnd.random() < 0.9:
+            files["Readings"].append((code, "kDefinition",
+                "%s, %s; %s" % tuple(rnd.sample(english_words, 3))))
+        if rnd.random() < 0.8:
+            files["Readings"].append((code, "kMandarin", "mǎ"))
+            files["Readings"].append(
+                (code, "kHanyuPinyin", "10001.010:mǎ,mā"))
+        if rnd.random() < 0.5:
+            files["Readings"].append((code, "kCantonese", "maa5 maa1"))
+        files["Readings"].append((code, "kJapaneseOn", "MA"))
+        if rnd.random() < 0.5:
+            files["DictionaryLikeData"].append(
+                (code, "kFrequency", str(rnd.randint(1, 5))))
+        if rnd.random() < 0.3:
+            files["DictionaryLikeData"].append(
+                (code, "kGradeLevel", str(rnd.randint(1, 6))))
+        files["IRGSources"].append((code, "kRSUnicode",
+            "%d.%d" % (rnd.randint(1, 214), rnd.randint(0, 9))))
+        files["IRGSources"].append(
+            (code, "kTotalStrokes", str(rnd.randint(1, 20))))
+    for name, rows in files.items():
+        filename = os.path.join(path, "Unihan", "Unihan_%s.txt" % name)
+        with open(filename, "w", encoding="utf8") as f:
+            f.write("# Unihan_%s.txt\n\n" % name)
+            for row in sorted(rows, key=lambda row: (row[0][2:].zfill(6),
+                                                     row[1])):
+                f.write("\t".join(row) + "\n")
+    counts["hanzi"] = len(hanzi)
+    # HSK hanzi, radicals, strokes and decompositions
+    paths["hsk_hanzi"] = os.path.join(path, "charlist.txt")
+    with open(paths["hsk_hanzi"], "w", encoding="utf8") as f:
+        number = 1
+        for level in "一二三四五六七":
+            f.write("%s级汉字表\n" % level)
+            for _ in range(len(hanzi) // 20):
+                f.write("%d\t%s\n" % (number, rnd.choice(hanzi)))
+                number += 1
+    counts["hsk-hanzi"] = number - 1
+    paths["hanzi_radicals"] = os.path.join(
+        path, "kangxi-radicals-wikipedia.tsv")
+    with open(paths["hanzi_radicals"], "w", encoding="utf8") as f:
+        f.write("header\n")
+        for number in range(1, 215):
+            radical = hanzi[number]
+            if number % 5 == 0:
+                radical += "（%s、%s）" % tuple(hanzi[number + 1:number + 3])
+            f.write("%d\t%s\t%d\tmeaning\tpin\t1,%03d\t\n"
+                    % (number, radical, number % 17 + 1, number))
+    counts["radicals"] = 214
+    paths["hanzi_strokes"] = os.path.join(path, "graphics.txt")
+    paths["hanzi_decomposition"] = os.path.join(path, "dictionary.txt")
+    with open(paths["hanzi_strokes"], "w", encoding="utf8") as strokes_file, \
+            open(paths["hanzi_decomposition"], "w", encoding="utf8") as \
+            decomposition_file:
+        for character in hanzi:
+            num_strokes = rnd.randint(2, 12)
+            strokes_file.write(json.dumps({ "character": character,
+                "strokes": ["M %d %d Q %d %d %d %d Z" % tuple(
+                    rnd.randint(0, 1024) for _ in range(6))
+                    for _ in range(num_strokes)],
+                "medians": [[[rnd.randint(0, 1024), rnd.randint(0, 1024)]
+                             for _ in range(3)] for _ in range(num_strokes)]
+            }, ensure_ascii=False) + "\n")
+            first, second = rnd.choice(hanzi), rnd.choice(hanzi)
+            if rnd.random() < 0.7:
+                decomposition = "⿰%s%s" % (first, second)
+                matches = [[number % 2] for number in range(num_strokes)]
+            else:
+                decomposition = "？"
+                matches = [None] * num_strokes
+            decomposition_file.write(json.dumps({ "character": character,
+                "decomposition": decomposition, "matches": matches
+            }, ensure_ascii=False) + "\n")
+    counts["hanzi-strokes"] = len(hanzi)
+    return paths, counts
+
+
+data_writers = {
+    "Japanese": write_japanese_data,
+    "Chinese": write_chinese_data
+}
+
+
+def write_data(language, path, scale, seed=0):
+    """Write synthetic input files for given language into the directory with
+    given path (usually in a worker process, so that the memory used for
+    generating them doesn't count towards the peak memory usage of stages).
+    """
+    rnd = random.Random("%s-%d-%d" % (language, scale, seed))
+    return data_writers[language](path, scale, rnd)
+
+
+def load_stages(language, input_paths, output_path):
+    """Return the stages of the language module for given language, using
+    given input paths (keyword arguments for `InputPaths`).
+    """
+    language_module = importlib.import_module(
+        "generate-%s-data" % language.lower())
+    return language_module.get_stages(
+        language_module.InputPaths(**input_paths), output_path)
+
+
+def open_database(database_path, batch_size):
+    connection = sqlite3.connect(database_path)
+    apply_build_pragmas(connection)
+    return connection, BulkWriter(connection.cursor(), batch_size=batch_size)
+
+
+def prepare_database(language, input_paths, output_path, stage_names,
+                     database_path, batch_size=DEFAULT_BATCH_SIZE):
+    """Run the stages with given names on a new database with given path
+    (usually in a worker process), without printing anything.
+    """
+    stages = [stage for stage in
+              load_stages(language, input_paths, output_path)
+              if stage.name in stage_names]
+    connection, writer = open_database(database_path, batch_size)
+    with contextlib.redirect_stdout(io.StringIO()):
+        run_stage_sequence(stages, writer)
+    connection.commit()
+    connection.close()
+
+
+def benchmark_stage(language, input_paths, output_path, stage_name,
+                    database_path, prepared_database_path=None,
+                    batch_size=DEFAULT_BATCH_SIZE):
+    """Run the stage with given name on a copy of the prepared database with
+    given path (or an empty database) in a fresh worker process, so that its
+    peak memory usage isn't affected by other stages. Return the report of
+    the stage (see `run_stage`).
+    """
+    stage = next(stage for stage in
+                 load_stages(language, input_paths, output_path)
+                 if stage.name == stage_name)
+    if prepared_database_path is not None:
+        shutil.copy(prepared_database_path, database_path)
+    elif os.path.exists(database_path):
+        os.remove(database_path)
+    connection, writer = open_database(database_path, batch_size)
+    with contextlib.redirect_stdout(io.StringIO()):
+        report = run_stage(stage, writer)
+    connection.commit()
+    connection.close()
+    return report
+
+
+def run_in_worker(function, *args, **kwargs):
+    """Call given function with given arguments in a new worker process.
+    Workers are started from scratch, since forked processes would share the
+    peak memory usage of this process.
+    """
+    with concurrent.futures.ProcessPoolExecutor(
+            1, mp_context=multiprocessing.get_context("spawn")) as executor:
+        return executor.submit(function, *args, **kwargs).result()
+
+
+def get_dependency_closure(stage, stages_by_name):
+    """Return the names of all stages which given stage (indirectly) depends
+    on, in the order in which they are declared.
+    """
+    names = set()
+    pending = [stage]
+    while pending:
+        for name in pending.pop().dependencies:
+            if name in stages_by_name and name not in names:
+                names.add(name)
+                pending.append(stages_by_name[name])
+    return tuple(name for name in stages_by_name if name in names)
+
+
+def benchmark_language(language, scale, data_path, seed=0, stage_names=None,
+                       batch_size=DEFAULT_BATCH_SIZE):
+    """Write synthetic input files for given language at given scale into the
+    directory with given path and benchmark its stages (or only those with
+    given names). Return a dictionary mapping stage names to their results.
+    """
+    input_path = os.path.join(data_path, "%s-%dx" % (language, scale))
+    output_path = os.path.join(input_path, "output")
+    if os.path.exists(output_path):
+        shutil.rmtree(output_path)
+    os.makedirs(output_path)
+    print("Writing synthetic input files into '%s'..." % input_path, end="\r")
+    input_paths, counts = run_in_worker(
+        write_data, language, input_path, scale, seed)
+    print("Writing synthetic input files into '%s'... Done." % input_path)
+    stages = load_stages(language, input_paths, output_path)
+    stages_by_name = dict((stage.name, stage) for stage in stages)
+    # Databases containing the results of each set of preceding stages
+    prepared_paths = dict()
+    results = dict()
+    for stage in stages:
+        if stage_names and stage.name not in stage_names:
+            continue
+        dependencies = get_dependency_closure(stage, stages_by_name)
+        if dependencies and dependencies not in prepared_paths:
+            prepared_path = os.path.join(
+                output_path, "prepared-%d.sqlite3" % len(prepared_paths))
+            run_in_worker(prepare_database, language, input_paths,
+                          output_path, dependencies, prepared_path,
+                          batch_size=batch_size)
+            prepared_paths[dependencies] = prepared_path
+        print("Benchmarking stage '%s' (%dx)..." % (stage.name, scale),
+              end="\r")
+        report = run_in_worker(benchmark_stage, language, input_paths,
+            output_path, stage.name,
+            os.path.join(output_path, "benchmark.sqlite3"),
+            prepared_paths.get(dependencies), batch_size=batch_size)
+        seconds = report["wall_seconds"]
+        results[stage.name] = {
+            "entries": counts[stage.name],
+            "seconds": seconds,
+            "entries_per_second":
+                counts[stage.name] / seconds if seconds > 0 else 0,
+            "peak_memory_mb": report["peak_memory_mb"]
+        }
+        print("Benchmarking stage '%s' (%dx)... Done." % (stage.name, scale))
+    return results
+
+
+def check_budgets(results, budgets):
+    """Compare given benchmark results (mapping languages to scales to stage
+    names to results) against given budgets (structured the same way, with
+    the minimum entries per second and the maximum peak memory usage of each
+    stage, throughput isn't budgeted for very short stages). Return a list of
+    messages describing all violated budgets.
+    """
+    violations = []
+    for language, scale_results in results.items():
+        for scale, stage_results in scale_results.items():
+            stage_budgets = budgets.get(language, dict()).get(scale, dict())
+            for stage_name, result in stage_results.items():
+                budget = stage_budgets.get(stage_name)
+                if budget is None:
+                    continue
+                if ("entries_per_second" in budget and
+                        result["entries_per_second"] <
+                        budget["entries_per_second"]):
+                    violations.append(
+                        "%s/%s (%s): %d entries/sec, budget is %d" % (
+                        language, stage_name, scale,
+                        result["entries_per_second"],
+                        budget["entries_per_second"]))
+                if ("peak_memory_mb" in budget and
+                        result["peak_memory_mb"] is not None and
+                        result["peak_memory_mb"] > budget["peak_memory_mb"]):
+                    violations.append(
+                        "%s/%s (%s): peak memory %.0f MB, budget is %.0f MB"
+                        % (language, stage_name, scale,
+                           result["peak_memory_mb"], budget["peak_memory_mb"]))
+    return violations
+
+
+def get_budgets(results, margin):
+    """Return budgets (see `check_budgets`) which allow given benchmark results
+    to get worse by given fraction.
+    """
+    budgets = dict()
+    for language, scale_results in results.items():
+        for scale, stage_results in scale_results.items():
+            for stage_name, result in stage_results.items():
+                budget = budgets.setdefault(language, dict()).setdefault(
+                    scale, dict())[stage_name] = dict()
+                if result["seconds"] >= MIN_BUDGET_SECONDS:
+                    budget["entries_per_second"] = \
+                        int(result["entries_per_second"] * (1 - margin))
+                if result["peak_memory_mb"] is not None:
+                    budget["peak_memory_mb"] = \
+                        round(result["peak_memory_mb"] * (1 + margin))
+    return budgets
+
+
+def print_results(results):
+    print("%-10s %-20s %6s %8s %8s %12s %9s" % ("Language", "Stage", "Scale",
+          "Entries", "Seconds", "Entries/sec", "Memory"))
+    for language, scale_results in results.items():
+        for scale, stage_results in scale_results.items():
+            for stage_name, result in stage_results.items():
+                print("%-10s %-20s %6s %8d %8.2f %12d %6.0f MB" % (
+                      language, stage_name, scale, result["entries"],
+                      result["seconds"], result["entries_per_second"],
+                      result["peak_memory_mb"] or 0))
+
+
+def main(args):
+    data_path = args.data_path
+    temporary_directory = None
+    if data_path is None:
+        temporary_directory = tempfile.TemporaryDirectory()
+        data_path = temporary_directory.name
+    results = dict()
+    try:
+        for language in args.languages:
+            results[language] = dict()
+            for scale in args.scales:
+                results[language]["%dx" % scale] = benchmark_language(
+                    language, scale, data_path, seed=args.seed,
+                    stage_names=args.stages, batch_size=args.batch_size)
+                print()
+    finally:
+        if temporary_directory is not None:
+            temporary_directory.cleanup()
+    print_results(results)
+    if args.report is not None:
+        with open(args.report, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=4)
+    if args.record_budgets:
+        with open(args.budgets, "w", encoding="utf-8") as f:
+            json.dump(get_budgets(results, args.margin), f, indent=4)
+            f.write("\n")
+        print()
+        print("Recorded budgets in file '%s'." % args.budgets)
+        return 0
+    if not os.path.exists(args.budgets):
+        return 0
+    with open(args.budgets, encoding="utf-8") as f:
+        budgets = json.load(f)
+    violations = check_budgets(results, budgets)
+    print()
+    if violations:
+        print("Budgets exceeded:")
+        for violation in violations:
+            print("  " + violation)
+        return 1
+    print("All stages are within their budgets from file '%s'." % args.budgets)
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark the stages generating language data on "
+                    "synthetic input files of different sizes.")
+    parser.add_argument("--languages", "--lang", "-l", nargs="+",
+            choices=list(data_writers), default=list(data_writers),
+            help="Languages whose stages are benchmarked.")
+    parser.add_argument("--scales", metavar="N", type=int, nargs="+",
+            default=DEFAULT_SCALES,
+            help="Factors by which the synthetic input files are scaled "
+                 "(1x is about 2000 dictionary entries for Japanese and 3000 "
+                 "for Chinese).")
+    parser.add_argument("--stages", metavar="NAME", nargs="+",
+            help="Names of the stages to benchmark (default: all).")
+    parser.add_argument("--data-path", metavar="PATH", dest="data_path",
+            help="Directory in which the synthetic input files are kept "
+                 "(default: a temporary directory).")
+    parser.add_argument("--seed", metavar="N", type=int, default=0,
+            help="Seed of the random input files.")
+    parser.add_argument("--batch-size", metavar="N", type=int,
+            dest="batch_size", default=DEFAULT_BATCH_SIZE,
+            help="Number of rows buffered per statement before writing them "
+                 "to the database.")
+    parser.add_argument("--budgets", metavar="FILENAME",
+            default=DEFAULT_BUDGETS_PATH,
+            help="JSON file with the minimum throughput and maximum peak "
+                 "memory usage of each stage per scale. The run fails if a "
+                 "stage exceeds its budget.")
+    parser.add_argument("--record-budgets", dest="record_budgets",
+            action="store_true",
+            help="Store budgets derived from the results of this run in the "
+                 "budgets file instead of checking them.")
+    parser.add_argument("--margin", metavar="FRACTION", type=float,
+            default=0.5,
+            help="Fraction by which recorded budgets allow throughput to "
+                 "drop and peak memory usage to grow.")
+    parser.add_argument("--report", metavar="FILENAME",
+            help="JSON file in which the results are stored.")
+    sys.exit(main(parser.parse_args()))
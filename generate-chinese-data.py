@@ -4,13 +4,28 @@ as command line arguments."""
 __author__ = "Daniel Bindemann (Daniel.Bindemann@gmx.de)"
 
 import os
+import time
 import argparse
 import re
 import sqlite3
 import random
 import json
+import itertools
+import collections
+import multiprocessing
+import functools
 from dataclasses import dataclass
 
+from generate_utils import (apply_build_pragmas, write_stroke_store,
+                            read_stroke_store, write_legacy_strokes_json,
+                            finalize_database, write_content_stats,
+                            run_stages, Stage, write_build_report,
+                            BulkWriter, DEFAULT_BATCH_SIZE,
+                            TracingConnection, get_statement_stats,
+                            print_statement_stats,
+                            get_build_path, BUILD_REPORT_FILENAME,
+                            BUILD_PROFILES_DIRNAME, BUILD_DIRNAME)
+
 
 def create_dictionary_tables(cursor):
     """Create tables for the dictionary in the database referenced by given
@@ -19,6 +34,7 @@ def create_dictionary_tables(cursor):
     cursor.execute("DROP TABLE IF EXISTS dictionary")
     cursor.execute("""
         CREATE TABLE IF NOT EXISTS dictionary (
+            id INTEGER PRIMARY KEY,
             simp TEXT,
             trad TEXT,
             pinyin TEXT,
@@ -105,56 +121,417 @@ def transform_pinyin(pinyin):
     return pinyin
 
 
-def parse_dictionary_entry(entry, line_number, cursor):
+"""
+The following tables are used to convert pinyin with tone numbers into pinyin
+with tone marks. They are built exactly like in the program's pinyin converter
+(String.prototype.toPinyin in js/extensions/converter.js), so that search keys
+computed here are identical to readings converted by the program.
+"""
+
+pinyin_initials = ["sh", "ch", "za", "zh", *"bpmfdtnlzcsrjqxgkh"]
+
+pinyin_finals = [
+    "iang", "iong", "uang",
+    "ang", "eng", "ong", "iao", "ian", "ing", "uai", "uan", "üan",
+    "ai", "ao", "an", "ou", "ei", "en", "ia", "ie", "iu", "in", "ua", "uo",
+    "ui", "ue", "un", "üe", "ün",
+    "a", "o", "e", "i", "u", "ü"
+]
+
+only_vowel_syllables = [
+    "a", "ai", "ao", "an", "ang", "e", "ei", "en", "eng", "er", "o", "ou", "yi",
+    "ya", "yao", "ye", "yo", "you", "yan", "yang", "yin", "ying", "yong", "wu",
+    "wa", "wai", "wei", "wo", "wan", "wang", "wen", "weng", "yu", "yue", "yuan",
+    "yun"
+]
+
+accent_codes = ("1", "2", "3", "4")
+
+accented_vowels = {
+    "a": dict(zip(accent_codes, "āáǎà")),
+    "e": dict(zip(accent_codes, "ēéěè")),
+    "i": dict(zip(accent_codes, "īíǐì")),
+    "o": dict(zip(accent_codes, "ōóǒò")),
+    "u": dict(zip(accent_codes, "ūúǔù")),
+    "ü": dict(zip(accent_codes, "ǖǘǚǜ"))
+}
+
+# Index of the vowel carrying the tone mark in each final or syllable
+accent_positions = {
+    "er": 0, "yi": 1, "ya": 1, "yo": 1, "yao": 1, "ye": 1, "you": 1, "yan": 1,
+    "yang": 1, "yin": 1, "ying": 1, "yong": 1, "wu": 1, "wa": 1, "wai": 1,
+    "wei": 1, "wo": 1, "wan": 1, "wang": 1, "wen": 1, "weng": 1, "yu": 1,
+    "yue": 2, "yuan": 2, "yun": 1,
+    "a": 0, "o": 0, "e": 0, "i": 0, "u": 0, "ü": 0, "ai": 0, "ao": 0, "an": 0,
+    "ou": 0, "ei": 0, "en": 0, "ia": 1, "ie": 1, "iu": 1, "in": 0, "ua": 1,
+    "uo": 1, "ui": 1, "ue": 1, "un": 0, "üe": 1, "ün": 0, "ang": 0, "eng": 0,
+    "ong": 0, "iao": 1, "ian": 1, "ing": 0, "uai": 1, "uan": 1, "üan": 1,
+    "iang": 1, "iong": 1, "uang": 1
+}
+
+syllable_to_accented_syllable = dict()
+accented_syllables = set()
+# Mirrors the program, which (mistakenly) uses accented a's for both sets
+accented_i = set(accented_vowels["a"].values())
+accented_u = set(accented_vowels["u"].values())
+
+
+def add_accented_syllables(syllable, initial, final):
+    syllable_to_accented_syllable[syllable] = dict()
+    for accent_code in accent_codes:
+        vowel = final[accent_positions[final]]
+        accented_syllable = initial + final.replace(
+            vowel, accented_vowels[vowel][accent_code], 1)
+        syllable_to_accented_syllable[syllable][accent_code] = accented_syllable
+        accented_syllables.add(accented_syllable)
+
+
+for initial in pinyin_initials:
+    for final in pinyin_finals:
+        add_accented_syllables(initial + final, initial, final)
+for syllable in only_vowel_syllables:
+    add_accented_syllables(syllable, "", syllable)
+# Allow conversion of "ue" and "v" to "ü"
+for syllable, pattern in (("nue", "n%s"), ("lue", "l%s"), ("nuee", "n%se"),
+                          ("luee", "l%se"), ("nv", "n%s"), ("lv", "l%s"),
+                          ("nve", "n%se"), ("lve", "l%se")):
+    syllable_to_accented_syllable[syllable] = {
+        accent_code: pattern % accented_vowels["ü"][accent_code]
+        for accent_code in accent_codes }
+
+unaccented_vowels = { accented: vowel for vowel in accented_vowels
+                      for accented in accented_vowels[vowel].values() }
+remove_tone_marks_table = str.maketrans(unaccented_vowels)
+
+
+def split_pinyin(pinyin):
+    """Split given pinyin with tone numbers into syllables the same way as the
+    program's pinyin converter does. Return a list of syllables with tone
+    marks and a list of their tones (5 for neutral tone or unknown syllables).
+    """
+    original = pinyin.strip()
+    string = pinyin.lower().strip()
+    converted = []
+    tones = []
+    unmatched_chars = []
+
+    def append_unmatched_chars():
+        if len(unmatched_chars) == 0:
+            return
+        converted.append("".join(unmatched_chars))
+        tones.append(5)
+        unmatched_chars.clear()
+
+    # Converted syllables can only occur in pinyin containing tone marks
+    has_tone_marks = not unaccented_vowels.keys().isdisjoint(string)
+    i = 0
+    while i < len(string):
+        processed = False
+        # Skip already converted syllables
+        for l in range(6 if has_tone_marks else 0, 0, -1):
+            syllable = string[i:i + l]
+            if syllable in accented_syllables:
+                # If next syllable is invalid (starts with i/u), shorten this
+                next_char = string[i + l:i + l + 1]
+                if next_char == "i" or next_char == "u" or \
+                        next_char in accented_i or next_char in accented_u:
+                    continue
+                append_unmatched_chars()
+                converted.append(syllable)
+                i += l
+                processed = True
+                break
+        if processed:
+            continue
+        # Convert maximal syllables
+        for l in range(6, 0, -1):
+            syllable = string[i:i + l]
+            if syllable in syllable_to_accented_syllable:
+                append_unmatched_chars()
+                accent_code = string[i + l:i + l + 1]
+                if accent_code in accent_codes:
+                    converted.append(
+                        syllable_to_accented_syllable[syllable][accent_code])
+                    tones.append(int(accent_code))
+                    i += 1
+                else:
+                    # Convert "ue" to "ü" in valid syllables
+                    if syllable in ("nue", "lue", "nuee", "luee"):
+                        converted.append(syllable.replace("ue", "ü"))
+                    else:
+                        converted.append(syllable)
+                    tones.append(5)
+                i += l
+                processed = True
+                break
+        if processed:
+            continue
+        # If no syllables have been matched, just append the next character
+        unmatched_chars.append(original[i])
+        i += 1
+    append_unmatched_chars()
+    return converted, tones
+
+
+def get_pinyin_search_keys(pinyin):
+    """Return search keys for given pinyin with tone numbers: the pinyin
+    without tones, the pinyin with tone marks (equal to the conversion done by
+    the program) and its syllables with tone numbers separated by spaces.
+    Pinyin with tone numbers can be matched against the latter by inserting a
+    space after each tone number. All keys are lowercase, since SQLite only
+    compares ASCII letters case-insensitively (e.g. 'É' and 'é' differ).
+    """
+    syllables, tones = split_pinyin(pinyin)
+    toneless = []
+    numbered = []
+    for syllable, tone in zip(syllables, tones):
+        syllable = syllable.translate(remove_tone_marks_table).lower()
+        toneless.append(syllable)
+        numbered.append(syllable + (str(tone) if tone < 5 else ""))
+    return ("".join(toneless), "".join(syllables).lower(),
+            " ".join(numbered))
+
+
+def create_pinyin_keys(data, writer):
+    """Write search keys for the pinyin of all entries in given dictionary data
+    and of their variants (see `get_pinyin_search_keys`) into a table using
+    given bulk writer. Position 0 refers to the pinyin of an entry itself,
+    position i to the pinyin of its i-th variant. The key columns are indexed
+    case-insensitively, so that LIKE patterns without a leading wildcard can
+    use the indices.
+    """
+    print("Creating pinyin search keys...", end="\r")
+    writer.execute("DROP TABLE IF EXISTS pinyin_keys")
+    writer.execute("""
+        CREATE TABLE pinyin_keys (
+            id INTEGER,
+            position INTEGER,
+            toneless TEXT COLLATE NOCASE,
+            marked TEXT COLLATE NOCASE,
+            syllables TEXT COLLATE NOCASE,
+            PRIMARY KEY (id, position)
+        ) WITHOUT ROWID""")
+    pinyin_to_keys = dict()
+    num_rows = 0
+    for entry_id, entry in data.entries.items():
+        pinyin_list = [entry.pinyin]
+        if entry.variants is not None:
+            pinyin_list.extend(variant.split("|")[2]
+                               for variant in entry.variants.split(";"))
+        for position, pinyin in enumerate(pinyin_list):
+            keys = pinyin_to_keys.get(pinyin)
+            if keys is None:
+                keys = pinyin_to_keys[pinyin] = get_pinyin_search_keys(pinyin)
+            writer.insert("pinyin_keys", (entry_id, position, *keys))
+        num_rows += len(pinyin_list)
+    for column in ("toneless", "marked", "syllables"):
+        writer.execute(
+            f"CREATE INDEX pinyin_keys_{column} ON pinyin_keys ({column})")
+    print("Creating pinyin search keys... Done (%d rows)." % num_rows)
+
+
+class DictionaryEntry:
+    """Dictionary entry kept in memory while post-processing the dictionary.
+    Slots keep the memory footprint of the (~120k) entries small.
+    """
+    __slots__ = ("trad", "simp", "pinyin", "translations", "variants",
+                 "classifiers")
+
+    def __init__(self, trad, simp, pinyin, translations):
+        self.trad = trad
+        self.simp = simp
+        self.pinyin = pinyin
+        self.translations = translations
+        self.variants = None
+        self.classifiers = None
+
+
+@dataclass
+class DictionaryData:
+    """Dictionary entries kept in memory while post-processing them."""
+    # Map entry IDs to entries (IDs are assigned in order of the file)
+    entries: dict
+    # Map (trad, simp, pinyin) to the ID of the entry with that key
+    key_to_id: dict
+    # Map (trad, simp) to the set of IDs of entries with these words
+    words_to_ids: dict
+
+
+def parse_dictionary_entry(entry, line_number):
+    """Return a tuple (trad, simp, pinyin, translations) for given line of the
+    dictionary file, or None if it can't be parsed.
+    """
     match = dict_entry_pattern.match(entry)
     if match is None:
-        print("ERROR: Could not parse line %d:  %s", (line_number, entry))
-        return False
+        print("ERROR: Could not parse line %d:  %s" % (line_number, entry))
+        return None
     trad, simp = match.group(1, 2)
     pinyin = transform_pinyin(match.group(3))
     translations = list(map(
             lambda t: t.strip(), match.group(4).replace(";", "/").split("/")))
-    cursor.execute("INSERT INTO dictionary VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
-        (simp, trad, pinyin, ";".join(translations),
-        None, None, None, None, None))
-    return True
+    return trad, simp, pinyin, translations
+
+
+def add_dictionary_entry(data, trad, simp, pinyin, translations):
+    """Add an entry to given dictionary data and return its ID. Lines of the
+    dictionary file sharing a key are merged into a single entry.
+    """
+    key = (trad, simp, pinyin)
+    entry_id = data.key_to_id.get(key)
+    if entry_id is not None:
+        entry = data.entries[entry_id]
+        entry.translations.extend(translation for translation in translations
+                                  if translation not in entry.translations)
+        return entry_id
+    entry_id = len(data.key_to_id) + 1
+    data.entries[entry_id] = DictionaryEntry(trad, simp, pinyin, translations)
+    data.key_to_id[key] = entry_id
+    data.words_to_ids.setdefault((trad, simp), set()).add(entry_id)
+    return entry_id
+
+
+def remove_dictionary_entry(data, entry_id):
+    """Remove the entry with given ID from given dictionary data."""
+    entry = data.entries.pop(entry_id)
+    del data.key_to_id[(entry.trad, entry.simp, entry.pinyin)]
+    data.words_to_ids[(entry.trad, entry.simp)].discard(entry_id)
 
 
-def parse_dictionary(filename, cursor, verbose=False):
+def count_dictionary_entries(data, trad, simp, pinyin=None):
+    """Return the number of entries with given words (and reading)."""
+    if pinyin is not None:
+        return int((trad, simp, pinyin) in data.key_to_id)
+    return len(data.words_to_ids.get((trad, simp), ()))
+
+
+def resolve_variant_chains(variants, var_to_ref_map):
+    """Given a list of (variant key, variant type) and a mapping from variant
+    keys to the key of the entry they are a variant of, map each referenced
+    key to the list of all its variants. Variants of variants exist, so
+    variants are registered for all entries in their chain of references.
+    The chain of each variant is only computed once and reused for variants
+    referencing it. Self-references and cycles are reported and cut off.
+    """
+    chains = dict()
+    # Chains of keys leading into a cycle depend on where the cycle has been
+    # entered, so they are not reused for other variants
+    leads_into_cycle = set()
+    self_references = set()
+    cycles = set()
+    for variant_key in var_to_ref_map:
+        if variant_key in chains:
+            continue
+        chain = []
+        visited = [variant_key]
+        visited_set = set(visited)
+        key = variant_key
+        while key in var_to_ref_map:
+            ref_key = var_to_ref_map[key]
+            # This has happened for the entry: 倆錢兒|俩钱儿[lia3 qian2 r5]
+            if ref_key == key:
+                self_references.add(key)
+                break
+            if ref_key in visited_set:
+                cycles.add(frozenset(visited[visited.index(ref_key):]))
+                leads_into_cycle.add(variant_key)
+                break
+            chain.append(ref_key)
+            if ref_key in chains and ref_key not in leads_into_cycle:
+                chain.extend(chains[ref_key])
+                break
+            visited.append(ref_key)
+            visited_set.add(ref_key)
+            key = ref_key
+        if variant_key in leads_into_cycle:
+            chains[variant_key] = chain
+            continue
+        # The chain of each key visited on the way is a suffix of this chain
+        for position, key in enumerate(visited):
+            if key in var_to_ref_map and key not in chains:
+                chains[key] = chain[position:]
+    for key in sorted(self_references):
+        print("WARNING: entry %s contains a self-reference." % str(key))
+    for cycle in cycles:
+        print("WARNING: entries %s reference each other in a cycle."
+              % ", ".join(map(str, sorted(cycle))))
+
+    ref_to_variants = dict()
+    for (variant_key, variant_type) in variants:
+        for ref_key in chains[variant_key]:
+            variants_for_key = ref_to_variants.setdefault(ref_key, [])
+            variants_for_key.append((variant_key, variant_type))
+
+    # Gather statistics about the size of connected groups of entries
+    parents = dict()
+    def find_group(key):
+        root = key
+        while parents.get(root, root) != root:
+            root = parents[root]
+        while key != root:
+            parents[key], key = root, parents[key]
+        return root
+    for variant_key, ref_key in var_to_ref_map.items():
+        variant_group, ref_group = find_group(variant_key), find_group(ref_key)
+        if variant_group != ref_group:
+            parents[variant_group] = ref_group
+    group_sizes = collections.Counter(find_group(key) for key in
+        set(var_to_ref_map) | set(var_to_ref_map.values()))
+    depths = [len(chain) for chain in chains.values()]
+    print("Resolved chains of references for %d variants." % len(chains))
+    if depths:
+        print("  Maximum chain length: %d, average chain length: %.2f."
+              % (max(depths), sum(depths) / len(depths)))
+        print("  Largest group of connected entries: %d entries."
+              % max(group_sizes.values()))
+    print("  Found %d self-references and %d cycles."
+          % (len(self_references), len(cycles)))
+    return ref_to_variants
+
+
+def parse_dictionary(filename, writer, verbose=False):
     """Parse given dictionary file (should be called 'cedict_ts.u8') and insert
-    dictionary entries into the database referenced by the given cursor."""
-    with open(filename, "r", encoding="utf8") as f:
-        lines = f.readlines()
+    dictionary entries into the database using the given bulk writer.
+    Entries are processed in memory and each of them is written only once.
+    """
     print("Creating tables for dictionary...", end="\r")
-    create_dictionary_tables(cursor)
+    create_dictionary_tables(writer.cursor)
     print("Creating tables for dictionary... Done.")
 
-    print("Inserting entries into the database... 0%", end="\r")
-    for i, line in enumerate(lines):
-        if line.startswith("#"):
-            i -= 1
-            continue
-        parse_dictionary_entry(line, i, cursor)
-        perc = ((i + 1) / len(lines)) * 100
-        print("Inserting entries into the database... %d%%" % perc,
-              end="\r")
-    cursor.execute("SELECT COUNT(*) FROM dictionary")
-    num_entries = cursor.fetchone()[0]
-    print("Inserting entries into the database... 100%")
+    data = DictionaryData(dict(), dict(), dict())
+    num_lines = 0
+    with open(filename, "r", encoding="utf8") as f:
+        for i, line in enumerate(f):
+            if line.startswith("#"):
+                continue
+            entry_data = parse_dictionary_entry(line, i)
+            if entry_data is not None:
+                add_dictionary_entry(data, *entry_data)
+                num_lines += 1
+            if num_lines % 1000 == 0:
+                print("Reading dictionary entries... %d" % num_lines,
+                      end="\r")
+    num_entries = len(data.entries)
+    print("Reading dictionary entries... %d" % num_lines)
     print("The dictionary contains %s entries." % num_entries)
+    if num_lines > num_entries:
+        print("  Merged %s lines sharing a key with a previous entry."
+              % (num_lines - num_entries))
 
-    # TODO: create indices elsewhere?
-    cursor.execute("CREATE INDEX dictionary_simp ON dictionary (simp)")
-    cursor.execute(
-        "CREATE INDEX dictionary_key ON dictionary (trad, simp, pinyin)")
-    
-    # Handle classifiers
-    cursor.execute("SELECT simp, trad, pinyin, translations FROM dictionary")
-    entries = cursor.fetchall()
+    # Handle classifiers and search for variants of the form "variant of ..."
+    # in a single pass. Classifiers are removed from the translations of an
+    # entry before searching them for variant references
+    variant_regex = re.compile(
+        r"^(?:(\S*)\s)?variant of ([^|[, ]+)(?:\|([^[):, ]*))?(?:\[([^]]*)\])?")
+    variants = []
+    var_to_translations = dict()
+    var_to_ref_map = dict()
     num_cls_found = 0
-    print("Searching for classifiers... 0%", end="\r")
-    for i, (simp, trad, pinyin, tsl_string) in enumerate(entries):
-        translations = tsl_string.split(";")
+    num_missing = 0
+    num_ambiguous = 0
+    print("Searching for classifiers and variants... 0%", end="\r")
+    for i, (entry_id, entry) in enumerate(data.entries.items()):
+        trad, simp, pinyin = entry.trad, entry.simp, entry.pinyin
+        translations = entry.translations
         new_translations = translations.copy()
         cls_strings = []
         for translation in translations:
@@ -176,29 +553,9 @@ def parse_dictionary(filename, cursor, verbose=False):
                     ref_simp = ref_trad 
                 cls_strings.append("%s|%s|%s" % (ref_trad, ref_simp, ref_pinyin))
         if len(cls_strings) > 0:
-            cursor.execute(
-                "UPDATE dictionary SET translations = ?, classifiers = ? "
-                "WHERE trad = ? AND simp = ? AND pinyin = ?",
-                (";".join(new_translations), ";".join(cls_strings),
-                trad, simp, pinyin))
-        perc = ((i + 1) / num_entries) * 100
-        print("Searching for classifiers... %d%%" % perc, end="\r")
-    print("Searching for classifiers... 100%%. Found classifiers for %s entries."
-        % num_cls_found)
-
-    # Handle variants of the form "variant of ..."
-    cursor.execute("SELECT simp, trad, pinyin, translations FROM dictionary")
-    entries = cursor.fetchall()
-    variant_regex = re.compile(
-        r"^(?:(\S*)\s)?variant of ([^|[, ]+)(?:\|([^[):, ]*))?(?:\[([^]]*)\])?")
-    variants = []
-    var_to_translations = dict()
-    var_to_ref_map = dict()
-    num_missing = 0
-    num_ambiguous = 0
-    print("Searching for variants... 0%", end="\r")
-    for i, (simp, trad, pinyin, tsl_string) in enumerate(entries):
-        translations = tsl_string.split(";")
+            entry.translations = new_translations
+            entry.classifiers = ";".join(cls_strings)
+        translations = entry.translations
         for translation in translations:
             match = variant_regex.match(translation)
             if match is None:
@@ -209,9 +566,8 @@ def parse_dictionary(filename, cursor, verbose=False):
             if variant_type is None:
                 variant_type = ""
             if ref_pinyin is None:
-                cursor.execute("SELECT COUNT(*) FROM dictionary WHERE "
-                    "trad = ? AND simp = ?", (ref_trad, ref_simp))
-                match_count = cursor.fetchone()[0]
+                match_count = count_dictionary_entries(
+                    data, ref_trad, ref_simp)
                 if match_count == 0:
                     if verbose:
                         print("WARNING: Couldn't find dictionary entry "
@@ -227,67 +583,55 @@ def parse_dictionary(filename, cursor, verbose=False):
                 ref_pinyin = ""
             variant_key = (trad, simp, pinyin)
             ref_key = (ref_trad, ref_simp, transform_pinyin(ref_pinyin))
-            var_to_translations[variant_key] = \
+            var_to_translations[entry_id] = \
                 list(filter(lambda t: t != translation, translations))
             variants.append((variant_key, variant_type))
             var_to_ref_map[variant_key] = ref_key
-        perc = ((i + 1) / num_entries) * 100
-        print("Searching for variants... %d%%" % perc, end="\r")
-    print("Searching for variants... 100%%. Found %s variants." % len(variants))
+        if i % 1000 == 0:
+            perc = ((i + 1) / num_entries) * 100
+            print("Searching for classifiers and variants... %d%%" % perc,
+                  end="\r")
+    print("Searching for classifiers and variants... 100%.")
+    print("  Found classifiers for %s entries." % num_cls_found)
+    print("  Found %s variants." % len(variants))
     print("  Couldn't find dictionary entry for %s references." % num_missing)
     print("  Multiple dictionary entries for %s references." % num_ambiguous)
 
-    # Map dictionary entries to a list of their variants.
-    # NOTE: variants of variants exist, so I have to use a nested loop
-    # to register such derived variants for all entries in the chain
-    ref_to_variants = dict()
-    for (variant_key, variant_type) in variants:
-        key = variant_key
-        while key in var_to_ref_map:
-            ref_key = var_to_ref_map[key]
-            # Need to catch the following case to prevent infinite loops,
-            # this has happened for the entry: 倆錢兒|俩钱儿[lia3 qian2 r5]
-            if key == ref_key:
-                print("WARNING: entry %s contains a self-reference." % str(key))
-                break
-            variants_for_key = ref_to_variants.setdefault(ref_key, [])
-            variants_for_key.append((variant_key, variant_type))
-            key = ref_key
+    # Map dictionary entries to a list of their (direct and indirect) variants
+    ref_to_variants = resolve_variant_chains(variants, var_to_ref_map)
 
     # Register variants for all referenced dictionary entries
     print("Updating dictionary with variants... 0%", end="\r")
     for i, ref_key in enumerate(ref_to_variants):
         variants = ref_to_variants[ref_key]
-        cursor.execute("SELECT COUNT(*) FROM dictionary "
-            "WHERE trad = ? AND simp = ? AND pinyin = ?", ref_key)
-        row = cursor.fetchone()
-        if row is None:
-            print("WARNING: Can't find dict entry for %s|%s [%s]" % ref_key)
+        ref_id = data.key_to_id.get(ref_key)
+        if ref_id is None:
+            if verbose:
+                print("WARNING: Can't find dict entry for %s|%s [%s]"
+                      % ref_key)
             continue
         variant_strings = []
         for (var_trad, var_simp, var_pinyin), var_type in variants:
             variant_strings.append("%s|%s|%s|%s" %
                 (var_trad, var_simp, var_pinyin, var_type))
-        cursor.execute("UPDATE dictionary SET variants = ? "
-            "WHERE trad = ? AND simp = ? AND pinyin = ?",
-                (";".join(variant_strings), *ref_key))
-        perc = ((i + 1) / len(ref_to_variants)) * 100
-        print("Updating dictionary with variants... %d%%" % perc, end="\r")
+        data.entries[ref_id].variants = ";".join(variant_strings)
+        if i % 1000 == 0:
+            perc = ((i + 1) / len(ref_to_variants)) * 100
+            print("Updating dictionary with variants... %d%%" % perc,
+                  end="\r")
     print("Updating dictionary with variants... 100%")
 
     # Update translations for all variants, delete entry if none are left
     print("Updating translations... 0%", end="\r")
-    for i, var_key in enumerate(var_to_translations):
-        new_translations = var_to_translations[var_key]
+    for i, var_id in enumerate(var_to_translations):
+        new_translations = var_to_translations[var_id]
         if len(new_translations) == 0:
-            cursor.execute("DELETE FROM dictionary "
-                "WHERE trad = ? AND simp = ? AND pinyin = ?", var_key)
+            remove_dictionary_entry(data, var_id)
         else:
-            cursor.execute("UPDATE dictionary SET translations = ? "
-                "WHERE trad = ? AND simp = ? AND pinyin = ?",
-                (";".join(new_translations), *var_key))
-        perc = ((i + 1) / len(var_to_translations)) * 100
-        print("Updating translations... %d%%" % perc, end="\r")
+            data.entries[var_id].translations = new_translations
+        if i % 1000 == 0:
+            perc = ((i + 1) / len(var_to_translations)) * 100
+            print("Updating translations... %d%%" % perc, end="\r")
     print("Updating translations... 100%")
 
     # Handle other variants, i.e.:
@@ -352,14 +696,14 @@ def parse_dictionary(filename, cursor, verbose=False):
     # - 242 references of the form "same as...", e.g. for word 馥馥
     # - 191 references of the form "see also...", e.g. for word 亞克力
     # - ...
-    cursor.execute("SELECT simp, trad, pinyin, translations FROM dictionary")
-    entries = cursor.fetchall()
+    # Entries are written into the database right after processing them
+    num_entries = len(data.entries)
     num_refs = 0
     num_missing = 0
     num_ambiguous = 0
     print("Processing references... 0%", end="\r")
-    for i, (simp, trad, pinyin, tsl_string) in enumerate(entries):
-        translations = tsl_string.split(";")
+    for i, (entry_id, entry) in enumerate(data.entries.items()):
+        translations = entry.translations
         new_translations = []
         match_found = False
         for translation in translations:
@@ -388,14 +732,9 @@ def parse_dictionary(filename, cursor, verbose=False):
                     if ref_simp is None:
                         ref_simp = ref_trad
                     # Check if reference exists and is unambiguous
-                    if no_pinyin:
-                        cursor.execute("SELECT COUNT(*) FROM dictionary WHERE "
-                            "trad = ? AND simp = ?", (ref_trad, ref_simp))
-                    else:
-                        cursor.execute("SELECT COUNT(*) FROM dictionary WHERE "
-                            "trad = ? AND simp = ? AND pinyin = ?",
-                            (ref_trad, ref_simp, transform_pinyin(ref_pinyin)))
-                    match_count = cursor.fetchone()[0]
+                    match_count = count_dictionary_entries(
+                        data, ref_trad, ref_simp,
+                        None if no_pinyin else transform_pinyin(ref_pinyin))
                     if match_count == 0:
                         if verbose:
                             print("WARNING: Couldn't find dictionary entry "
@@ -417,21 +756,42 @@ def parse_dictionary(filename, cursor, verbose=False):
                 new_translation_parts.append(translation[j:])
             new_translations.append("".join(new_translation_parts))
         if match_found:
-            cursor.execute("UPDATE dictionary SET translations = ? "
-                "WHERE trad = ? AND simp = ? AND pinyin = ?",
-                (";".join(new_translations), trad, simp, pinyin))
-        perc = ((i + 1) / num_entries) * 100
-        print("Processing references... %d%%" % perc, end="\r")
+            entry.translations = new_translations
+        writer.insert("dictionary", (entry_id, entry.simp, entry.trad,
+            entry.pinyin, ";".join(entry.translations), entry.variants,
+            entry.classifiers, None, None, None))
+        if i % 1000 == 0:
+            perc = ((i + 1) / num_entries) * 100
+            print("Processing references... %d%%" % perc, end="\r")
     print("Processing references... 100%%. Found %s references." % num_refs)
     print("  Couldn't find dictionary entry for %s references." % num_missing)
     print("  Multiple dictionary entries for %s references." % num_ambiguous)
 
+    # Index the entry keys once all entries have been written
+    print("Indexing dictionary entries...", end="\r")
+    writer.execute("CREATE INDEX dictionary_simp ON dictionary (simp)")
+    writer.execute("CREATE UNIQUE INDEX dictionary_key "
+                   "ON dictionary (trad, simp, pinyin)")
+    print("Indexing dictionary entries... Done.")
+
+    create_pinyin_keys(data, writer)
+
 
-def parse_hsk_vocabulary(filename, cursor, verbose=False):
+hsk_vocab_header_regex = re.compile(r"^//.*\(Level (\d)")
+hsk_vocab_regex = re.compile(r"^(\d+) (.*)$")
+hsk_vocab_note_regex = re.compile(r"（[^)]+）")
+
+
+def parse_hsk_vocabulary(filename, writer, verbose=False):
     with open(filename, "r", encoding="utf8") as f:
         lines = f.readlines()
-    header_regex = re.compile(r"^//.*\(Level (\d)")
-    vocab_regex = re.compile(r"^(\d+) (.*)$")
+    # Map words to the HSK level of their first dictionary entry. Levels are
+    # assigned in memory and written to the dictionary in a single update
+    word_to_level = dict()
+    for simp, hsk in writer.execute(
+            "SELECT simp, hsk FROM dictionary ORDER BY id"):
+        word_to_level.setdefault(simp, hsk)
+    assigned_levels = dict()
     level = None
     num_entries = 0
     num_assigned = 0
@@ -442,7 +802,7 @@ def parse_hsk_vocabulary(filename, cursor, verbose=False):
     num_unmatched_total = 0
     num_duplicates_total = 0
     for i, line in enumerate(lines):
-        header_match = header_regex.match(line)
+        header_match = hsk_vocab_header_regex.match(line)
         if header_match is not None:
             if level is not None and verbose:
                 print("---------------------------------------"
@@ -466,7 +826,7 @@ def parse_hsk_vocabulary(filename, cursor, verbose=False):
                 print("Parsed    0 words for HSK level %s."
                     % ("7 - 9" if level == 7 else level), end="\r")
             continue
-        vocab_match = vocab_regex.match(line)
+        vocab_match = hsk_vocab_regex.match(line)
         if vocab_match is not None:
             if level is None:
                 print("ERROR: first level header is missing. Aborting.")
@@ -481,12 +841,9 @@ def parse_hsk_vocabulary(filename, cursor, verbose=False):
                     % (num_entries, "7 - 9" if level == 7 else level), end="\r")
             for word in words:
                 # Discard any additional information in brackets
-                word = re.sub(r"（[^)]+）", "", word).strip()
+                word = hsk_vocab_note_regex.sub("", word).strip()
                 # Check if this word exists in the dictionary
-                cursor.execute("SELECT hsk FROM dictionary WHERE simp = ?",
-                        (word,))
-                rows = cursor.fetchall()
-                if len(rows) == 0:
+                if word not in word_to_level:
                     # Check if dictionary contains variant without 儿 at the end
                     if word.endswith("儿"):
                         words.append(word[:-1])
@@ -497,9 +854,10 @@ def parse_hsk_vocabulary(filename, cursor, verbose=False):
                     num_unmatched += 1
                     continue
                 # Check if an HSK level is already assigned
-                if rows[0][0] is not None:
+                assigned_level = word_to_level[word]
+                if assigned_level is not None:
                     if verbose:
-                        if rows[0][0] != level:
+                        if assigned_level != level:
                             print("WARNING: Word '%s' already has a different "
                                   "HSK level assigned in the dictionary" % word)
                         else:
@@ -508,9 +866,10 @@ def parse_hsk_vocabulary(filename, cursor, verbose=False):
                     num_duplicates += 1
                     continue
                 num_assigned += 1
-                # Update HSK level in the dictionary entry
-                cursor.execute("UPDATE dictionary SET hsk = ? WHERE simp = ?",
-                        (level, word))
+                word_to_level[word] = level
+                assigned_levels[word] = level
+    # Update HSK levels of all dictionary entries at once
+    writer.update_column("dictionary", "hsk", "simp", assigned_levels)
     if verbose:
         print("--------------------------------------------------------------------")
         print("HSK level 7-9: %s entries, %s assigned, %s unmatched, %s duplicates."
@@ -528,12 +887,21 @@ def parse_hsk_vocabulary(filename, cursor, verbose=False):
 
 
 
-def parse_word_frequencies(filename, freqtype, cursor, verbose=False):
-    regex = re.compile(r"^(\d+)\s((?:\d|\.)+)\s(.+)$")
+word_frequency_regex = re.compile(r"^(\d+)\s((?:\d|\.)+)\s(.+)$")
+
+
+def parse_word_frequencies(filename, freqtype, writer, verbose=False):
     column = "net_rank" if freqtype == "web" \
         else "lcmc_rank" if freqtype == "lcmc" else None
     if column is None:
         raise ValueError("Unknown freqtype '%s'." % freqtype)
+    # Map words to the rank of their first dictionary entry. Ranks are
+    # assigned in memory and written to the dictionary in a single update
+    word_to_rank = dict()
+    for simp, rank in writer.execute(
+            f"SELECT simp, {column} FROM dictionary ORDER BY id"):
+        word_to_rank.setdefault(simp, rank)
+    assigned_ranks = dict()
     with open(filename, encoding="utf8") as f:
         # Skip first four lines
         for i in range(4):
@@ -541,7 +909,7 @@ def parse_word_frequencies(filename, freqtype, cursor, verbose=False):
         no_match_counter = 0
         match_counter = 0
         for count, line in enumerate(f):
-            line_match = regex.match(line)
+            line_match = word_frequency_regex.match(line)
             rank = int(line_match.group(1))
             score = float(line_match.group(2))
             word = line_match.group(3).strip()
@@ -549,17 +917,15 @@ def parse_word_frequencies(filename, freqtype, cursor, verbose=False):
             if score < 2:
                 break
             # Check if this word exists in the dictionary
-            cursor.execute(f"SELECT {column} FROM dictionary WHERE simp = ?",
-                    (word,))
-            entry = cursor.fetchone()
-            if entry is None:
+            if word not in word_to_rank:
                 if verbose:
                     print("WARNING: Could not find dictionary entry "
                         "for word '%s'" % (word,))
                 no_match_counter += 1
                 continue
             # Check if a frequency is already assigned
-            if entry[0] is not None and entry[0] != rank:
+            assigned_rank = word_to_rank[word]
+            if assigned_rank is not None and assigned_rank != rank:
                 if verbose:
                     print("WARNING: Word '%s' already has a different "
                         "frequency assigned in the dictionary" % word)
@@ -568,57 +934,90 @@ def parse_word_frequencies(filename, freqtype, cursor, verbose=False):
                 print(f"Parsed %5s word frequencies of type '%s'." %
                         (count, freqtype), end="\r")
             match_counter += 1
-            # Update frequency in the dictionary entry
-            cursor.execute(
-                f"UPDATE dictionary SET {column} = ? WHERE simp = ?",
-                (rank, word))
+            word_to_rank[word] = rank
+            assigned_ranks[word] = rank
+        # Update frequencies of all dictionary entries at once
+        writer.update_column("dictionary", column, "simp", assigned_ranks)
         print("Parsed %5s word frequencies of type '%s'." %
                 (count, freqtype))
         print("Assigned frequencies for %s entries." % match_counter)
         print("Couldn't find matches for %s entries." % no_match_counter)
 
 
-def parse_hanzi(unihan_path, cursor, verbose=False):
-    # Define names of relevant files and relations therein
-    relevant_fields = {
-        "Variants": [
-            "kTraditionalVariant",
-            "kSimplifiedVariant"
-        ],
-        "Readings": [
-            "kDefinition",
-            "kHanyuPinyin",
-            "kHanyuPinlu",  # Pinyin frequencies, not every hanzi has this
-            "kMandarin",  # Most frequently used pinyin
-            "kCantonese"  # Jyutping
-        ],
-        "DictionaryLikeData": [
-            "kFrequency",  # From 1 to 5 (1 is most common)
-            "kGradeLevel"  # From 1 to 6 (for Hong Kong)
-        ],
-        "IRGSources": [
-            "kRSUnicode",
-            "kTotalStrokes"
-        ]
-    }
-    # Parse data for all relevant fields from Unihan files
-    data = dict()
-    rows = dict()
-    print("Parsing Unihan files...", end="\r")
-    for file_name in relevant_fields:
-        file_path = os.path.join(unihan_path, f"Unihan_{file_name}.txt")
-        with open(file_path, "r", encoding="utf8") as f:
-            lines = f.readlines()
-        relevant_fields_set = set(relevant_fields[file_name])
-        for field_name in relevant_fields_set:
-            data[field_name] = []
-        for line in lines:
+# Relevant fields in each of the Unihan files read by `parse_hanzi`
+unihan_fields = {
+    "Variants": [
+        "kTraditionalVariant",
+        "kSimplifiedVariant"
+    ],
+    "Readings": [
+        "kDefinition",
+        "kHanyuPinyin",
+        "kHanyuPinlu",  # Pinyin frequencies, not every hanzi has this
+        "kMandarin",  # Most frequently used pinyin
+        "kCantonese"  # Jyutping
+    ],
+    "DictionaryLikeData": [
+        "kFrequency",  # From 1 to 5 (1 is most common)
+        "kGradeLevel"  # From 1 to 6 (for Hong Kong)
+    ],
+    "IRGSources": [
+        "kRSUnicode",
+        "kTotalStrokes"
+    ]
+}
+
+
+def read_unihan_file(file_path, fields):
+    """Scan given Unihan file line by line and keep only values of given
+    fields. Return the codepoints (like 'U+4E00') having any of these fields
+    in order of their first appearance, and a dictionary mapping each field
+    to a dictionary from codepoints to values.
+    """
+    codes = dict()
+    values = {field: dict() for field in fields}
+    with open(file_path, "r", encoding="utf8") as f:
+        for line in f:
             if line.startswith("#") or line[0] == "\n":
                 continue
-            subject, relation, obj = line.split("\t")
-            if relation in relevant_fields_set:
-                data[relation].append((subject, obj.rstrip()))
-                rows.setdefault(subject, dict())
+            code, field, value = line.split("\t")
+            field_values = values.get(field)
+            if field_values is None:
+                continue
+            field_values[code] = value.rstrip()
+            codes[code] = None
+    return list(codes), values
+
+
+def read_unihan(unihan_path, jobs=1):
+    """Read all relevant fields from the Unihan files in given directory.
+    If more than one job is given, files are read concurrently by up to that
+    many worker processes. Return the codepoints in order of first appearance
+    (with files in the order of `unihan_fields`) and a dictionary mapping
+    each field to a dictionary from codepoints to values.
+    """
+    arguments = [(os.path.join(unihan_path, f"Unihan_{file_name}.txt"), fields)
+                 for file_name, fields in unihan_fields.items()]
+    if jobs > 1:
+        with multiprocessing.Pool(min(jobs, len(arguments))) as pool:
+            results = pool.starmap(read_unihan_file, arguments)
+    else:
+        results = itertools.starmap(read_unihan_file, arguments)
+    codes = dict()
+    data = dict()
+    for file_codes, file_data in results:
+        codes.update(dict.fromkeys(file_codes))
+        data.update(file_data)
+    return list(codes), data
+
+
+def parse_hanzi(unihan_path, writer, verbose=False, jobs=1):
+    """Parse hanzi from the Unihan files in given directory and insert them
+    into the database using given bulk writer. Files are scanned once and only
+    relevant fields are kept, see `read_unihan`.
+    """
+    print("Parsing Unihan files...", end="\r")
+    codes, data = read_unihan(unihan_path, jobs)
     print("Parsing Unihan files... Done.")
 
     # Print some stats about parsed data
@@ -640,11 +1039,11 @@ def parse_hanzi(unihan_path, cursor, verbose=False):
 
     def sample_chars(d, n=30):
         ns = min(n, len(d))
-        l = map(lambda c: chr(int(c[2:], 16)), random.sample(d, ns))
+        l = map(lambda c: chr(int(c[2:], 16)), random.sample(sorted(d), ns))
         return "".join(l) + ("..." if len(d) > n else "")
 
     def code_set(key):
-        return set(map(lambda t: t[0], data[key]))
+        return data[key].keys()
     
     def print_diff(key1, key2):
         x = code_set(key1) - code_set(key2)
@@ -661,81 +1060,45 @@ def parse_hanzi(unihan_path, cursor, verbose=False):
         print_diff("kTraditionalVariant", "kSimplifiedVariant")
         print_diff("kSimplifiedVariant", "kTraditionalVariant")
 
-    # Process most customary pinyin
-    for code, value in data["kMandarin"]:
-        rows[code]["pinyin"] = value
-    # Process list of pinyin
-    for code, value in data["kHanyuPinyin"]:
-        pinyin = value.split(":")[1].split(",")
-        # Make sure pinyin from kMandarin comes first
-        if "pinyin" in rows[code] and rows[code]["pinyin"] in pinyin:
-            pinyin.remove(rows[code]["pinyin"])
-            pinyin = [rows[code]["pinyin"]] + pinyin
-        rows[code]["pinyin"] = ";".join(pinyin)
-    # Process meanings
-    for code, value in data["kDefinition"]:
-        meanings = value.split(";")
-        translations = map(lambda m:
-                map(lambda t: t.strip(), m.split(",")), meanings)
-        rows[code]["meanings"] = \
-                ";".join(map(lambda t: ",".join(t), translations))
-    # Process stroke counts
-    for code, value in data["kTotalStrokes"]:
-        num_strokes = value.split(" ")
-        # Second value is preferred for TW, ignore it for now
-        num_strokes = num_strokes[0]
-        rows[code]["strokes"] = int(num_strokes)
-    # Process USENET frequencies
-    for code, value in data["kFrequency"]:
-        rows[code]["usenet_freq"] = int(value)
-    # Process Hongkong school system grades
-    for code, value in data["kGradeLevel"]:
-        rows[code]["hk_grade"] = int(value)
-    # Process radicals
-    for code, value in data["kRSUnicode"]:
-        radical = value.split(".")[0].split("'")
-        # Second part is simplified version of radical, not needed
-        # because it's already included in the radicals table
-        radical = radical[0]
-        rows[code]["radical_id"] = int(radical)
-    # Process Jyutping readings for Cantonese
-    for code, value in data["kCantonese"]:
-        jyutping = value.split(" ")
-        rows[code]["jyutping"] = ";".join(jyutping)
     # Process simplified and traditional variants
     trad_variants = dict()
     simp_variants = dict()
-    for code, value in data["kTraditionalVariant"]:
+    for code, value in data["kTraditionalVariant"].items():
         trad_variants[code] = value.split(" ")
-    for code, value in data["kSimplifiedVariant"]:
+    for code, value in data["kSimplifiedVariant"].items():
         simp_variants[code] = value.split(" ")
-    # Find out how many hanzi are not converted between simplified/traditional
-    unchanged_hanzi = []
-    for code in rows:
-        if code not in simp_variants and code not in trad_variants:
-            unchanged_hanzi.append(code)
+
+    def code_to_hanzi(code):
+        return chr(int(code[2:], 16))
+
+    def conv_arr(codes):
+        return ", ".join(map(lambda c: code_to_hanzi(c), codes))
+
     if verbose:
+        # Find out how many hanzi are not converted between simp/trad
+        unchanged_hanzi = [code for code in codes
+                           if code not in simp_variants
+                           and code not in trad_variants]
         print(f"Hanzi with neither kSimplifiedVariant nor kTraditionalVariant: "
             f"{len(unchanged_hanzi)}  (${sample_chars(unchanged_hanzi)})")
-    # Find hanzi that have conversions for both simplified and traditional
-    both_conv = code_set("kSimplifiedVariant") & code_set("kTraditionalVariant")
-    same_simp = []
-    same_trad = []
-    both_diff = []
-    for code in both_conv:
-        if len(simp_variants[code]) == 1 and simp_variants[code][0] == code:
-            same_simp.append(code)
-            continue
-        if len(trad_variants[code]) == 1 and trad_variants[code][0] == code:
-            same_trad.append(code)
-            continue
-        both_diff.append(code)
-    # Print some stats about variants
-    multiple_trad = [
-        code for code in trad_variants.keys() if len(trad_variants[code]) > 1]
-    multiple_simp = [
-        code for code in simp_variants.keys() if len(simp_variants[code]) > 1]
-    if verbose:
+        # Find hanzi that have conversions for both simplified and traditional
+        both_conv = code_set("kSimplifiedVariant") & \
+                    code_set("kTraditionalVariant")
+        same_simp = []
+        same_trad = []
+        both_diff = []
+        for code in both_conv:
+            if len(simp_variants[code]) == 1 and simp_variants[code][0] == code:
+                same_simp.append(code)
+                continue
+            if len(trad_variants[code]) == 1 and trad_variants[code][0] == code:
+                same_trad.append(code)
+                continue
+            both_diff.append(code)
+        multiple_trad = [code for code in trad_variants.keys()
+                         if len(trad_variants[code]) > 1]
+        multiple_simp = [code for code in simp_variants.keys()
+                         if len(simp_variants[code]) > 1]
         print(f"Hanzi with multiple simplified variants: "
             f"{len(multiple_simp)}  ({sample_chars(multiple_simp)})")
         print(f"Hanzi with multiple traditional variants: "
@@ -744,87 +1107,103 @@ def parse_hanzi(unihan_path, cursor, verbose=False):
             f"{len(both_conv)}  ({sample_chars(both_conv)})")
         print(f"Hanzi where simplified variant is identical: "
             f"{len(same_simp)}  ({sample_chars(same_simp)})")
-    
-    def code_to_hanzi(code):
-        return chr(int(code[2:], 16))
-
-    def conv_arr(codes):
-        return ", ".join(map(lambda c: code_to_hanzi(c), codes))
-
-    multi_simp_strings = \
-        map(lambda c: f"{chr(int(c[2:], 16))} -> {conv_arr(simp_variants[c])}",
-            same_trad)
-    if verbose:
+        multi_simp_strings = \
+            map(lambda c: f"{code_to_hanzi(c)} -> {conv_arr(simp_variants[c])}",
+                same_trad)
         print(f"Hanzi where traditional variant is identical: "
             f"{len(same_trad)}  ({', '.join(multi_simp_strings)})")
         both_diff_strings = \
-            map(lambda code: f"{chr(int(code[2:], 16))}: -> "
+            map(lambda code: f"{code_to_hanzi(code)}: -> "
                             f"simp: {conv_arr(simp_variants[code])}, "
                             f"trad: {conv_arr(trad_variants[code])}",
                 both_diff)
         print(f"Hanzi with both distinct simplified and traditional variant: "
             f"{len(both_diff)}  ({', '.join(both_diff_strings)})")
-    print(f"Total number of hanzi found: {len(rows)}")
+    print(f"Total number of hanzi found: {len(codes)}")
+
+    # Process most customary pinyin and list of pinyin
+    pinyin = dict(data["kMandarin"])
+    for code, value in data["kHanyuPinyin"].items():
+        pinyin_list = value.split(":")[1].split(",")
+        # Make sure pinyin from kMandarin comes first
+        if code in pinyin and pinyin[code] in pinyin_list:
+            pinyin_list.remove(pinyin[code])
+            pinyin_list.insert(0, pinyin[code])
+        pinyin[code] = ";".join(pinyin_list)
+    # Process meanings
+    meanings = dict()
+    for code, value in data["kDefinition"].items():
+        meanings[code] = ";".join(
+            ",".join(t.strip() for t in m.split(",")) for m in value.split(";"))
     # Discard hanzi that have neither meanings nor readings associated
-    codes_without_core_info = []
-    all_codes = list(rows.keys())
-    for code in all_codes:
-        if "pinyin" in rows[code] or "meanings" in rows[code]:
+    remaining_codes = dict.fromkeys(codes)
+    num_without_core_info = 0
+    for code in codes:
+        if code in pinyin or code in meanings:
             continue
-        if code in simp_variants and simp_variants[code][0] in rows:
-            simp_row = rows[simp_variants[code][0]]
+        if code in simp_variants and simp_variants[code][0] in remaining_codes:
+            simp_code = simp_variants[code][0]
             # A few hanzi (about 14) exist where the simplified version has
             # pinyin or english definitions associated but the traditional one
             # doesnt, so copy data from simplified to traditional version
-            if "pinyin" in simp_row or "meanings" in simp_row:
-                if "pinyin" in simp_row:
-                    rows[code]["pinyin"] = simp_row["pinyin"]
-                if "meanings" in simp_row:
-                    rows[code]["meanings"] = simp_row["meanings"]
+            if simp_code in pinyin or simp_code in meanings:
+                if simp_code in pinyin:
+                    pinyin[code] = pinyin[simp_code]
+                if simp_code in meanings:
+                    meanings[code] = meanings[simp_code]
                 continue
-        codes_without_core_info.append(code)
-        del rows[code]
-    print(f"Hanzi with neither meanings nor pinyin: "
-          f"{len(codes_without_core_info)}")
-    # Add "trad" and "simp" fields to each row
-    final_rows = []
-    simplified_hanzi = []
-    for code in rows:
+        num_without_core_info += 1
+        del remaining_codes[code]
+    print(f"Hanzi with neither meanings nor pinyin: {num_without_core_info}")
+
+    # Insert a row for each remaining hanzi into the database
+    create_hanzi_table(writer.cursor)
+    keys = ["hanzi", "trad", "simp", "hk_grade", "hsk", "radical_id", "strokes",
+            "usenet_freq", "pinyin", "jyutping", "meanings", "parts"]
+    hk_grades = data["kGradeLevel"]
+    radicals = data["kRSUnicode"]
+    stroke_counts = data["kTotalStrokes"]
+    usenet_freqs = data["kFrequency"]
+    jyutping = data["kCantonese"]
+    num_simplified_hanzi = 0
+    for code in remaining_codes:
         # Count simplified hanzi that are not also used as traditional ones
         if code in trad_variants and code not in simp_variants:
-            simplified_hanzi.append(code)
-        rows[code]["hanzi"] = chr(int(code[2:], 16))
-        if code in trad_variants:
-            trad_codes = map(lambda c: code_to_hanzi(c), trad_variants[code])
-            rows[code]["trad"] = "".join(trad_codes)
-        if code in simp_variants:
-            simp_codes = map(lambda c: code_to_hanzi(c), simp_variants[code])
-            rows[code]["simp"] = "".join(simp_codes)
-        # rows[code]["trad"] = chr(int(code[2:], 16))
-        # if code in simp_variants:
-        #     simp_codes = list(filter(lambda c: c != code, simp_variants[code]))
-        #     if len(simp_codes):
-        #         rows[code]["simp"] = \
-        #             "".join(map(lambda c: code_to_hanzi(c), simp_codes))
-        final_rows.append(rows[code])
+            num_simplified_hanzi += 1
+        trad = "".join(map(code_to_hanzi, trad_variants[code])) \
+            if code in trad_variants else None
+        simp = "".join(map(code_to_hanzi, simp_variants[code])) \
+            if code in simp_variants else None
+        hk_grade = int(hk_grades[code]) if code in hk_grades else None
+        # Second part is simplified version of radical, not needed
+        # because it's already included in the radicals table
+        radical_id = int(radicals[code].split(".")[0].split("'")[0]) \
+            if code in radicals else None
+        # Second value is preferred for TW, ignore it for now
+        strokes = int(stroke_counts[code].split(" ")[0]) \
+            if code in stroke_counts else None
+        usenet_freq = int(usenet_freqs[code]) if code in usenet_freqs else None
+        jyutping_list = ";".join(jyutping[code].split(" ")) \
+            if code in jyutping else None
+        writer.insert("hanzi", (code_to_hanzi(code), trad, simp, hk_grade, None,
+            radical_id, strokes, usenet_freq, pinyin.get(code), jyutping_list,
+            meanings.get(code), None), columns=keys)
     print(f"Hanzi only representing a simplified variant: "
-          f"{len(simplified_hanzi)}")
-    # Insert all rows into the database
+          f"{num_simplified_hanzi}")
     print(f"Number of hanzi to be inserted into the database: "
-          f"{len(final_rows)}")
-    create_hanzi_table(cursor)
-    keys = ["hanzi", "trad", "simp", "hk_grade", "hsk", "radical_id", "strokes",
-            "usenet_freq", "pinyin", "jyutping", "meanings", "parts"]
-    for row in final_rows:
-        values = [(row[key] if key in row else None) for key in keys]
-        qmarks = ", ".join(["?"] * len(keys))
-        cursor.execute(
-            f"INSERT INTO hanzi ({', '.join(keys)}) VALUES ({qmarks})", values)
+          f"{len(remaining_codes)}")
 
 
-def parse_hsk_characters(filename, cursor, verbose=False):
+hsk_hanzi_header_regex = re.compile(r"^(.*)字表")
+hsk_hanzi_regex = re.compile(r"^(\d+)[\t](.)$")
+
+
+def parse_hsk_characters(filename, writer, verbose=False):
     with open(filename, "r", encoding="utf8") as f:
         lines = f.readlines()
+    # Levels are assigned in memory and written to the database at once
+    hanzi_to_level = dict(writer.execute("SELECT hanzi, hsk FROM hanzi"))
+    assigned_levels = dict()
     num_entries = 0
     num_assigned = 0
     num_unmatched = 0
@@ -835,9 +1214,7 @@ def parse_hsk_characters(filename, cursor, verbose=False):
     num_duplicates_total = 0
     level = 0
     for i, line in enumerate(lines):
-        header_regex = re.compile(r"^(.*)字表")
-        entry_regex = re.compile(r"^(\d+)[\t](.)$")
-        header_match = header_regex.match(line)
+        header_match = hsk_hanzi_header_regex.match(line)
         if header_match is not None:
             # Skip the sections about handwriting
             if not header_match.group(1).endswith("级汉"):
@@ -864,7 +1241,7 @@ def parse_hsk_characters(filename, cursor, verbose=False):
                 print("Parsed    0 words for HSK level %s."
                     % ("7 - 9" if level == 7 else level), end="\r")
             continue
-        entry_match = entry_regex.match(line)
+        entry_match = hsk_hanzi_regex.match(line)
         if entry_match is None:
             continue
         if level == 0:
@@ -876,23 +1253,17 @@ def parse_hsk_characters(filename, cursor, verbose=False):
             print("Parsed %4s characters for HSK level %s."
                 % (num_entries, "7 - 9" if level == 7 else level), end="\r")
         # Check if this character exists in the database
-        cursor.execute("SELECT hsk FROM hanzi WHERE hanzi = ?", (char,))
-        rows = cursor.fetchall()
-        if len(rows) == 0:
+        if char not in hanzi_to_level:
             if verbose:
                 print("WARNING: Could not find database entry for hanzi '%s'"
                     % char)
             num_unmatched += 1
             continue
-        # if len(rows) > 1:
-        #     row_str = map(lambda row: f"(simp: {row[1]}, trad: {row[2]})", rows)
-        #     print("WARNING: More than a single row has been matched for hanzi "
-        #         f"{char}: {' | '.join(row_str)})")
         # Check if an HSK level is already assigned
-        row = rows[0]
-        if row[0] is not None:
+        assigned_level = hanzi_to_level[char]
+        if assigned_level is not None:
             if verbose:
-                if row[0] != level:
+                if assigned_level != level:
                     print("WARNING: Hanzi '%s' already has a different HSK "
                             "level assigned in the database" % char)
                 else:
@@ -901,9 +1272,10 @@ def parse_hsk_characters(filename, cursor, verbose=False):
             num_duplicates += 1
             continue
         num_assigned += 1
-        # Update HSK level in the database entry
-        cursor.execute(
-            f"UPDATE hanzi SET hsk = ? WHERE hanzi = ?", (level, char))
+        hanzi_to_level[char] = level
+        assigned_levels[char] = level
+    # Update HSK levels of all characters at once
+    writer.update_column("hanzi", "hsk", "hanzi", assigned_levels)
     if verbose:
         print("--------------------------------------------------------------------")
         print("HSK level 7-9: %s entries, %s assigned, %s unmatched, %s duplicates."
@@ -920,10 +1292,10 @@ def parse_hsk_characters(filename, cursor, verbose=False):
     print("--------------------------------------------------------------------")
 
 
-def parse_radicals(filename, cursor):
+def parse_radicals(filename, writer):
     with open(filename, "r", encoding="utf8") as f:
         lines = f.readlines()[1:]  # Skip header line
-    create_radicals_table(cursor)
+    create_radicals_table(writer.cursor)
     for line in lines:
         fields = line.split("\t")
         number = int(fields[0])
@@ -942,87 +1314,113 @@ def parse_radicals(filename, cursor):
         if simplified.startswith("(pr.") or len(simplified) == 0:
             simplified = None
         variants = ";".join(variants) if variants is not None else None
-        cursor.execute("""
-            INSERT INTO radicals VALUES (?, ?, ?, ?, ?, ?, ?, ?)""",
+        writer.insert("radicals",
             (number, radical, variants, pinyin, meaning, strokes,
             frequency, simplified))
 
 
-def parse_hanzi_strokes(filename, output_filepath, cursor):
-    """The file should be 'graphics.txt' from the Make Me a Hanzi project."""
-    data = dict()
-    discarded = []
-    with open(filename, "r", encoding="utf8") as f:
-        for i, line in enumerate(f):
-            print("Parsed stroke info for %d hanzi..." % i, end="\r")
-            line_data = json.loads(line)
-            hanzi = line_data["character"]
-            cursor.execute("SELECT hk_grade, hsk, usenet_freq FROM hanzi "
-                "WHERE hanzi = ?", hanzi)
-            row = cursor.fetchone()
-            if row is None:
-                # print("Couldn't find hanzi '%s' in the database." % hanzi)
-                continue
-            grade, hsk, freq = row
-            if grade is None and hsk is None and freq is None:
-                discarded.append(hanzi)
-                continue
-            strokes = line_data["strokes"]
-            medians = line_data["medians"]
-            data[hanzi] = []
-            for stroke, median_list in zip(strokes, medians):
-                data[hanzi].append({
-                    "stroke": stroke, "parts": [], "start": median_list[0] })
-        print("Parsed stroke info for %d hanzi... Done." % i)
-    print("Discarded stroke info for %s infrequent hanzi." % len(discarded))
-    print("Saving stroke data for %s hanzi." % len(data))
-    # print("Discarded hanzi:", "".join(discarded))
-    with open(output_filepath, "w", encoding="utf8") as f:
-        json.dump(data, f, sort_keys=True, ensure_ascii=False)
-
-
-def parse_hanzi_decompositions(filename, output_filepath, cursor):
-    """The file should be 'dictionary.txt' from the Make Me a Hanzi project."""
-    if not os.path.exists(output_filepath):
+# Ideographic description characters used in hanzi decompositions, the
+# question mark stands for an unknown part
+ids_chars = "⿰⿱⿲⿳⿴⿵⿶⿷⿸⿹⿺⿻"
+ids_qmark = "？"
+
+
+def parse_decomposition_tree(string, parts_list):
+    """Parse the decomposition tree at the start of given string, appending
+    all parts to given list. Return the tree (nested lists of parts) and the
+    number of characters it spans.
+    """
+    if string[0] not in ids_chars:
+        if string[0] != ids_qmark:
+            parts_list.append(string[0])
+        return string[0] if string[0] != ids_qmark else None, 1
+    subtree1, size1 = parse_decomposition_tree(string[1:], parts_list)
+    subtree2, size2 = parse_decomposition_tree(string[size1 + 1:], parts_list)
+    size3 = 0
+    subtree = [subtree1, subtree2]
+    if string[0] == "⿲" or string[0]== "⿳":
+        subtree3, size3 = \
+            parse_decomposition_tree(string[size1 + size2 + 1:], parts_list)
+        subtree.append(subtree3)
+    return subtree, size1 + size2 + size3 + 1
+
+
+def parse_hanzi_strokes(strokes_filename, decompositions_filename,
+                        output_filepath, writer):
+    """Parse strokes of hanzi from the first given file (should be
+    'graphics.txt' from the Make Me a Hanzi project) and their decompositions
+    into parts from the second one (should be 'dictionary.txt' from the same
+    project). Both files list hanzi in the same order, so they are streamed
+    together. The strokes are written to the stroke store once, the parts of
+    all hanzi are updated using given bulk writer in a single statement.
+
+    If no stroke file is given, strokes are taken from an existing stroke
+    store instead. If no decomposition file is given, strokes have no parts.
+    """
+    if strokes_filename is None and not os.path.exists(output_filepath):
         print("ERROR: File with previously parsed hanzi strokes is missing.")
         return
-    with open(output_filepath, "r", encoding="utf8") as f:
-        data = json.load(f)
-
-    ids_chars = "⿰⿱⿲⿳⿴⿵⿶⿷⿸⿹⿺⿻"
-    qmark = "？"
-
-    # Define a recursive helper function
-    def parse_decomp_tree(string, parts_list):
-        if string[0] not in ids_chars:
-            if string[0] != qmark:
-                parts_list.append(string[0])
-            return string[0] if string[0] != qmark else None, 1
-        subtree1, size1 = parse_decomp_tree(string[1:], parts_list)
-        subtree2, size2 = parse_decomp_tree(string[size1 + 1:], parts_list)
-        size3 = 0
-        subtree = [subtree1, subtree2]
-        if string[0] == "⿲" or string[0]== "⿳":
-            subtree3, size3 = \
-                parse_decomp_tree(string[size1 + size2 + 1:], parts_list)
-            subtree.append(subtree3)
-
-        return subtree, size1 + size2 + size3 + 1
- 
-    with open(filename, "r", encoding="utf8") as f:
-        for i, line in enumerate(f):
-            print("Parsed decomposition info for %d hanzi..." % i, end="\r")
-            line_data = json.loads(line)
-            hanzi = line_data["character"]
-            if hanzi not in data:
-                continue
-            decomp = line_data["decomposition"]
+    # Strokes are only stored for hanzi which are used frequently enough
+    cursor = writer.execute(
+        "SELECT hanzi, hk_grade, hsk, usenet_freq FROM hanzi")
+    hanzi_to_info = { hanzi: (grade, hsk, freq)
+                      for hanzi, grade, hsk, freq in cursor.fetchall() }
+
+    def iterate_strokes():
+        if strokes_filename is None:
+            for hanzi, strokes in read_stroke_store(output_filepath).items():
+                yield hanzi, [dict(stroke_info, parts=[])
+                              for stroke_info in json.loads(strokes)]
+            return
+        with open(strokes_filename, "r", encoding="utf8") as f:
+            for line in f:
+                line_data = json.loads(line)
+                yield line_data["character"], [
+                    { "stroke": stroke, "parts": [], "start": median_list[0] }
+                    for stroke, median_list
+                    in zip(line_data["strokes"], line_data["medians"])]
+
+    def iterate_decompositions():
+        if decompositions_filename is None:
+            return
+        with open(decompositions_filename, "r", encoding="utf8") as f:
+            for line in f:
+                yield json.loads(line)
+
+    decompositions = iterate_decompositions()
+    # Decompositions read ahead while looking for a hanzi (only needed if
+    # the files don't list hanzi in the same order)
+    skipped_decompositions = dict()
+
+    def find_decomposition(hanzi):
+        if hanzi in skipped_decompositions:
+            return skipped_decompositions.pop(hanzi)
+        for line_data in decompositions:
+            if line_data["character"] == hanzi:
+                return line_data
+            skipped_decompositions[line_data["character"]] = line_data
+        return None
+
+    hanzi_to_strokes = dict()
+    hanzi_to_parts = dict()
+    num_discarded = 0
+    num_parsed = 0
+    for hanzi, strokes in iterate_strokes():
+        print("Parsed stroke info for %d hanzi..." % num_parsed, end="\r")
+        num_parsed += 1
+        info = hanzi_to_info.get(hanzi)
+        if info is None:
+            continue
+        if info == (None, None, None):
+            num_discarded += 1
+            continue
+        decomposition = find_decomposition(hanzi)
+        if decomposition is not None:
             parts = []
-            tree, _ = parse_decomp_tree(decomp, parts)
-            cursor.execute("UPDATE hanzi SET parts = ? WHERE hanzi = ?",
-                ("".join(parts), hanzi))
-            matches = line_data["matches"]
-            for stroke_info, match in zip(data[hanzi], matches):
+            tree, _ = parse_decomposition_tree(
+                decomposition["decomposition"], parts)
+            hanzi_to_parts[hanzi] = "".join(parts)
+            for stroke_info, match in zip(strokes, decomposition["matches"]):
                 if match is None:
                     continue
                 subtree = tree
@@ -1031,9 +1429,64 @@ def parse_hanzi_decompositions(filename, output_filepath, cursor):
                 if subtree is None:
                     continue
                 stroke_info["parts"] = [subtree]
-        print("Parsed decomposition info for %d hanzi... Done." % i)
-    with open(output_filepath, "w", encoding="utf8") as f:
-        json.dump(data, f, sort_keys=True, ensure_ascii=False)
+        hanzi_to_strokes[hanzi] = json.dumps(
+            strokes, ensure_ascii=False, separators=(",", ":"))
+    print("Parsed stroke info for %d hanzi... Done." % num_parsed)
+    print("Discarded stroke info for %s infrequent hanzi." % num_discarded)
+    print("Saving stroke data for %s hanzi." % len(hanzi_to_strokes))
+    if decompositions_filename is not None:
+        print("Found decompositions for %s hanzi." % len(hanzi_to_parts))
+        writer.update_column("hanzi", "parts", "hanzi", hanzi_to_parts)
+    write_stroke_store(output_filepath, hanzi_to_strokes)
+
+
+def create_example_words_index(writer):
+    """Create a table mapping each hanzi to the dictionary entries containing
+    it (in simplified or traditional form or in one of its variants), ordered
+    by HSK level and frequency, in the database using given bulk writer.
+    """
+    cursor = writer.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'table' AND "
+        "(name = 'hanzi' OR name = 'dictionary')")
+    if len(cursor.fetchall()) != 2:
+        print("Dictionary and hanzi must both be parsed into the database to "
+              "create an index on example words for hanzi, skipping.")
+        return
+    print("Creating index for hanzi example words...", end="\r")
+    cursor = writer.execute("SELECT hanzi FROM hanzi")
+    hanzi_to_entries = { hanzi: [] for (hanzi,) in cursor.fetchall() }
+    # Single pass over all dictionary entries (in the order in which example
+    # words should be listed), appending each entry to the lists of the
+    # hanzi it contains
+    cursor = writer.execute("""
+        SELECT id, trad, simp, variants FROM dictionary
+        ORDER BY hsk IS NULL, hsk ASC,
+                 net_rank IS NULL, net_rank ASC,
+                 lcmc_rank IS NULL, lcmc_rank ASC, length(simp) ASC """)
+    for entry_id, trad, simp, variants in cursor.fetchall():
+        characters = set(trad) | set(simp)
+        if variants:
+            characters.update(variants)
+        for hanzi in characters:
+            if hanzi in hanzi_to_entries:
+                hanzi_to_entries[hanzi].append(entry_id)
+    writer.execute("DROP TABLE IF EXISTS example_words")
+    writer.execute("""
+        CREATE TABLE example_words (
+            hanzi TEXT,
+            position INTEGER,
+            id INTEGER,
+            PRIMARY KEY (hanzi, position)
+        ) WITHOUT ROWID""")
+    num_rows = 0
+    for hanzi, entry_ids in hanzi_to_entries.items():
+        for position, entry_id in enumerate(entry_ids):
+            writer.insert("example_words", (hanzi, position, entry_id))
+        num_rows += len(entry_ids)
+    writer.flush()
+    print("Creating index for hanzi example words... Done (%d rows)."
+          % num_rows)
+
 
 @dataclass
 class InputPaths:
@@ -1050,66 +1503,161 @@ class InputPaths:
     hsk_hanzi: str = None
 
 
-def generate_data(input_paths: InputPaths, output_path: str, verbose=False):
-    database_path = os.path.join(output_path, "Chinese-English.sqlite3")
-    hanzi_strokes_path = os.path.join(output_path, "hanzi-strokes.json")
-    connection = sqlite3.connect(database_path)
-    cursor = connection.cursor()
+def get_stages(input_paths: InputPaths, output_path: str, verbose=False,
+               jobs=1, legacy_strokes_json=False):
+    """Return the stages (see `Stage`) building the data from given input
+    files, with output files (other than the database) in given directory.
+    """
+    hanzi_strokes_path = os.path.join(output_path, "hanzi-strokes.sqlite3")
+    hanzi_strokes_json_path = os.path.join(output_path, "hanzi-strokes.json")
+    # Declare the stages of the build, each with the stages it depends on
+    stages = []
     if input_paths.dictionary is not None:
-        print("Parsing dictionary from file '%s':" % input_paths.dictionary)
-        parse_dictionary(input_paths.dictionary, cursor, verbose=verbose)
+        stages.append(Stage("dictionary",
+            functools.partial(parse_dictionary, input_paths.dictionary,
+                              verbose=verbose),
+            inputs=(input_paths.dictionary,),
+            description="Parsing dictionary from file '%s':"
+                        % input_paths.dictionary))
     if input_paths.hsk_vocab is not None:
-        print()
-        print("Parsing HSK word vocabulary lists from file '%s':"
-              % input_paths.hsk_vocab)
-        parse_hsk_vocabulary(input_paths.hsk_vocab, cursor, verbose=verbose)
+        stages.append(Stage("hsk-vocab",
+            functools.partial(parse_hsk_vocabulary, input_paths.hsk_vocab,
+                              verbose=verbose),
+            dependencies=("dictionary",), inputs=(input_paths.hsk_vocab,),
+            description="Parsing HSK word vocabulary lists from file '%s':"
+                        % input_paths.hsk_vocab))
     if input_paths.web_word_frequencies is not None:
-        print()
-        print("Parsing internet word frequencies from file '%s':"
-              % input_paths.web_word_frequencies)
-        parse_word_frequencies(
-            input_paths.web_word_frequencies, "web", cursor, verbose=verbose)
+        stages.append(Stage("web-frequencies",
+            functools.partial(parse_word_frequencies,
+                input_paths.web_word_frequencies, "web", verbose=verbose),
+            dependencies=("dictionary",),
+            inputs=(input_paths.web_word_frequencies,),
+            description="Parsing internet word frequencies from file '%s':"
+                        % input_paths.web_word_frequencies))
     if input_paths.lcmc_word_frequencies is not None:
-        print()
-        print("Parsing LCMC word frequencies from file '%s':"
-              % input_paths.lcmc_word_frequencies)
-        parse_word_frequencies(
-            input_paths.lcmc_word_frequencies, "lcmc", cursor, verbose=verbose)
+        stages.append(Stage("lcmc-frequencies",
+            functools.partial(parse_word_frequencies,
+                input_paths.lcmc_word_frequencies, "lcmc", verbose=verbose),
+            dependencies=("dictionary",),
+            inputs=(input_paths.lcmc_word_frequencies,),
+            description="Parsing LCMC word frequencies from file '%s':"
+                        % input_paths.lcmc_word_frequencies))
     if input_paths.hanzi is not None:
-        print()
-        print("Parsing hanzi from Unihan data in directory '%s':"
-              % input_paths.hanzi)
-        parse_hanzi(input_paths.hanzi, cursor, verbose=verbose)
+        stages.append(Stage("hanzi",
+            functools.partial(parse_hanzi, input_paths.hanzi,
+                              verbose=verbose, jobs=jobs),
+            inputs=(input_paths.hanzi,),
+            description="Parsing hanzi from Unihan data in directory '%s':"
+                        % input_paths.hanzi))
     if input_paths.hsk_hanzi is not None:
-        print()
-        print("Parsing HSK character lists from file '%s':"
-              % input_paths.hsk_hanzi)
-        parse_hsk_characters(input_paths.hsk_hanzi, cursor, verbose=verbose)
+        stages.append(Stage("hsk-hanzi",
+            functools.partial(parse_hsk_characters, input_paths.hsk_hanzi,
+                              verbose=verbose),
+            dependencies=("hanzi",), inputs=(input_paths.hsk_hanzi,),
+            description="Parsing HSK character lists from file '%s':"
+                        % input_paths.hsk_hanzi))
     if input_paths.hanzi_radicals is not None:
-        print()
-        print("Parsing radicals from file '%s'." % input_paths.hanzi_radicals)
-        parse_radicals(input_paths.hanzi_radicals, cursor)
-    if input_paths.hanzi_strokes is not None:
-        print()
-        print("Parsing SVG stroke sequences from file '%s':" %
-            input_paths.hanzi_strokes)
-        parse_hanzi_strokes(input_paths.hanzi_strokes,
-            hanzi_strokes_path, cursor)
-    if input_paths.hanzi_decomposition is not None:
-        print()
-        print("Parsing hanzi decompositions from file '%s':" %
-            input_paths.hanzi_decomposition)
-        parse_hanzi_decompositions(
-            input_paths.hanzi_decomposition, hanzi_strokes_path, cursor)
-    connection.commit()
+        stages.append(Stage("radicals",
+            functools.partial(parse_radicals, input_paths.hanzi_radicals),
+            inputs=(input_paths.hanzi_radicals,),
+            description="Parsing radicals from file '%s'."
+                        % input_paths.hanzi_radicals))
+    # Decompositions are stored in the hanzi table, strokes in a separate file
+    if (input_paths.hanzi_strokes is not None or
+            input_paths.hanzi_decomposition is not None):
+        descriptions = []
+        if input_paths.hanzi_strokes is not None:
+            descriptions.append("Parsing SVG stroke sequences from file '%s'."
+                                % input_paths.hanzi_strokes)
+        if input_paths.hanzi_decomposition is not None:
+            descriptions.append("Parsing hanzi decompositions from file '%s'."
+                                % input_paths.hanzi_decomposition)
+        stages.append(Stage("hanzi-strokes",
+            functools.partial(parse_hanzi_strokes, input_paths.hanzi_strokes,
+                input_paths.hanzi_decomposition, hanzi_strokes_path),
+            dependencies=("hanzi",),
+            inputs=(input_paths.hanzi_strokes,
+                    input_paths.hanzi_decomposition),
+            outputs=(hanzi_strokes_path,),
+            description="\n".join(descriptions)))
+        # Also store strokes in a single json file (for older program versions)
+        if legacy_strokes_json:
+            stages.append(Stage("hanzi-strokes-json",
+                functools.partial(write_legacy_strokes_json,
+                                  hanzi_strokes_path, hanzi_strokes_json_path),
+                dependencies=("hanzi-strokes",), uses_database=False,
+                outputs=(hanzi_strokes_json_path,)))
+    # Create reversed index for example words containing certain hanzi (the
+    # order of example words depends on HSK levels and frequencies as well)
+    if (input_paths.dictionary is not None or
+            input_paths.hsk_vocab is not None or
+            input_paths.web_word_frequencies is not None or
+            input_paths.lcmc_word_frequencies is not None or
+            input_paths.hanzi is not None):
+        stages.append(Stage("example-words", create_example_words_index,
+            dependencies=("dictionary", "hsk-vocab", "web-frequencies",
+                          "lcmc-frequencies", "hanzi")))
+    return stages
+
+
+def generate_data(input_paths: InputPaths, output_path: str, verbose=False,
+                  batch_size=DEFAULT_BATCH_SIZE, jobs=1,
+                  legacy_strokes_json=False, incremental=False, profile=False,
+                  trace_sql=None, build_path=None):
+    start_time = time.perf_counter()
+    database_path = os.path.join(output_path, "Chinese-English.sqlite3")
+    connection = sqlite3.connect(database_path, factory=TracingConnection
+                                 if trace_sql else sqlite3.Connection)
+    apply_build_pragmas(connection)
+    writer = BulkWriter(connection.cursor(), batch_size=batch_size)
+    stages = get_stages(input_paths, output_path, verbose=verbose,
+        jobs=jobs, legacy_strokes_json=legacy_strokes_json)
+    # Build state is kept out of the output directory
+    if build_path is None:
+        build_path = get_build_path(output_path)
+    stage_reports = run_stages(stages, writer, jobs=jobs,
+        incremental=incremental, build_path=build_path,
+        profile_path=os.path.join(build_path, BUILD_PROFILES_DIRNAME)
+                     if profile else None)
+    finishing_start_time = time.perf_counter()
+    # Precompute aggregates which the program needs at startup
+    write_content_stats(writer, {
+        "words_per_hsk_level":
+            "SELECT hsk, COUNT(*) FROM dictionary WHERE hsk IS NOT NULL "
+            "GROUP BY hsk",
+        "max_net_rank": "SELECT MAX(net_rank) FROM dictionary"
+    })
+    print()
+    finalize_database(connection)
     connection.close()
+    print()
+    writer.print_stats()
+    statement_stats = get_statement_stats(connection)
+    if statement_stats is not None:
+        print()
+        print_statement_stats(statement_stats, limit=trace_sql)
+    # Record timings and memory usage of all stages for analysis
+    write_build_report(os.path.join(build_path, BUILD_REPORT_FILENAME),
+        stage_reports, statement_stats=statement_stats,
+        jobs=jobs, incremental=incremental,
+        finishing_seconds=time.perf_counter() - finishing_start_time,
+        wall_seconds=time.perf_counter() - start_time,
+        database_size=os.path.getsize(database_path))
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(
             description="Parse data for language-pair Chinese->English.")
     parser.add_argument("--verbose", "-v", dest="verbose", action="store_true")
+    parser.add_argument("--batch-size", metavar="N", type=int,
+            dest="batch_size", default=DEFAULT_BATCH_SIZE,
+            help="Number of rows buffered per statement before writing them "
+                 "to the database")
     parser.add_argument("--output", "--out", "-o", metavar="FILENAME",
             dest="output_path", help="Directory path for output files")
+    parser.add_argument("--jobs", "-j", metavar="N", type=int,
+            dest="jobs", default=1,
+            help="Number of worker processes used for reading Unihan files "
+                 "and for running independent stages concurrently")
 
     parser.add_argument("--dictionary", "--dict", "--dic", "-d",
             metavar="FILENAME", dest="dictionary",
@@ -1138,9 +1686,42 @@ if __name__ == "__main__":
     parser.add_argument("--hsk-hanzi", metavar="FILENAME",
             dest="hsk_hanzi",
             help="Name of the plain text file containing HSK 3.0 characters")
+    parser.add_argument("--incremental", dest="incremental",
+            action="store_true",
+            help="Skip stages whose inputs and code haven't changed since the "
+                 "last build into the output directory (recorded in a build "
+                 "manifest in the build directory) and reuse their results")
+    parser.add_argument("--profile", dest="profile", action="store_true",
+            help="Run each stage under cProfile and store the statistics in "
+                 "a file per stage in the directory '%s' of the build "
+                 "directory" % BUILD_PROFILES_DIRNAME)
+    parser.add_argument("--build-dir", metavar="PATH", dest="build_path",
+            help="Directory for the build manifest, cached stage results and "
+                 "the build report (default: the directory with the name of "
+                 "the output directory in '%s' next to it)" % BUILD_DIRNAME)
+    parser.add_argument("--trace-sql", metavar="N", type=int, nargs="?",
+            const=20, dest="trace_sql",
+            help="Trace all SQL statements executed during the build and "
+                 "print the N statements which took the most time (20 by "
+                 "default). Stats of all statements are stored in the build "
+                 "report")
+    parser.add_argument("--legacy-strokes-json", dest="legacy_strokes_json",
+            action="store_true",
+            help="Also store hanzi strokes in a single json file (as read by "
+                 "older versions of the program)")
 
     input_paths = InputPaths()
     args = parser.parse_args(namespace=input_paths)
     output_path = args.output_path if args.output_path else "Chinese-English"
     verbose = args.verbose
-    generate_data(input_paths, output_path, verbose=verbose)
+    batch_size = args.batch_size
+    jobs = args.jobs
+    legacy_strokes_json = args.legacy_strokes_json
+    incremental = args.incremental
+    profile = args.profile
+    trace_sql = args.trace_sql
+    generate_data(input_paths, output_path, verbose=verbose,
+                  batch_size=batch_size, jobs=jobs,
+                  legacy_strokes_json=legacy_strokes_json,
+                  incremental=incremental, profile=profile,
+                  trace_sql=trace_sql, build_path=args.build_path)
@@ -10,9 +10,24 @@ import re
 import sqlite3
 import json
 import itertools
+import collections
+import multiprocessing
+import functools
+import time
 import xml.etree.ElementTree as ElementTree
 from dataclasses import dataclass
 
+from generate_utils import (format_throughput, apply_build_pragmas,
+                            write_stroke_store, write_legacy_strokes_json,
+                            encode_id_list, create_indices,
+                            finalize_database, write_content_stats,
+                            run_stages, Stage, write_build_report,
+                            BulkWriter, DEFAULT_BATCH_SIZE,
+                            TracingConnection, get_statement_stats,
+                            print_statement_stats,
+                            get_build_path, BUILD_REPORT_FILENAME,
+                            BUILD_PROFILES_DIRNAME, BUILD_DIRNAME)
+
 
 def create_dictionary_tables(cursor):
     """Create tables for dictionary in the database referenced by given cursor.
@@ -23,6 +38,7 @@ def create_dictionary_tables(cursor):
     cursor.execute("DROP TABLE IF EXISTS readings")
     cursor.execute("DROP TABLE IF EXISTS meanings")
     cursor.execute("DROP TABLE IF EXISTS translations")
+    cursor.execute("DROP TABLE IF EXISTS translations_fts")
     cursor.execute(
         """
         CREATE TABLE IF NOT EXISTS dictionary (
@@ -63,8 +79,8 @@ def create_dictionary_tables(cursor):
             readings_restricted_to TEXT
         )
         """)
-    # Translations table is only used for searching. consider deleting it,
-    # since indices are of no use for matching whole words (requires wildcards)
+    # Translations table is only used for searching with wildcards that the
+    # full-text index below can't handle (indices are of no use for those)
     cursor.execute(
         """
         CREATE TABLE IF NOT EXISTS translations (
@@ -74,6 +90,35 @@ def create_dictionary_tables(cursor):
         """)
 
 
+def create_translations_search_index(writer):
+    """Create a full-text search index over all translations in the database
+    using given bulk writer. Each translation is stored in a separate row
+    (together with the ID of its dictionary entry), so that all words of a
+    search query must be contained in the same translation. Prefix indices
+    speed up searching for words which have only been partially typed.
+    Column sizes are not stored since results are never ranked by relevance.
+    """
+    try:
+        writer.execute(
+            """
+            CREATE VIRTUAL TABLE translations_fts USING fts5 (
+                translation,
+                id UNINDEXED,
+                prefix = '2 3',
+                columnsize = 0
+            )
+            """)
+    except sqlite3.OperationalError as error:
+        print("Couldn't create full-text search index for translations (%s)."
+              % error)
+        return
+    writer.execute("INSERT INTO translations_fts (translation, id) "
+                   "SELECT translation, id FROM translations")
+    # Merge index segments into a single b-tree for faster lookups
+    writer.execute("INSERT INTO translations_fts (translations_fts) "
+                   "VALUES ('optimize')")
+
+
 def create_proper_names_table(cursor):
     """Create table for proper names in the database referenced by given cursor.
     Drop table first if it already exists.
@@ -130,37 +175,22 @@ def create_radicals_table(cursor):
 
 
 LANG_ATTR = "{http://www.w3.org/XML/1998/namespace}lang"
+KVG_ELEMENT_ATTR = "{http://kanjivg.tagaini.net}element"
 
 
-def parse_dictionary_entry(entry, cursor, text_to_code):
-    """ Parse dictionary entry given as an XML node.
-    Insert it into the database referenced by given cursor.
+def extract_dictionary_entry(entry):
+    """ Extract the data of a dictionary entry given as an XML node.
+    Return it as a tuple of plain values, so that it can be passed between
+    processes. Texts of <pos>, <field>, <misc> and <dial> elements are kept
+    as they are, mapping them to codes is done when inserting the entry.
     """
     ID = int(entry.find("ent_seq").text)
-    # Create function for getting the code for a text. Create a new
-    # code and register it if there's none for this text yet.
-    def get_code(text):
-        if text in text_to_code:
-            return text_to_code[text]
-        next_code = len(text_to_code)
-        # Two bytes with chars a-z should be enough for all texts (max of 676)
-        letter1 = chr(ord('a') + next_code // 26)
-        letter2 = chr(ord('a') + next_code % 26)
-        text_to_code[text] = letter1 + letter2
-        return letter1 + letter2
     # Create variables to store data parsed for this entry
-    # number = entry.find("ent_seq").text
     entry_news_rank = None  # Calculated as minimum of ranks of words/readings
     words = []
     commonness = None
-    readings = []
-    reading_restricted_to = dict()
-    meanings = []  # List of lists containing translations
-    meaning_restricted_to = []
-    part_of_speech = []
-    field_of_application = []
-    dialect = []
-    misc_info = []
+    readings = []  # List of (reading, kanji elements it's restricted to)
+    meanings = []  # List of tuples containing translations and meaning info
     # Parse kanji elements (i.e. words/expressions with kanji) for this entry
     for kanji_element in entry.findall("k_ele"):
         word = kanji_element.find("keb").text
@@ -179,7 +209,6 @@ def parse_dictionary_entry(entry, cursor, text_to_code):
     # Parse readings (the words/expressions in kana) for this entry
     for reading_element in entry.findall("r_ele"):
         reading = reading_element.find("reb").text
-        readings.append(reading)
         # Parse frequency tags for this reading element
         for freq_element in reading_element.findall("re_pri"):
             tag = freq_element.text
@@ -192,9 +221,9 @@ def parse_dictionary_entry(entry, cursor, text_to_code):
                 if entry_news_rank is None or rank < entry_news_rank:
                     entry_news_rank = rank
         # Get kanji elements which this reading is restricted to
-        reading_restricted_to[reading] = []
-        for restr_element in reading_element.findall("re_restr"):
-            reading_restricted_to[reading].append(restr_element.text)
+        restricted_to = [restr_element.text for restr_element
+                         in reading_element.findall("re_restr")]
+        readings.append((reading, restricted_to))
     # Parse meanings (in form of translations) and a information about them
     for sense_element in entry.findall("sense"):
         # NOTE: In newer versions of the dictionary, the translations for each
@@ -203,59 +232,74 @@ def parse_dictionary_entry(entry, cursor, text_to_code):
         glosses = sense_element.findall("gloss")
         if len(glosses) == 0 or glosses[0].attrib[LANG_ATTR] != "eng":
             continue
-        translations = []
-        part_of_speech.append([])
-        field_of_application.append([])
-        misc_info.append([])
-        dialect.append([])
-        meaning_restricted_to.append({ "words": [], "readings": [] })
-        # Get part of speech information for this meaning
-        for pos_element in sense_element.findall("pos"):
-            part_of_speech[-1].append(get_code(pos_element.text))
-        # Get field of application for this meaning
-        for field_element in sense_element.findall("field"):
-            field_of_application[-1].append(get_code(field_element.text))
-        # Get misc info for this meaning
-        for misc_element in sense_element.findall("misc"):
-            misc_info[-1].append(get_code(misc_element.text))
-        # Get dialect info for this meaning
-        for dial_element in sense_element.findall("dial"):
-            dialect[-1].append(get_code(dial_element.text))
-        # Get kanji elements this meaning is restricted to
-        for word_restr_element in sense_element.findall("stagk"):
-            meaning_restricted_to[-1]["words"].append(word_restr_element.text)
-        # Get reading elements this meaning is restricted to
-        for reading_restr_element in sense_element.findall("stagr"):
-            meaning_restricted_to[-1]["readings"].append(
-                    reading_restr_element.text)
-        # Get translations corresponding to this meaning
-        for gloss_element in glosses:
-            translations.append(gloss_element.text)
-        meanings.append(translations)
+        meanings.append((
+            # Translations corresponding to this meaning
+            [gloss_element.text for gloss_element in glosses],
+            # Part of speech information for this meaning
+            [element.text for element in sense_element.findall("pos")],
+            # Field of application for this meaning
+            [element.text for element in sense_element.findall("field")],
+            # Misc info for this meaning
+            [element.text for element in sense_element.findall("misc")],
+            # Dialect info for this meaning
+            [element.text for element in sense_element.findall("dial")],
+            # Kanji elements this meaning is restricted to
+            [element.text for element in sense_element.findall("stagk")],
+            # Reading elements this meaning is restricted to
+            [element.text for element in sense_element.findall("stagr")]))
+    return ID, words, entry_news_rank, commonness, readings, meanings
+
+
+def insert_dictionary_entry(entry_data, writer, text_to_code):
+    """ Insert dictionary entry data extracted by `extract_dictionary_entry`
+    into the database using given bulk writer.
+    """
+    ID, words, entry_news_rank, commonness, readings, meanings = entry_data
+    # Create function for getting the code for a text. Create a new
+    # code and register it if there's none for this text yet.
+    def get_code(text):
+        if text in text_to_code:
+            return text_to_code[text]
+        next_code = len(text_to_code)
+        # Two bytes with chars a-z should be enough for all texts (max of 676)
+        letter1 = chr(ord('a') + next_code // 26)
+        letter2 = chr(ord('a') + next_code % 26)
+        text_to_code[text] = letter1 + letter2
+        return letter1 + letter2
     # Insert entry into the database
-    cursor.execute("INSERT INTO dictionary VALUES (?, ?, ?, ?, ?, ?, ?)",
+    writer.insert("dictionary",
         (ID, ";".join(words), None, entry_news_rank, None, None, commonness))
     for word in words:
-        cursor.execute("INSERT INTO words (id, word) VALUES (?, ?)", (ID, word))
-    for reading in readings:
-        cursor.execute("INSERT INTO readings VALUES (?, ?, ?)",
-                (ID, reading, ";".join(reading_restricted_to[reading])))
-    for translations, pos, field, misc, dial, restricted_to in zip(
-            meanings, part_of_speech, field_of_application, misc_info,
-            dialect, meaning_restricted_to):
-        cursor.execute("INSERT INTO meanings VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+        writer.insert("words", (ID, word), columns=("id", "word"))
+    for reading, restricted_to in readings:
+        writer.insert("readings", (ID, reading, ";".join(restricted_to)))
+    for (translations, pos, field, misc, dial,
+            words_restricted_to, readings_restricted_to) in meanings:
+        # Codes are assigned in order of first occurrence, keep it that way
+        pos = [get_code(text) for text in pos]
+        field = [get_code(text) for text in field]
+        misc = [get_code(text) for text in misc]
+        dial = [get_code(text) for text in dial]
+        writer.insert("meanings",
                 (ID, ";".join(translations), ";".join(pos), ";".join(field),
                  ";".join(misc), ";".join(dial),
-                 ";".join(restricted_to["words"]),
-                 ";".join(restricted_to["readings"])))
+                 ";".join(words_restricted_to),
+                 ";".join(readings_restricted_to)))
         for translation in translations:
-            cursor.execute("INSERT INTO translations VALUES (?, ?)",
-                (ID, translation))
+            writer.insert("translations", (ID, translation))
 
 
-def parse_kanji_entry(line, cursor):
+def parse_dictionary_entry(entry, writer, text_to_code):
+    """ Parse dictionary entry given as an XML node.
+    Insert it into the database using given bulk writer.
+    """
+    insert_dictionary_entry(
+        extract_dictionary_entry(entry), writer, text_to_code)
+
+
+def parse_kanji_entry(line, writer):
     """ Parse kanji entry given as string with space-separated information.
-    Insert it into the database referenced by given cursor.
+    Insert it into the database using given bulk writer.
     """
     fields = line.split() 
     # Parse line
@@ -288,11 +332,7 @@ def parse_kanji_entry(line, cursor):
         elif field == "T1" or field[0] == "{":
             break
     # Insert entry into database
-    cursor.execute("""
-            INSERT INTO kanji (entry, grade, jlpt, radical_id, strokes,
-            frequency, on_yomi, kun_yomi, meanings, on_yomi_search,
-            kun_yomi_search, meanings_search, parts)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+    writer.insert("kanji",
         (data["kanji"], data["grade"], data["jlpt"], data["radical_id"],
          data["strokes"], data["frequency"],
          ";".join(data["on-yomi"]),
@@ -300,12 +340,16 @@ def parse_kanji_entry(line, cursor):
          ";".join(data["meanings"]),
          ";".join(data["on-yomi-search"]),
          ";".join(data["kun-yomi-search"]),
-         ";".join(data["meanings-search"]), ""))
+         ";".join(data["meanings-search"]), ""),
+        columns=("entry", "grade", "jlpt", "radical_id", "strokes",
+                 "frequency", "on_yomi", "kun_yomi", "meanings",
+                 "on_yomi_search", "kun_yomi_search", "meanings_search",
+                 "parts"))
 
 
-def parse_radical_entry(line, cursor):
+def parse_radical_entry(line, writer):
     """ Parse radical entry given as string with space-separated information.
-    Insert it into the database referenced by given cursor.
+    Insert it into the database using given bulk writer.
     """
     fields = re.findall(
         r"(.) \[(.+?)\] B(\d+?) S(\d+?) N\((.*?)\)\w?(.*)\n",
@@ -317,45 +361,150 @@ def parse_radical_entry(line, cursor):
     name = fields[4]
     details = fields[5].strip()
     # Insert entry into database
-    cursor.execute("INSERT INTO radicals VALUES (?, ?, ?, ?, ?, ?, ?)",
+    writer.insert("radicals",
         (radical_id, radical, ", ".join(readings), name, strokes,
          None, details))
 
 
-def parse_kanji_strokes_entry(entry, data_object):
-    if "{http://kanjivg.tagaini.net}element" not in entry[0].attrib:
-        return
-    kanji = entry[0].attrib["{http://kanjivg.tagaini.net}element"]
+def parse_kanji_strokes_entry(entry):
+    """Parse the strokes of a kanji given as XML node (from KanjiVG).
+    Return the kanji and a list containing the path of each stroke along
+    with the elements which the stroke is part of, or None if the node
+    doesn't belong to a kanji.
+    """
+    if len(entry) == 0 or KVG_ELEMENT_ATTR not in entry[0].attrib:
+        return None
+    kanji = entry[0].attrib[KVG_ELEMENT_ATTR]
     # TODO: Only take kanji that are registered in the database?
-    data_object[kanji] = []
-    # Do a depth first search over the element subtree. For each stroke,
-    # store a list of subelements which the stroke is part of
+    strokes = []
+    # Do an (iterative) depth first search over the element subtree. For each
+    # stroke, store a list of subelements which the stroke is part of
     elements = []
-    def dfs_recursive(node):
-        if "{http://kanjivg.tagaini.net}element" in node.attrib:
-            elements.append(node.attrib["{http://kanjivg.tagaini.net}element"])
-        if node.tag == "path":
-            data_object[kanji].append(
-                    { "stroke": node.attrib["d"], "parts": "".join(elements) })
-        for child_node in list(node):
-            dfs_recursive(child_node)
-        if "{http://kanjivg.tagaini.net}element" in node.attrib:
+    stack = [(entry, False)]
+    while stack:
+        node, finished = stack.pop()
+        if finished:
             del elements[-1]
-    dfs_recursive(entry)
-    # for stroke_element in entry.iter("path"):
-    #     data_object[kanji].append(stroke_element.attrib["d"])
+            continue
+        if KVG_ELEMENT_ATTR in node.attrib:
+            elements.append(node.attrib[KVG_ELEMENT_ATTR])
+            # Remove element again once all child nodes have been visited
+            stack.append((node, True))
+        if node.tag == "path":
+            strokes.append({ "stroke": node.attrib["d"],
+                             "parts": "".join(elements) })
+        stack.extend((child_node, False) for child_node in reversed(node))
+    return kanji, strokes
 
 
-def parse_kanji_parts_entry(line, cursor):
+def parse_kanji_parts_entry(line, writer):
     kanji = line[0]
     parts = "".join([s.strip() for s in sorted(line[4:].split(" ")) if len(s)])
-    cursor.execute(
+    writer.update(
             "UPDATE kanji SET parts = ? WHERE entry = ?", (parts, kanji))
 
 
-def parse_dictionary(filename, cursor, code_to_text_output_path):
+def iterate_dictionary_entries(filename):
+    """Incrementally parse given dictionary file and yield each <entry> element
+    as soon as it has been closed, together with the percentage of the file
+    read so far. Yielded elements are freed afterwards, so memory usage stays
+    flat regardless of the size of the dictionary.
+    """
+    file_size = os.path.getsize(filename)
+    with open(filename, "rb") as f:
+        context = ElementTree.iterparse(f, events=("start", "end"))
+        _, root = next(context)
+        for event, element in context:
+            if event != "end" or element.tag != "entry":
+                continue
+            yield element, (f.tell() / file_size) * 100
+            # Entries are direct children of the root, drop the finished one
+            root.clear()
+
+
+def iterate_dictionary_chunks(filename, chunk_size):
+    """Split given dictionary file into raw chunks of (at most) given number
+    of <entry> elements without parsing it. Yield each chunk as bytes,
+    together with the percentage of the file read so far. The file header
+    (XML declaration and DTD with the entity definitions) is returned
+    separately as first item, so that chunks can be parsed on their own.
+    """
+    file_size = os.path.getsize(filename)
+    with open(filename, "rb") as f:
+        header = []
+        for line in f:
+            if line.strip() == b"<JMdict>":
+                break
+            header.append(line)
+        else:
+            raise ValueError("Couldn't find <JMdict> element in '%s'."
+                             % filename)
+        yield b"".join(header)
+        lines = []
+        num_entries = 0
+        for line in f:
+            stripped_line = line.strip()
+            if stripped_line == b"</JMdict>":
+                break
+            lines.append(line)
+            if stripped_line == b"</entry>":
+                num_entries += 1
+                if num_entries == chunk_size:
+                    yield b"".join(lines), (f.tell() / file_size) * 100
+                    lines = []
+                    num_entries = 0
+        if num_entries > 0:
+            yield b"".join(lines), 100
+
+
+dictionary_header = None
+
+
+def init_dictionary_worker(header):
+    """Store dictionary file header in a worker process (used as pool
+    initializer, so the header isn't sent along with every chunk).
+    """
+    global dictionary_header
+    dictionary_header = header
+
+
+def parse_dictionary_chunk(chunk):
+    """Parse a raw chunk of dictionary entries in a worker process and
+    return the extracted data for each entry (in the original order).
+    """
+    root = ElementTree.fromstring(
+        dictionary_header + b"<JMdict>" + chunk + b"</JMdict>")
+    return [extract_dictionary_entry(entry) for entry in root]
+
+
+def iterate_dictionary_entries_parallel(filename, jobs, chunk_size=1000):
+    """Parse given dictionary file using given number of worker processes.
+    Yield the extracted data for each entry in the same order as in the
+    file, together with the percentage of the file read so far. At most a
+    few chunks per worker are kept in flight to limit memory usage.
+    """
+    chunks = iterate_dictionary_chunks(filename, chunk_size)
+    header = next(chunks)
+    pending = collections.deque()
+    with multiprocessing.Pool(jobs, initializer=init_dictionary_worker,
+                              initargs=(header,)) as pool:
+        for chunk, perc in chunks:
+            pending.append(
+                (pool.apply_async(parse_dictionary_chunk, (chunk,)), perc))
+            if len(pending) >= 2 * jobs:
+                result, perc = pending.popleft()
+                for entry_data in result.get():
+                    yield entry_data, perc
+        while pending:
+            result, perc = pending.popleft()
+            for entry_data in result.get():
+                yield entry_data, perc
+
+
+def parse_dictionary(filename, writer, code_to_text_output_path,
+                     streaming=True, jobs=1):
     """Parse given dictionary file (should be called 'JMdict.xml') and insert
-    dictionary entries into database referenced by given cursor.
+    dictionary entries into database using given bulk writer.
 
     Map content of <pos>, <field>, <misc> and <dial> elements to two-letter
     codes which will be mapped back to texts again in the trainer.
@@ -363,24 +512,56 @@ def parse_dictionary(filename, cursor, code_to_text_output_path):
         --> Allows using custom mapping from codes to texts
     Use given mapping from texts to improve texts, to output a mapping from
     codes to improved texts.
+
+    If streaming is set to false, the whole XML tree is loaded into memory
+    before inserting entries (old behaviour, needs a few GB for JMdict).
+    If more than one job is given, entries are parsed by that many worker
+    processes while this process inserts them in their original order, so
+    codes are assigned exactly as in a serial run.
     """
-    print("Parsing dictionary xml-file...", end="\r")
-    tree = ElementTree.parse(filename)
-    root = tree.getroot()
-    print("Parsing dictionary xml-file... Done. Found %d entries" % len(root))
+    start_time = time.perf_counter()
+    if not streaming:
+        print("Parsing dictionary xml-file...", end="\r")
+        tree = ElementTree.parse(filename)
+        root = tree.getroot()
+        print("Parsing dictionary xml-file... Done. Found %d entries" % len(root))
 
     print("Creating tables for dictionary...", end="\r")
-    create_dictionary_tables(cursor)
+    create_dictionary_tables(writer.cursor)
     print("Creating tables for dictionary... Done.")
 
     text_to_code = dict()
 
     print("Inserting dict entries into database... 0%", end="\r")
-    for i, entry in enumerate(root):
-        parse_dictionary_entry(entry, cursor, text_to_code)
-        perc = ((i + 1) / len(root)) * 100
-        print("Inserting dict entries into database... %d%%" % perc, end="\r")
+    num_entries = 0
+    if jobs > 1:
+        for entry_data, perc in iterate_dictionary_entries_parallel(
+                filename, jobs):
+            insert_dictionary_entry(entry_data, writer, text_to_code)
+            num_entries += 1
+            print("Inserting dict entries into database... %d%%" % perc,
+                  end="\r")
+    elif streaming:
+        for entry, perc in iterate_dictionary_entries(filename):
+            parse_dictionary_entry(entry, writer, text_to_code)
+            num_entries += 1
+            print("Inserting dict entries into database... %d%%" % perc,
+                  end="\r")
+    else:
+        for i, entry in enumerate(root):
+            parse_dictionary_entry(entry, writer, text_to_code)
+            num_entries += 1
+            perc = ((i + 1) / len(root)) * 100
+            print("Inserting dict entries into database... %d%%" % perc,
+                  end="\r")
+    writer.flush()
     print("Inserting dict entries into database... 100%")
+    print("Parsed %s." % format_throughput(
+        num_entries, time.perf_counter() - start_time))
+
+    print("Creating full-text search index for translations...", end="\r")
+    create_translations_search_index(writer)
+    print("Creating full-text search index for translations... Done.")
 
     print("Creating json file containing code-to-text mapping...", end="\r")
     code_to_text = dict()
@@ -421,8 +602,60 @@ def parse_improved_dictionary_texts(code_to_text_path, improved_texts_path, verb
     print("Done.")
 
 
-def parse_jlpt_vocabulary(filename, level, cursor, verbose=False,
+@dataclass
+class JlptMatchingData:
+    """Lookup tables used for matching JLPT vocabulary to dictionary entries.
+    Lists of entry IDs are kept in database order, so that candidates are
+    collected in the same order as when querying the database for them.
+    """
+    word_to_ids: dict
+    reading_to_ids: dict
+    id_to_words: dict
+    id_to_readings: dict
+    id_to_translations: dict
+    jlpt_levels: dict  # Maps entry IDs to assigned JLPT levels
+
+
+def load_jlpt_matching_data(writer):
+    """Load words, readings and translations of all dictionary entries from
+    the database using given bulk writer, as well as already assigned levels.
+    """
+    print("Loading dictionary data for matching JLPT vocabulary...", end="\r")
+    data = JlptMatchingData(dict(), dict(), dict(), dict(), dict(), dict())
+    cursor = writer.execute("SELECT id, word FROM words ORDER BY rowid")
+    for entry_id, word in cursor:
+        data.word_to_ids.setdefault(word, []).append(entry_id)
+        data.id_to_words.setdefault(entry_id, []).append(word)
+    cursor = writer.execute("SELECT id, reading FROM readings ORDER BY rowid")
+    for entry_id, reading in cursor:
+        data.reading_to_ids.setdefault(reading, []).append(entry_id)
+        data.id_to_readings.setdefault(entry_id, []).append(reading)
+    cursor = writer.execute(
+        "SELECT id, translations FROM meanings ORDER BY rowid")
+    for entry_id, translations in cursor:
+        data.id_to_translations.setdefault(entry_id, []).append(translations)
+    cursor = writer.execute("SELECT id, jlpt_level FROM dictionary "
+                            "WHERE jlpt_level IS NOT NULL")
+    data.jlpt_levels.update(cursor)
+    print("Loading dictionary data for matching JLPT vocabulary... Done.")
+    return data
+
+
+def write_jlpt_levels(data, writer):
+    """Write JLPT levels assigned in given matching data to the database
+    using given bulk writer.
+    """
+    for entry_id, level in data.jlpt_levels.items():
+        writer.update("UPDATE dictionary SET jlpt_level = ? WHERE id = ?",
+                      (level, entry_id))
+    writer.flush()
+
+
+def parse_jlpt_vocabulary(filename, level, data, verbose=False,
                           show_candidates_of_ambigous_entries=False):
+    """Match vocabulary in given JLPT vocabulary file to dictionary entries
+    and assign given level to them in given JLPT matching data.
+    """
     num_unique_matches = 0
     num_resolved_matches = 0
     num_ambiguous_matches = 0
@@ -436,6 +669,18 @@ def parse_jlpt_vocabulary(filename, level, cursor, verbose=False,
         tsl = re.sub(r"\s\s", "", tsl).strip() # Collapse whitespace, trim sides
         return tsl
 
+    # Cache preprocessed translations, entries are often candidates repeatedly
+    id_to_known_meanings = dict()
+
+    def get_known_meanings(entry_id):
+        known_meanings = id_to_known_meanings.get(entry_id)
+        if known_meanings is None:
+            known_meanings = set(map(preprocess, itertools.chain(*map(
+                lambda translations: translations.split(";"),
+                data.id_to_translations.get(entry_id, [])))))
+            id_to_known_meanings[entry_id] = known_meanings
+        return known_meanings
+
     with open(filename, encoding="utf-8") as f:
         for n, line in enumerate(f):
             # Each line at least contains a word and comma-separated meanings,
@@ -462,24 +707,15 @@ def parse_jlpt_vocabulary(filename, level, cursor, verbose=False,
             if word == reading:
                 reading = ""
             # If word contains kanji, search in words-table, else in readings
-            word_type = "word" if reading else "reading"
-            cursor.execute("SELECT id FROM %ss WHERE %s = ?"
-                           % (word_type, word_type), (word,))
-            for row in cursor.fetchall():
-                candidate_ids.add(row[0])
+            key_to_ids = data.word_to_ids if reading else data.reading_to_ids
+            candidate_ids.update(key_to_ids.get(word, []))
             if word2:
-                cursor.execute("SELECT id FROM %ss WHERE %s = ?"
-                               % (word_type, word_type), (word2,))
-                for row in cursor.fetchall():
-                    candidate_ids.add(row[0])
+                candidate_ids.update(key_to_ids.get(word2, []))
             matched_id = None
             # If there's no match and word ends with と/に/な, remove and retry
             if len(candidate_ids) == 0 and (word.endswith("と") or
                     word.endswith("に") or word.endswith("な")):
-                cursor.execute("SELECT id FROM %ss WHERE %s = ?"
-                               % (word_type, word_type), (word[:-1],))
-                for row in cursor.fetchall():
-                    candidate_ids.add(row[0])
+                candidate_ids.update(key_to_ids.get(word[:-1], []))
             # Skip the word if there's no matching dictionary entry
             if len(candidate_ids) == 0:
                 if verbose:
@@ -499,10 +735,7 @@ def parse_jlpt_vocabulary(filename, level, cursor, verbose=False,
                 second_best_match_score = 0
                 candidate_ids_copy = candidate_ids.copy()
                 for entry_id in candidate_ids_copy:
-                    cursor.execute("SELECT reading FROM readings WHERE id = ?",
-                                   (entry_id,))
-                    known_readings = \
-                        set(map(lambda row: row[0], cursor.fetchall()))
+                    known_readings = set(data.id_to_readings.get(entry_id, []))
                     if reading in known_readings and reading2 in known_readings:
                         second_best_match_score = best_match_score
                         best_match_score = 2
@@ -530,10 +763,7 @@ def parse_jlpt_vocabulary(filename, level, cursor, verbose=False,
                 given_meanings = set(map(lambda tsl: preprocess(tsl.strip()),
                         match.group("meanings").split(",")))
                 for entry_id in candidate_ids:
-                    cursor.execute("SELECT translations FROM meanings "
-                                   "WHERE id = ?", (entry_id,))
-                    known_meanings = set(map(preprocess, itertools.chain(*map(
-                            lambda row: row[0].split(";"), cursor.fetchall()))))
+                    known_meanings = get_known_meanings(entry_id)
                     num_matched_meanings = len(known_meanings & given_meanings)
                     if num_matched_meanings >= best_match_score:
                         second_best_match_score = best_match_score
@@ -561,27 +791,19 @@ def parse_jlpt_vocabulary(filename, level, cursor, verbose=False,
                 print("Candidates for %s | %s | %s" % (", ".join(given_words),
                     ", ".join(given_readings), ", ".join(given_meanings)))
                 for index, entry_id in enumerate(candidate_ids):
-                    cursor.execute("SELECT word FROM words WHERE id = ?",
-                                   (entry_id,))
-                    words = map(lambda row: row[0], cursor.fetchall())
-                    cursor.execute("SELECT reading FROM readings WHERE id = ?",
-                                   (entry_id,))
-                    readings = map(lambda row: row[0], cursor.fetchall())
+                    words = data.id_to_words.get(entry_id, [])
+                    readings = data.id_to_readings.get(entry_id, [])
                     print("  %s. %s: %s | %s" % (index + 1,
                             entry_id, ", ".join(words), ", ".join(readings)))
-                    cursor.execute("SELECT translations FROM meanings "
-                                   "WHERE id = ?", (entry_id,))
-                    meanings = \
-                        map(lambda row: row[0].split(";"), cursor.fetchall())
+                    meanings = map(lambda translations: translations.split(";"),
+                                   data.id_to_translations.get(entry_id, []))
                     for translations in meanings:
                         print("    - %s" % "; ".join(translations))
                 input()  # Pause script
             if matched_id is None:
                 continue
             # Check if matched dictionary entry already has assigned JLPT level
-            cursor.execute("SELECT jlpt_level FROM dictionary WHERE id = ?",
-                           (matched_id,))
-            assigned_level = cursor.fetchone()[0]
+            assigned_level = data.jlpt_levels.get(matched_id)
             if assigned_level is not None:
                 if verbose:
                     print("WARNING: dictionary entry with id '%s' already has "
@@ -592,8 +814,7 @@ def parse_jlpt_vocabulary(filename, level, cursor, verbose=False,
                 num_duplicates += 1
                 continue
             # Otherwise finally assign level to the matched dictionary entry
-            cursor.execute("UPDATE dictionary SET jlpt_level = ? WHERE id = ?",
-                           (level, matched_id))
+            data.jlpt_levels[matched_id] = level
             print(n+1, "JLPT N%s vocabulary items parsed...\r" % level, end="")
 
         print("Finished parsing", n + 1, "JLPT N%s vocabulary items." % level)
@@ -606,22 +827,39 @@ def parse_jlpt_vocabulary(filename, level, cursor, verbose=False,
             print("  Number of unmatched entries:", num_zero_matches)
 
 
-def process_manual_jlpt_assignments(filename, cursor):
+def process_manual_jlpt_assignments(filename, data):
     print("Processing manual JLPT level assignments...", end="\r")
     with open(filename, encoding="utf-8") as f:
         assignments = json.load(f)
     for level in assignments:
         for entry_id in assignments[level]:
-            cursor.execute("UPDATE dictionary SET jlpt_level = ? WHERE id = ?",
-                           (int(level), entry_id))
+            data.jlpt_levels[entry_id] = int(level)
     print("Processing manual JLPT level assignments... Done.")
 
 
-def parse_proper_names(filename, cursor):
+def parse_jlpt_vocabulary_lists(filenames, writer):
+    """Assign JLPT levels to dictionary entries using the vocabulary lists with
+    given filenames (for levels N5 to N1, followed by the JSON file containing
+    manual assignments) and write them to the database using given writer.
+    """
+    jlpt_matching_data = load_jlpt_matching_data(writer)
+    for level in range(5, 0, -1):
+        print()
+        print("Parsing JLPT N%s vocabulary from file '%s':"
+              % (level, filenames[5 - level]))
+        parse_jlpt_vocabulary(filenames[5 - level], level, jlpt_matching_data)
+    print()
+    process_manual_jlpt_assignments(filenames[5], jlpt_matching_data)
+    print("Writing JLPT levels into database...", end="\r")
+    write_jlpt_levels(jlpt_matching_data, writer)
+    print("Writing JLPT levels into database... Done.")
+
+
+def parse_proper_names(filename, writer):
     """ Parse proper name dictionary file with given filename (should be
-    'enamdict') into database referenced by given cursor.
+    'enamdict') into database using given bulk writer.
     """
-    create_proper_names_table(cursor)
+    create_proper_names_table(writer.cursor)
     known_tags = {
         "s": "surname",
         "u": "person name, as-yet unclassified",
@@ -678,32 +916,31 @@ def parse_proper_names(filename, cursor):
                         translation_string = \
                                 translation_string.replace(", abbr", "")
                 translations.append(translation_string.strip())
-            cursor.execute("""
-                INSERT INTO proper_names (id, name, tags, reading, translations)
-                VALUES (?, ?, ?, ?, ?) """, 
-                (count, name, ";".join(tags), reading, ";".join(translations)))
+            writer.insert("proper_names",
+                (count, name, ";".join(tags), reading, ";".join(translations)),
+                columns=("id", "name", "tags", "reading", "translations"))
             print(count + 1, "proper names parsed...\r", end="")
         print("Finished parsing", count + 1, "proper names.")
 
 
-def match_word_to_dictionary_entry(word, cursor):
+def match_word_to_dictionary_entry(word, writer):
     """Return the ids of the dictionary entries which match given word in
-    the database referenced by given cursor.
+    the database written by given bulk writer.
     """
-    cursor.execute("""SELECT id FROM words WHERE word LIKE '%s' UNION
-                      SELECT id FROM readings WHERE reading LIKE '%s'"""
-                      % (word, word))
+    cursor = writer.execute(
+        """SELECT id FROM words WHERE word LIKE '%s' UNION
+           SELECT id FROM readings WHERE reading LIKE '%s'""" % (word, word))
     return cursor.fetchall()
 
 
-def parse_word_web_frequencies(filename, cursor):
+def parse_word_web_frequencies(filename, writer):
     pass
 
 
-def parse_word_news_frequencies(filename, cursor):
+def parse_word_news_frequencies(filename, writer):
     """Parse newspaper word frequency file with given filename (should be
     called something like 'wordfreq.txt') and insert values into database
-    referenced by given cursor.
+    using given bulk writer.
     """
     with open(filename, encoding="euc_jp") as f:
         total_count = int(re.findall(r"\d+", f.readline())[0])
@@ -717,94 +954,133 @@ def parse_word_news_frequencies(filename, cursor):
             pos_id = int(pos_id)
             if frequency <= 5:
                 break
-            entry_matches = match_word_to_dictionary_entry(word, cursor)
+            entry_matches = match_word_to_dictionary_entry(word, writer)
             # cursor.execute("UPDATE words SET news_freq = ? WHERE word = ?",
             #                (frequency, word))
             print(count + 1, "newspaper word frequencies parsed...\r", end="")
         print("Finished parsing", count + 1, "newspaper word frequencies.")
 
 
-def parse_word_book_frequencies(filename, cursor):
+def parse_word_book_frequencies(filename, writer):
     """Parse book word frequencies from the JSON file generated based on
     frequency values from the BCCWJ dataset and insert them into the
-    database references by given cursor.
+    database using given bulk writer.
     """
     with open(filename, encoding="utf-8") as f:
         for index, line in enumerate(f):
             entry_id, frequency = line.split("\t")
-            cursor.execute("UPDATE dictionary SET book_rank = ? WHERE id = ?",
-                           (index + 1, entry_id))
+            writer.update("UPDATE dictionary SET book_rank = ? WHERE id = ?",
+                          (index + 1, entry_id))
 
 
-def parse_word_bccwj_frequencies(filename, cursor):
+def parse_word_bccwj_frequencies(filename, writer):
     pass
 
 
-def parse_kanji(filename, cursor):
+def parse_kanji(filename, writer):
     """Parse given kanji file (should be called 'kanjidic.txt') and insert
-    kanji entries into database referenced by given cursor.
+    kanji entries into database using given bulk writer.
     """
     print("Creating tables for kanji...", end="\r")
-    create_kanji_tables(cursor)
+    create_kanji_tables(writer.cursor)
     print("Creating tables for kanji... Done.")
 
     print("Beginning to parse kanji.")
     with open(filename, encoding="euc_jp") as f:
         next(f)
         for count, line in enumerate(f):
-            parse_kanji_entry(line, cursor)
+            parse_kanji_entry(line, writer)
             print(count + 1, "Kanji parsed...\r", end="")
         print("Finished parsing", count + 1, "Kanji.")
 
 
-def parse_radicals(filename, cursor):
+def parse_radicals(filename, writer):
     """Parse given radicals file (should be called 'radical.utf8.txt')
-    and insert radical entries into database referenced by given cursor.
+    and insert radical entries into database using given bulk writer.
     """
     print("Creating table for radicals...", end="\r")
-    create_radicals_table(cursor)
+    create_radicals_table(writer.cursor)
     print("Creating table for radicals... Done.")
 
     print("Beginning to parse radicals.")
     with open(filename, encoding="utf-8") as f:
         next(f)
         for count, line in enumerate(f):
-            parse_radical_entry(line, cursor)
+            parse_radical_entry(line, writer)
             print(count, "radicals parsed...\r", end="")
         print("Finished parsing", count, "radicals.")
 
 
-def parse_improved_kanji_meanings(filename, cursor):
+def parse_improved_kanji_meanings(filename, writer):
     """Parse json file with given filename containing improved kanji meanings.
-    Apply changes from that file to database referenced by given cursor.
+    Apply changes from that file to database using given bulk writer.
     """
     print("Applying improved kanji meanings...", end="\r")
+    cursor = writer.execute("SELECT entry, meanings FROM kanji")
+    kanji_to_meanings = dict(cursor.fetchall())
     with open(filename, encoding="utf-8") as f:
         new_meanings = json.load(f)
         for kanji in new_meanings:
             # Old meanings are kept as data in another column for searching
             # (Only those which are not also part of the new meanings)
-            cursor.execute("SELECT meanings FROM kanji WHERE entry = ?",
-                           (kanji,))
-            old_meanings = cursor.fetchone()[0].split(";")
+            old_meanings = kanji_to_meanings[kanji].split(";")
             new_meanings_set = set(new_meanings[kanji])
             only_old_meanings = []
             for old_meaning in old_meanings:
                 if old_meaning not in new_meanings_set:
                     only_old_meanings.append(old_meaning)
-            cursor.execute(
+            writer.update(
                 "UPDATE kanji SET meanings_search = ? WHERE entry = ?",
                 (";".join(only_old_meanings), kanji))
             # Old meanings are replaced with new ones
-            cursor.execute("UPDATE kanji SET meanings = ? WHERE entry = ?",
+            writer.update("UPDATE kanji SET meanings = ? WHERE entry = ?",
                 (";".join(new_meanings[kanji]), kanji))
     print("Applying improved kanji meanings... Done.")
 
 
-def parse_kanji_parts(filename, cursor):
+def create_kanji_lookup_tables(writer):
+    """Create tables mapping readings and meanings to kanji in the database
+    using given bulk writer, so that kanji can be looked up with an index
+    instead of searching the semicolon-separated columns of the kanji table.
+    Readings are stored both with and without the dot marking okurigana.
+    Old meanings (replaced by improved ones, but kept for searching) are
+    flagged as such. Must be called after kanji meanings have been improved.
+    """
+    writer.execute("DROP TABLE IF EXISTS kanji_readings")
+    writer.execute("DROP TABLE IF EXISTS kanji_meanings")
+    writer.execute("""
+            CREATE TABLE kanji_readings (
+                kanji TEXT,
+                reading TEXT COLLATE NOCASE,
+                type TEXT)""")
+    writer.execute("""
+            CREATE TABLE kanji_meanings (
+                kanji TEXT,
+                meaning TEXT COLLATE NOCASE,
+                is_old INTEGER)""")
+    print("Creating lookup tables for kanji readings and meanings...", end="\r")
+    cursor = writer.execute("""
+        SELECT entry, on_yomi, on_yomi_search, kun_yomi, kun_yomi_search,
+               meanings, meanings_search
+        FROM kanji""")
+    for (kanji, on_yomi, on_yomi_search, kun_yomi, kun_yomi_search,
+            meanings, meanings_search) in cursor.fetchall():
+        for reading_type, readings in (("on", on_yomi), ("on", on_yomi_search),
+                                       ("kun", kun_yomi),
+                                       ("kun", kun_yomi_search)):
+            for reading in filter(None, readings.split(";")):
+                writer.insert("kanji_readings", (kanji, reading, reading_type))
+        for is_old, meanings in ((0, meanings), (1, meanings_search)):
+            for meaning in filter(None, meanings.split(";")):
+                writer.insert("kanji_meanings", (kanji, meaning, is_old))
+    writer.flush()
+    print("Creating lookup tables for kanji readings and meanings... Done.")
+
+
+def parse_kanji_parts(filename, writer):
     """Parse composition of kanji from text file with given filename (should be
-    called "kradfile") and insert the data into the database referenced
-    by given cursor.
+    called "kradfile") and insert the data into the database using given
+    bulk writer.
     """
     print("Inserting kanji compositions into database... 0%", end="\r")
     with open(filename, encoding="euc_jp") as f:
@@ -812,85 +1088,117 @@ def parse_kanji_parts(filename, cursor):
             # Skip comment lines
             if line[0] == "#":
                 continue
-            parse_kanji_parts_entry(line, cursor)
+            parse_kanji_parts_entry(line, writer)
             perc = ((number - 99) / 6355) * 100
             print("Inserting kanji compositions into database... %d%%"
                   % perc, end="\r")
         print("Inserting kanji compositions into database... 100%")
 
 
-def update_kanji_jlpt_levels(filenameN3Kanji, cursor):
+def update_kanji_jlpt_levels(filenameN3Kanji, writer):
     """ Read new JLPT N3 kanji levels from given file (should be called
     something like "new_jlpt_n3_kanji.txt") and update old JLPT levels to new
-    ones for kanji entries in the database referenced by given cursor.
+    ones for kanji entries in the database using given bulk writer.
     -- Don't call this function on an already updated database --
     """
     print("Updating JLPT levels in database...", end="\r")
     # Old N4 -> New N5, Old N3 -> New N4
-    cursor.execute("UPDATE kanji SET jlpt = 5 WHERE jlpt = 4");
-    cursor.execute("UPDATE kanji SET jlpt = 4 WHERE jlpt = 3");
+    writer.execute("UPDATE kanji SET jlpt = 5 WHERE jlpt = 4");
+    writer.execute("UPDATE kanji SET jlpt = 4 WHERE jlpt = 3");
+    cursor = writer.execute("SELECT entry, jlpt FROM kanji")
+    kanji_to_level = dict(cursor.fetchall())
     with open(filenameN3Kanji, encoding="UTF-16LE") as f:
         # Skip first three lines
         next(f);next(f);next(f)
         # For each new N3 kanji: if it's in old N2 level, set it to N3 level
         for line in f:
             kanji = line[0]
-            cursor.execute("SELECT jlpt FROM kanji WHERE entry = ?", (kanji,))
-            current_level = cursor.fetchone()[0]
-            if current_level == 2:
-                cursor.execute("UPDATE kanji SET jlpt = 3 WHERE entry = ?",
-                               (kanji,))
+            if kanji_to_level[kanji] == 2:
+                kanji_to_level[kanji] = 3
+                writer.update("UPDATE kanji SET jlpt = 3 WHERE entry = ?",
+                              (kanji,))
     print("Updating JLPT levels in database... Done.")
 
 
 def parse_kanji_strokes(filename, output_filepath):
     """Parse kanji strokes from xml file with given filename (should be of the
-    form "kanjivg-*.xml") and store the data in a json file with given path.
-    """
-    print("Parsing kanji strokes xml-file...", end="\r")
-    tree = ElementTree.parse(filename)
-    root = tree.getroot()
-    print("Parsing kanji strokes xml-file... Done.")
-
-    print("Transforming kanji stroke entries into json object... 0%", end="\r")
-    data_object = dict()
-    for number, entry in enumerate(root):
-        parse_kanji_strokes_entry(entry, data_object)
-        perc = ((number + 1) / len(root)) * 100
-        print("Transforming kanji stroke entries into json object... %d%%"
-              % perc, end="\r")
-    print("Transforming kanji stroke entries into json object... 100%")
-
-    print("Storing json object to file '%s'..." % output_filepath, end="\r")
-    with open(output_filepath, "w", encoding="utf-8") as f:
-        f.write(json.dumps(data_object, sort_keys=True, indent=4,
-                           ensure_ascii=False))
-    print("Storing json object to file '%s'... Done." % output_filepath)
+    form "kanjivg-*.xml") and store the data in a stroke store (SQLite file
+    with one row per kanji) with given path.
 
-
-def create_example_words_index(cursor, output_path):
-    cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND "
-                   "(name = 'kanji' OR name = 'dictionary')")
+    The file is parsed incrementally, one kanji at a time. Strokes of each
+    kanji are serialized right away, so only the (compact) output is kept in
+    memory.
+    """
+    start_time = time.perf_counter()
+    print("Parsing kanji strokes xml-file... 0%", end="\r")
+    kanji_to_strokes_json = dict()
+    file_size = os.path.getsize(filename)
+    with open(filename, "rb") as f:
+        context = ElementTree.iterparse(f, events=("start", "end"))
+        _, root = next(context)
+        for event, element in context:
+            if event != "end" or element.tag != "kanji":
+                continue
+            result = parse_kanji_strokes_entry(element)
+            if result is not None:
+                kanji, strokes = result
+                kanji_to_strokes_json[kanji] = json.dumps(
+                    strokes, ensure_ascii=False, separators=(",", ":"))
+            # Kanji are direct children of the root, drop the finished one
+            root.clear()
+            print("Parsing kanji strokes xml-file... %d%%"
+                  % ((f.tell() / file_size) * 100), end="\r")
+    print("Parsing kanji strokes xml-file... 100%")
+
+    print("Storing kanji strokes to file '%s'..." % output_filepath, end="\r")
+    write_stroke_store(output_filepath, kanji_to_strokes_json)
+    print("Storing kanji strokes to file '%s'... Done." % output_filepath)
+    print("Parsed %s." % format_throughput(
+        len(kanji_to_strokes_json), time.perf_counter() - start_time,
+        unit="kanji"))
+
+
+def create_example_words_index(writer, output_path=None):
+    """Create a table mapping each kanji to the IDs of dictionary entries
+    containing it (ordered by frequency) in the database using given bulk
+    writer. IDs are stored compactly as a blob per kanji (see
+    `encode_id_list`). If an output path is given, the index is also stored
+    in a json file (as read by older versions of the program).
+    """
+    cursor = writer.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'table' AND "
+        "(name = 'kanji' OR name = 'dictionary')")
     if len(cursor.fetchall()) != 2:
         print("Dictionary and kanji must be parsed into the database before "
               "creating a reversed index on example words for kanji!")
         return
-    kanji_to_word_ids = dict()
-    print("Creating index for kanji example words... 0%", end="\r")
-    cursor.execute("SELECT entry FROM kanji")
-    kanji_list = cursor.fetchall()
-    for i, (kanji,) in enumerate(kanji_list):
-        pattern = "%%%s%%" % kanji
-        cursor.execute("""
-            SELECT id FROM dictionary WHERE words LIKE ?
-            ORDER BY news_rank IS NULL, news_rank ASC,
-                     commonness IS NULL, commonness ASC """, (pattern,))
-        kanji_to_word_ids[kanji] = [entry for (entry,) in cursor.fetchall()]
-        print("Creating index for kanji example words... %d%%"
-              % (((i + 1) / len(kanji_list)) * 100), end="\r")
-    with open(output_path, "w", encoding="utf-8") as output_file:
-        output_file.write(json.dumps(kanji_to_word_ids, ensure_ascii=False))
-    print("Creating index for kanji example words... 100%")
+    print("Creating index for kanji example words...", end="\r")
+    cursor = writer.execute("SELECT entry FROM kanji")
+    kanji_to_word_ids = { kanji: [] for (kanji,) in cursor.fetchall() }
+    # Single pass over all dictionary entries (in the order in which example
+    # words should be listed), appending each entry to the lists of the
+    # kanji contained in its words
+    cursor = writer.execute("""
+        SELECT id, words FROM dictionary
+        ORDER BY news_rank IS NULL, news_rank ASC,
+                 commonness IS NULL, commonness ASC """)
+    for entry, words in cursor.fetchall():
+        for kanji in set(words):
+            if kanji in kanji_to_word_ids:
+                kanji_to_word_ids[kanji].append(entry)
+    writer.execute("DROP TABLE IF EXISTS example_words")
+    writer.execute("""
+            CREATE TABLE example_words (
+                kanji TEXT PRIMARY KEY,
+                ids BLOB)""")
+    for kanji, word_ids in kanji_to_word_ids.items():
+        writer.insert("example_words", (kanji, encode_id_list(word_ids)))
+    writer.flush()
+    if output_path is not None:
+        with open(output_path, "w", encoding="utf-8") as output_file:
+            output_file.write(
+                json.dumps(kanji_to_word_ids, ensure_ascii=False))
+    print("Creating index for kanji example words... Done.")
 
 
 @dataclass
@@ -914,122 +1222,205 @@ class InputPaths:
     example_words_index: str = None
 
 
-def generate_data(input_paths: InputPaths, output_path: str):
-    # Define filenames and paths for output files
-    database_path = os.path.join(output_path, "Japanese-English.sqlite3")
-    kanji_strokes_path = os.path.join(output_path, "kanji-strokes.json")
+def get_stages(input_paths: InputPaths, output_path: str, streaming=True,
+               jobs=1, legacy_strokes_json=False,
+               legacy_example_words_json=False):
+    """Return the stages (see `Stage`) building the data from given input
+    files, with output files (other than the database) in given directory.
+    """
+    kanji_strokes_path = os.path.join(output_path, "kanji-strokes.sqlite3")
+    kanji_strokes_json_path = os.path.join(output_path, "kanji-strokes.json")
     code_to_text_path = os.path.join(output_path, "dict-code-to-text.json")
     example_words_index_path = os.path.join(
             output_path, "example-words-index.json")
-    # Open database connection
-    connection = sqlite3.connect(database_path)
-    cursor = connection.cursor()
-    # Parse dictionary
+    # Declare the stages of the build, each with the stages it depends on
+    stages = []
     if input_paths.dictionary is not None:
-        print("Parsing dictionary from file '%s':" % input_paths.dictionary)
-        parse_dictionary(input_paths.dictionary, cursor, code_to_text_path)
-    # Parse improved dictionary texts
+        stages.append(Stage("dictionary",
+            functools.partial(parse_dictionary, input_paths.dictionary,
+                code_to_text_output_path=code_to_text_path,
+                streaming=streaming, jobs=jobs),
+            inputs=(input_paths.dictionary,), outputs=(code_to_text_path,),
+            description="Parsing dictionary from file '%s':"
+                        % input_paths.dictionary))
     if input_paths.dictionary_texts is not None:
-        print()
-        print("Applying improved dictionary info texts from file '%s':" %
-            input_paths.dictionary_texts)
-        parse_improved_dictionary_texts(
-                code_to_text_path, input_paths.dictionary_texts)
-    # Parse JLPT vocabulary
+        stages.append(Stage("dictionary-texts",
+            functools.partial(parse_improved_dictionary_texts,
+                code_to_text_path, input_paths.dictionary_texts),
+            dependencies=("dictionary",), uses_database=False,
+            inputs=(input_paths.dictionary_texts,),
+            outputs=(code_to_text_path,),
+            description="Applying improved dictionary info texts from file "
+                        "'%s':" % input_paths.dictionary_texts))
     if input_paths.jlpt_vocab is not None:
-
-        # Create temporary indices to speed up database queries
-        print("Creating temporary indices... ", end="\r")
-        cursor.execute("CREATE INDEX IF NOT EXISTS w_w ON words (word)")
-        cursor.execute("CREATE INDEX IF NOT EXISTS r_r ON readings (reading)")
-        cursor.execute("CREATE INDEX IF NOT EXISTS r_id ON readings (id)")
-        cursor.execute("CREATE INDEX IF NOT EXISTS m_id ON meanings (id)")
-        print("Creating temporary indices... Done.")
-
-        for level in range(5, 0, -1):
-            print()
-            print("Parsing JLPT N%s vocabulary from file '%s':"
-                  % (level, input_paths.jlpt_vocab[5 - level]))
-            parse_jlpt_vocabulary(input_paths.jlpt_vocab[5 - level], level, cursor)
-        print()
-        process_manual_jlpt_assignments(input_paths.jlpt_vocab[5], cursor)
-
-        # Remove temporary indices (will be recreated within the app)
-        print("Removing temporary indices... ", end="\r")
-        cursor.execute("DROP INDEX IF EXISTS w_w")
-        cursor.execute("DROP INDEX IF EXISTS r_r")
-        cursor.execute("DROP INDEX IF EXISTS r_id")
-        cursor.execute("DROP INDEX IF EXISTS m_id")
-        print("Removing temporary indices... Done.")
-    # Parse proper names
+        stages.append(Stage("jlpt-vocab",
+            functools.partial(parse_jlpt_vocabulary_lists,
+                              input_paths.jlpt_vocab),
+            dependencies=("dictionary",),
+            inputs=tuple(input_paths.jlpt_vocab)))
     if input_paths.proper_names is not None:
-        print()
-        print("Parsing proper names from file '%s':" %
-            input_paths.proper_names)
-        parse_proper_names(input_paths.proper_names, cursor)
-    # Parse internet word frequencies
+        stages.append(Stage("proper-names",
+            functools.partial(parse_proper_names, input_paths.proper_names),
+            inputs=(input_paths.proper_names,),
+            description="Parsing proper names from file '%s':"
+                        % input_paths.proper_names))
     if input_paths.word_web_frequencies is not None:
-        print()
-        print("Parsing frequencies of words in the internet from file '%s':"
-              % input_paths.word_web_frequencies)
-        parse_word_web_frequencies(input_paths.word_web_frequencies, cursor)
-    # Parse news word frequencies
+        stages.append(Stage("web-frequencies",
+            functools.partial(parse_word_web_frequencies,
+                              input_paths.word_web_frequencies),
+            dependencies=("dictionary",),
+            inputs=(input_paths.word_web_frequencies,),
+            description="Parsing frequencies of words in the internet from "
+                        "file '%s':" % input_paths.word_web_frequencies))
     if input_paths.word_news_frequencies is not None:
-        print()
-        print("Parsing frequencies of words in newspapers from file '%s':"
-              % input_paths.word_news_frequencies)
-        parse_word_news_frequencies(input_paths.word_news_frequencies, cursor)
-    # Parse word frequencies in the BCCWJ dataset (including printed media)
+        stages.append(Stage("news-frequencies",
+            functools.partial(parse_word_news_frequencies,
+                              input_paths.word_news_frequencies),
+            dependencies=("dictionary",),
+            inputs=(input_paths.word_news_frequencies,),
+            description="Parsing frequencies of words in newspapers from "
+                        "file '%s':" % input_paths.word_news_frequencies))
+    # Word frequencies in the BCCWJ dataset (including printed media)
     if input_paths.word_bccwj_frequencies is not None:
-        print()
-        print("Parsing frequencies of words in BCCWF dataset from file '%s':"
-               % input_paths.word_bccwj_frequencies)
-        parse_word_bccwj_frequencies(input_paths.word_bccwj_frequencies, cursor)
-    # Parse book word frequencies (part of the BCCWJ dataset)
+        stages.append(Stage("bccwj-frequencies",
+            functools.partial(parse_word_bccwj_frequencies,
+                              input_paths.word_bccwj_frequencies),
+            dependencies=("dictionary",),
+            inputs=(input_paths.word_bccwj_frequencies,),
+            description="Parsing frequencies of words in BCCWF dataset from "
+                        "file '%s':" % input_paths.word_bccwj_frequencies))
+    # Book word frequencies (part of the BCCWJ dataset)
     if input_paths.word_book_frequencies is not None:
-        print()
-        print("Parsing frequencies of words in books from file '%s':"
-               % input_paths.word_book_frequencies)
-        parse_word_book_frequencies(input_paths.word_book_frequencies, cursor)
-    # Parse kanji
+        stages.append(Stage("book-frequencies",
+            functools.partial(parse_word_book_frequencies,
+                              input_paths.word_book_frequencies),
+            dependencies=("dictionary",),
+            inputs=(input_paths.word_book_frequencies,),
+            description="Parsing frequencies of words in books from file "
+                        "'%s':" % input_paths.word_book_frequencies))
     if input_paths.kanji is not None:
-        print()
-        print("Parsing kanji from file '%s':" % input_paths.kanji)
-        parse_kanji(input_paths.kanji, cursor)
-    # Parse radicals
+        stages.append(Stage("kanji",
+            functools.partial(parse_kanji, input_paths.kanji),
+            inputs=(input_paths.kanji,),
+            description="Parsing kanji from file '%s':" % input_paths.kanji))
     if input_paths.kanji_radicals is not None:
-        print()
-        print("Parsing radicals from file '%s':" % input_paths.kanji_radicals)
-        parse_radicals(input_paths.kanji_radicals, cursor)
-    # Parse improved kanji meanings
+        stages.append(Stage("radicals",
+            functools.partial(parse_radicals, input_paths.kanji_radicals),
+            inputs=(input_paths.kanji_radicals,),
+            description="Parsing radicals from file '%s':"
+                        % input_paths.kanji_radicals))
     if input_paths.kanji_meanings is not None:
-        print()
-        print("Applying improved kanji meanings from file '%s':" %
-            input_paths.kanji_meanings)
-        parse_improved_kanji_meanings(input_paths.kanji_meanings, cursor)
-    # Parse kanji part compositions
+        stages.append(Stage("kanji-meanings",
+            functools.partial(parse_improved_kanji_meanings,
+                              input_paths.kanji_meanings),
+            dependencies=("kanji",), inputs=(input_paths.kanji_meanings,),
+            description="Applying improved kanji meanings from file '%s':"
+                        % input_paths.kanji_meanings))
+    # Create lookup tables for kanji readings and meanings
+    if input_paths.kanji is not None or input_paths.kanji_meanings is not None:
+        stages.append(Stage("kanji-lookup-tables", create_kanji_lookup_tables,
+            dependencies=("kanji", "kanji-meanings")))
     if input_paths.kanji_parts is not None:
-        print()
-        print("Parsing kanji parts from file '%s':" %
-                input_paths.kanji_parts)
-        parse_kanji_parts(input_paths.kanji_parts, cursor)
+        stages.append(Stage("kanji-parts",
+            functools.partial(parse_kanji_parts, input_paths.kanji_parts),
+            dependencies=("kanji",), inputs=(input_paths.kanji_parts,),
+            description="Parsing kanji parts from file '%s':"
+                        % input_paths.kanji_parts))
     # Update JLPT levels (now 5 instead of previously 4 levels)
     if input_paths.new_jlpt_n3_kanji is not None:
-        print()
-        print("Updating JLPT levels using file '%s':" % input_paths.new_jlpt_n3_kanji)
-        update_kanji_jlpt_levels(input_paths.new_jlpt_n3_kanji, cursor)
+        stages.append(Stage("kanji-jlpt-levels",
+            functools.partial(update_kanji_jlpt_levels,
+                              input_paths.new_jlpt_n3_kanji),
+            dependencies=("kanji",), inputs=(input_paths.new_jlpt_n3_kanji,),
+            description="Updating JLPT levels using file '%s':"
+                        % input_paths.new_jlpt_n3_kanji))
+    # Kanji strokes are stored in a separate file
+    if input_paths.kanji_strokes is not None:
+        stages.append(Stage("kanji-strokes",
+            functools.partial(parse_kanji_strokes, input_paths.kanji_strokes,
+                              kanji_strokes_path),
+            uses_database=False, inputs=(input_paths.kanji_strokes,),
+            outputs=(kanji_strokes_path,),
+            description="Parsing kanji strokes from file '%s':"
+                        % input_paths.kanji_strokes))
+        # Also store strokes in a single json file (for older app versions)
+        if legacy_strokes_json:
+            stages.append(Stage("kanji-strokes-json",
+                functools.partial(write_legacy_strokes_json,
+                                  kanji_strokes_path, kanji_strokes_json_path),
+                dependencies=("kanji-strokes",), uses_database=False,
+                outputs=(kanji_strokes_json_path,)))
     # Create reversed index for example words containing certain kanji
     if input_paths.example_words_index:
-        print()
-        create_example_words_index(cursor, example_words_index_path)
-    connection.commit()
+        stages.append(Stage("example-words",
+            functools.partial(create_example_words_index,
+                output_path=example_words_index_path
+                            if legacy_example_words_json else None),
+            dependencies=("dictionary", "news-frequencies", "kanji"),
+            outputs=(example_words_index_path,)
+                    if legacy_example_words_json else ()))
+    return stages
+
+
+def generate_data(input_paths: InputPaths, output_path: str, streaming=True,
+                  batch_size=DEFAULT_BATCH_SIZE, jobs=1,
+                  legacy_strokes_json=False, legacy_example_words_json=False,
+                  incremental=False, profile=False, trace_sql=None,
+                  build_path=None):
+    start_time = time.perf_counter()
+    # Define filenames and paths for output files
+    database_path = os.path.join(output_path, "Japanese-English.sqlite3")
+    indices_path = os.path.join(
+            os.path.dirname(os.path.abspath(__file__)), "japanese-indices.sql")
+    # Open database connection (tracing all statements if requested)
+    connection = sqlite3.connect(database_path, factory=TracingConnection
+                                 if trace_sql else sqlite3.Connection)
+    apply_build_pragmas(connection)
+    writer = BulkWriter(connection.cursor(), batch_size=batch_size)
+    stages = get_stages(input_paths, output_path, streaming=streaming,
+        jobs=jobs, legacy_strokes_json=legacy_strokes_json,
+        legacy_example_words_json=legacy_example_words_json)
+    # Build state is kept out of the output directory
+    if build_path is None:
+        build_path = get_build_path(output_path)
+    stage_reports = run_stages(stages, writer, jobs=jobs,
+        incremental=incremental, build_path=build_path,
+        profile_path=os.path.join(build_path, BUILD_PROFILES_DIRNAME)
+                     if profile else None)
+    finishing_start_time = time.perf_counter()
+    # Precompute aggregates which the program needs at startup
+    write_content_stats(writer, {
+        "kanji_per_grade":
+            "SELECT grade, COUNT(*) FROM kanji GROUP BY grade",
+        "kanji_per_jlpt_level":
+            "SELECT jlpt, COUNT(*) FROM kanji WHERE jlpt IS NOT NULL "
+            "GROUP BY jlpt",
+        "words_per_jlpt_level":
+            "SELECT jlpt_level, COUNT(*) FROM dictionary "
+            "WHERE jlpt_level IS NOT NULL GROUP BY jlpt_level",
+        "max_news_rank": "SELECT MAX(news_rank) FROM dictionary",
+        "max_book_rank": "SELECT MAX(book_rank) FROM dictionary"
+    })
+    # Ship the database with all indices used by the program prebuilt
+    print()
+    print("Creating indices from file '%s'..." % indices_path, end="\r")
+    create_indices(connection, indices_path)
+    print("Creating indices from file '%s'... Done." % indices_path)
+    finalize_database(connection)
     connection.close()
-    # Parse kanji stroke info
-    if input_paths.kanji_strokes is not None:
+    print()
+    writer.print_stats()
+    statement_stats = get_statement_stats(connection)
+    if statement_stats is not None:
         print()
-        print("Parsing kanji strokes from file '%s':" %
-                input_paths.kanji_strokes)
-        parse_kanji_strokes(input_paths.kanji_strokes, kanji_strokes_path)
+        print_statement_stats(statement_stats, limit=trace_sql)
+    # Record timings and memory usage of all stages for analysis
+    write_build_report(os.path.join(build_path, BUILD_REPORT_FILENAME),
+        stage_reports, statement_stats=statement_stats,
+        jobs=jobs, incremental=incremental,
+        finishing_seconds=time.perf_counter() - finishing_start_time,
+        wall_seconds=time.perf_counter() - start_time,
+        database_size=os.path.getsize(database_path))
     print()
 
 
@@ -1044,6 +1435,46 @@ if __name__ == "__main__":
             dest="dictionary", help="Filename of the dictionary xml file.")
     parser.add_argument("--kanji", "--kan", "-k", metavar="FILENAME",
             dest="kanji", help="Filename of the kanji file.")
+    parser.add_argument("--no-streaming", dest="streaming",
+            action="store_false",
+            help="Load the whole dictionary xml file into memory at once "
+                 "instead of parsing it incrementally.")
+    parser.add_argument("--batch-size", metavar="N", type=int,
+            dest="batch_size", default=DEFAULT_BATCH_SIZE,
+            help="Number of rows buffered per statement before writing them "
+                 "to the database.")
+    parser.add_argument("--jobs", "-j", metavar="N", type=int,
+            dest="jobs", default=1,
+            help="Number of worker processes used for parsing dictionary "
+                 "entries and for running independent stages concurrently. "
+                 "Entries are still inserted by a single process.")
+    parser.add_argument("--incremental", dest="incremental",
+            action="store_true",
+            help="Skip stages whose inputs and code haven't changed since the "
+                 "last build into the output directory (recorded in a build "
+                 "manifest in the build directory) and reuse their results.")
+    parser.add_argument("--profile", dest="profile", action="store_true",
+            help="Run each stage under cProfile and store the statistics in "
+                 "a file per stage in the directory '%s' of the build "
+                 "directory." % BUILD_PROFILES_DIRNAME)
+    parser.add_argument("--build-dir", metavar="PATH", dest="build_path",
+            help="Directory for the build manifest, cached stage results and "
+                 "the build report (default: the directory with the name of "
+                 "the output directory in '%s' next to it)." % BUILD_DIRNAME)
+    parser.add_argument("--trace-sql", metavar="N", type=int, nargs="?",
+            const=20, dest="trace_sql",
+            help="Trace all SQL statements executed during the build and "
+                 "print the N statements which took the most time (20 by "
+                 "default). Stats of all statements are stored in the build "
+                 "report.")
+    parser.add_argument("--legacy-strokes-json", dest="legacy_strokes_json",
+            action="store_true",
+            help="Also store kanji strokes in a single json file (as read by "
+                 "older versions of the program).")
+    parser.add_argument("--legacy-example-words-json",
+            dest="legacy_example_words_json", action="store_true",
+            help="Also store the index of example words for kanji in a json "
+                 "file (as read by older versions of the program).")
 
     parser.add_argument("--dictionary-texts", "--texts", "--tex", "-t",
             metavar="FILENAME", dest="dictionary_texts",
@@ -1093,4 +1524,17 @@ if __name__ == "__main__":
     input_paths = InputPaths()
     args = parser.parse_args(namespace=input_paths)
     output_path = args.output_path if args.output_path else "Japanese-English"
-    generate_data(input_paths, output_path)
\ No newline at end of file
+    streaming = args.streaming
+    batch_size = args.batch_size
+    jobs = args.jobs
+    legacy_strokes_json = args.legacy_strokes_json
+    legacy_example_words_json = args.legacy_example_words_json
+    incremental = args.incremental
+    profile = args.profile
+    trace_sql = args.trace_sql
+    generate_data(input_paths, output_path, streaming=streaming,
+                  batch_size=batch_size, jobs=jobs,
+                  legacy_strokes_json=legacy_strokes_json,
+                  legacy_example_words_json=legacy_example_words_json,
+                  incremental=incremental, profile=profile,
+                  trace_sql=trace_sql, build_path=args.build_path)
\ No newline at end of file
@@ -5,6 +5,9 @@ import importlib
 import argparse
 import json
 from pathlib import Path
+from typing import Optional
+
+from generate_utils import BUILD_MANIFEST_FILENAME, BUILD_DIRNAME
 
 data_filenames = {
     "Japanese": {
@@ -65,81 +68,95 @@ with open(package_path, encoding="utf-8") as f:
     program_version = package_info["version"]
 
 
-def generate_data(language: str, source_language: str, data_path: Path, output_path: Path): 
+def generate_data(language: str, source_language: str, data_path: Path,
+                  output_path: Path, jobs: int = 1, rebuild: bool = False,
+                  profile: bool = False, trace_sql: Optional[int] = None,
+                  build_path: Optional[Path] = None):
     print("=" * 80)
     print(f"  Generating data for ({language}, {source_language})")
     print("=" * 80)
        
     output_path /= f"{language}-{source_language}"
     os.makedirs(output_path, exist_ok=True)
+    # Build state is kept in a separate directory, so that output directories
+    # can be published as they are
+    if build_path is None:
+        build_path = output_path.parent / BUILD_DIRNAME
+    build_path /= output_path.name
+    # Builds are incremental, without a manifest everything is regenerated
+    manifest_path = build_path / BUILD_MANIFEST_FILENAME
+    if rebuild and manifest_path.exists():
+        os.remove(manifest_path)
 
     language_module = importlib.import_module(f"generate-{language.lower()}-data")
-    parts = data_filenames[language].keys()
-    for part in parts:
-        filenames = data_filenames[language][part]
-        paths = {
-            resource_name: Path(data_path) / filename
-            for resource_name, filename in filenames.items()
-        }
-        if language == "Japanese":
-            if part == "words":
-                input_paths = language_module.InputPaths(**{
-                    "dictionary": paths["dictionary"],
-                    "dictionary_texts": paths["dictionary-texts"],
-                    # "proper_names": paths["proper-names"],
-                    "jlpt_vocab": [
-                        paths["jlpt-vocab-n5"],
-                        paths["jlpt-vocab-n4"],
-                        paths["jlpt-vocab-n3"],
-                        paths["jlpt-vocab-n2"],
-                        paths["jlpt-vocab-n1"],
-                        paths["jlpt-vocab-manual"],
-                    ],
-                    "word_book_frequencies": paths["book-frequencies"]
-                })
-                language_module.generate_data(input_paths, output_path)
-                shutil.copy(paths["name-tag-texts"], output_path)
-            elif part == "kanji":
-                input_paths = language_module.InputPaths(**{
-                    "kanji": paths["kanji"],
-                    "kanji_meanings": paths["meanings"],
-                    "kanji_radicals": paths["radicals"],
-                    "kanji_strokes": paths["strokes"],
-                    "kanji_parts": paths["parts"],
-                    "new_jlpt_n3_kanji": paths["new-jlpt-n3"],
-                    "example_words_index": paths
-                })
-                language_module.generate_data(input_paths, output_path)
-                shutil.copy(paths["numerals"], output_path)
-                shutil.copy(paths["counters"], output_path)
-                shutil.copy(paths["kokuji"], output_path)
-        elif language == "Chinese":
-            if part == "words":
-                input_paths = language_module.InputPaths(**{
-                    "dictionary": paths["dictionary"],
-                    "hsk_vocab": paths["hsk-vocab"],
-                    "web_word_frequencies": paths["web-frequencies"],
-                    "lcmc_word_frequencies": paths["lcmc-frequencies"]
-                })
-                language_module.generate_data(input_paths, output_path)
-            elif part == "hanzi":
-                input_paths = language_module.InputPaths(**{
-                    "hanzi": paths["hanzi"],
-                    "hsk_hanzi": paths["hsk-hanzi"],
-                    "hanzi_radicals": paths["hanzi-radicals"],
-                    "hanzi_strokes": paths["hanzi-strokes"],
-                    "hanzi_decomposition": paths["hanzi-decomposition"]
-                })
-                language_module.generate_data(input_paths, output_path)
+    content_versions = min_content_versions[language][source_language]
+    # All parts are generated in a single run, so that the language module
+    # can schedule their stages together (independent ones concurrently)
+    paths = {
+        resource_name: Path(data_path) / filename
+        for filenames in data_filenames[language].values()
+        for resource_name, filename in filenames.items()
+    }
+    if language == "Japanese":
+        input_paths = language_module.InputPaths(**{
+            "dictionary": paths["dictionary"],
+            "dictionary_texts": paths["dictionary-texts"],
+            # "proper_names": paths["proper-names"],
+            "jlpt_vocab": [
+                paths["jlpt-vocab-n5"],
+                paths["jlpt-vocab-n4"],
+                paths["jlpt-vocab-n3"],
+                paths["jlpt-vocab-n2"],
+                paths["jlpt-vocab-n1"],
+                paths["jlpt-vocab-manual"],
+            ],
+            "word_book_frequencies": paths["book-frequencies"],
+            "kanji": paths["kanji"],
+            "kanji_meanings": paths["meanings"],
+            "kanji_radicals": paths["radicals"],
+            "kanji_strokes": paths["strokes"],
+            "kanji_parts": paths["parts"],
+            "new_jlpt_n3_kanji": paths["new-jlpt-n3"],
+            "example_words_index": True
+        })
+        # Strokes in a single json file and the json index of example
+        # words are only needed as long as older program versions
+        # are supported
+        language_module.generate_data(input_paths, output_path, jobs=jobs,
+            incremental=True, profile=profile, trace_sql=trace_sql,
+            build_path=build_path,
+            legacy_strokes_json="kanji-strokes.json" in content_versions,
+            legacy_example_words_json=
+                "example-words-index.json" in content_versions)
+        shutil.copy(paths["name-tag-texts"], output_path)
+        shutil.copy(paths["numerals"], output_path)
+        shutil.copy(paths["counters"], output_path)
+        shutil.copy(paths["kokuji"], output_path)
+    elif language == "Chinese":
+        input_paths = language_module.InputPaths(**{
+            "dictionary": paths["dictionary"],
+            "hsk_vocab": paths["hsk-vocab"],
+            "web_word_frequencies": paths["web-frequencies"],
+            "lcmc_word_frequencies": paths["lcmc-frequencies"],
+            "hanzi": paths["hanzi"],
+            "hsk_hanzi": paths["hsk-hanzi"],
+            "hanzi_radicals": paths["hanzi-radicals"],
+            "hanzi_strokes": paths["hanzi-strokes"],
+            "hanzi_decomposition": paths["hanzi-decomposition"]
+        })
+        language_module.generate_data(input_paths, output_path, jobs=jobs,
+            incremental=True, profile=profile, trace_sql=trace_sql,
+            build_path=build_path,
+            legacy_strokes_json="hanzi-strokes.json" in content_versions)
 
     # Write version infos to output directory
     content_versions_path = output_path / "versions.json"
     min_program_versions_path = output_path / "min-program-versions.json"
     with open(content_versions_path, "w", encoding="utf-8") as f:
-        json.dump(min_content_versions[language][source_language], f)
+        json.dump(content_versions, f)
     with open(min_program_versions_path, "w", encoding="utf-8") as f:
         obj = {}
-        for filename in min_content_versions[language][source_language]:
+        for filename in content_versions:
             obj[filename] = program_version
         json.dump(obj, f)
 
@@ -170,7 +187,10 @@ def main(args):
                 print(f"ERROR: no data found for '{data_directory_key}'")
                 return
             output_path = args.output_path if args.output_path else script_path
-            generate_data(language, source_language, input_path, output_path)
+            generate_data(language, source_language, input_path, output_path,
+                          jobs=args.jobs, rebuild=args.rebuild,
+                          profile=args.profile, trace_sql=args.trace_sql,
+                          build_path=args.build_path)
 
 
 if __name__ == "__main__":
@@ -179,5 +199,29 @@ if __name__ == "__main__":
     parser.add_argument("--languages", "--lang", "-l", nargs="*", choices=supported_languages)
     parser.add_argument("--source-languages", "--source", "-s")
     parser.add_argument("--output-path", "--output", "--out", "-o", type=Path)
+    parser.add_argument("--jobs", "-j", metavar="N", type=int, default=1,
+                        help="Number of worker processes used for running "
+                             "independent stages concurrently")
+    parser.add_argument("--rebuild", action="store_true",
+                        help="Regenerate everything instead of skipping "
+                             "stages whose inputs haven't changed since the "
+                             "last build (see build-manifest.json in the "
+                             "build directory)")
+    parser.add_argument("--profile", action="store_true",
+                        help="Store cProfile statistics of each stage in the "
+                             "build directory (timings, memory usage and "
+                             "row counts are always recorded in the build "
+                             "report there)")
+    parser.add_argument("--build-dir", metavar="PATH", type=Path,
+                        dest="build_path",
+                        help="Directory for the build manifests, cached stage "
+                             "results and build reports, which must not be "
+                             "published along with the output (default: "
+                             "'%s' in the output directory)" % BUILD_DIRNAME)
+    parser.add_argument("--trace-sql", metavar="N", type=int, nargs="?",
+                        const=20,
+                        help="Trace all SQL statements run by the stages and "
+                             "print the N slowest ones (20 by default), use "
+                             "together with --rebuild to trace all stages")
     args = parser.parse_args()
     main(args)
@@ -0,0 +1,1100 @@
+"""Helpers shared by the scripts generating language data."""
+
+__author__ = "Daniel Bindemann (Daniel.Bindemann@gmx.de)"
+
+import io
+import os
+import re
+import sys
+import json
+import time
+import shutil
+import sqlite3
+import hashlib
+import functools
+import cProfile
+import inspect
+import tempfile
+import contextlib
+import tracemalloc
+import concurrent.futures
+from dataclasses import dataclass
+from typing import Callable
+
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None
+
+
+def peak_memory_usage():
+    """Return the peak resident set size of the current process in megabytes,
+    or None if it cannot be determined on this platform.
+    """
+    if resource is None:
+        return None
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS reports bytes
+    if sys.platform == "darwin":
+        return max_rss / (1024 * 1024)
+    return max_rss / 1024
+
+
+def format_throughput(count, seconds, unit="entries", show_memory=True):
+    """Return a short summary like '1234 entries in 1.2s (1028 entries/sec)',
+    including the peak memory usage of the process if available.
+    """
+    rate = count / seconds if seconds > 0 else 0
+    summary = "%d %s in %.1fs (%d %s/sec" % (count, unit, seconds, rate, unit)
+    peak_memory = peak_memory_usage() if show_memory else None
+    if peak_memory is not None:
+        summary += ", peak memory %.0f MB" % peak_memory
+    return summary + ")"
+
+
+# Pragmas used while building content databases. Durability is not needed
+# during a build (a failed build is simply started again), so the journal
+# and syncing are turned off and the database is locked for the process.
+BUILD_PRAGMAS = {
+    "journal_mode": "OFF",
+    "synchronous": "OFF",
+    "cache_size": -262144,  # Negative values are in KiB, i.e. 256 MB
+    "locking_mode": "EXCLUSIVE",
+    "temp_store": "MEMORY"
+}
+
+
+def apply_build_pragmas(connection):
+    """Apply the build-only pragma profile to given database connection.
+    None of these pragmas are persistent, so the generated database file
+    uses the default settings again once the connection has been closed.
+    """
+    for name, value in BUILD_PRAGMAS.items():
+        connection.execute("PRAGMA %s = %s" % (name, value))
+
+
+# Page size of finished content databases. Larger pages make the databases
+# smaller and faster to copy into memory, see `finalize_database`
+CONTENT_PAGE_SIZE = 8192
+
+create_index_regex = re.compile(
+    r"^\s*CREATE\s+INDEX\s+(?:IF\s+NOT\s+EXISTS\s+)?(\w+)\s+ON\s+(\w+)",
+    re.IGNORECASE)
+
+
+def create_indices(connection, filename):
+    """Execute the CREATE INDEX statements in the SQL file with given name.
+    Indices on tables which don't exist (yet) are skipped, so that the file
+    can be applied to partially generated databases as well.
+    """
+    with open(filename, encoding="utf-8") as f:
+        lines = [line for line in f if not line.lstrip().startswith("--")]
+    tables = set(name for (name,) in connection.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'table'"))
+    statement = ""
+    for line in lines:
+        statement += line
+        if not sqlite3.complete_statement(statement):
+            continue
+        match = create_index_regex.match(statement)
+        if match is None:
+            raise ValueError("Not an index definition: '%s'" % statement)
+        if match.group(2) in tables:
+            connection.execute(statement)
+        statement = ""
+
+
+def finalize_database(connection, page_size=CONTENT_PAGE_SIZE):
+    """Prepare a generated content database for shipping: gather statistics
+    for the query planner and rebuild the file without unused pages using
+    given page size. All pending changes are committed first.
+    """
+    print("Optimizing database...", end="\r")
+    connection.commit()
+    connection.execute("ANALYZE")
+    connection.commit()
+    connection.execute("PRAGMA page_size = %d" % page_size)
+    connection.execute("VACUUM")
+    print("Optimizing database... Done.")
+
+
+DEFAULT_BATCH_SIZE = 10000
+
+write_statement_regex = re.compile(
+    r"^\s*(?:INSERT\s+(?:OR\s+\w+\s+)?INTO|UPDATE|DELETE\s+FROM)\s+(\w+)",
+    re.IGNORECASE)
+
+
+class BulkWriter:
+    """Buffer rows written to the database referenced by given cursor and
+    write them using `executemany` once a batch of given size is full.
+
+    Buffered rows are flushed in the order in which their statements were
+    first used. Statements reading from the database must be run through
+    `execute`, which flushes all buffered rows first, so queries never miss
+    rows that have been written before.
+    """
+
+    def __init__(self, cursor, batch_size=DEFAULT_BATCH_SIZE):
+        self.cursor = cursor
+        self.batch_size = batch_size
+        # Map statements to the table they write to and their pending rows
+        self.buffers = dict()
+        # Map table names to [inserted rows, updated rows, seconds]
+        self.stats = dict()
+        self.insert_statements = dict()
+
+    def insert(self, table, values, columns=None):
+        """Buffer a row with given values for insertion into given table.
+        If no column names are given, values must cover all columns.
+        """
+        if columns is not None:
+            columns = tuple(columns)
+        key = (table, columns, len(values))
+        statement = self.insert_statements.get(key)
+        if statement is None:
+            qmarks = ", ".join(["?"] * len(values))
+            if columns is None:
+                statement = "INSERT INTO %s VALUES (%s)" % (table, qmarks)
+            else:
+                statement = "INSERT INTO %s (%s) VALUES (%s)" % (
+                    table, ", ".join(columns), qmarks)
+            self.insert_statements[key] = statement
+        self.write(statement, values)
+
+    def update(self, statement, values):
+        """Buffer an UPDATE or DELETE statement with given parameters."""
+        self.write(statement, values)
+
+    def write(self, statement, values):
+        buffer = self.buffers.get(statement)
+        if buffer is None:
+            match = write_statement_regex.match(statement)
+            if match is None:
+                raise ValueError("Can't buffer statement '%s'." % statement)
+            buffer = self.buffers[statement] = (match.group(1), [])
+        rows = buffer[1]
+        rows.append(values)
+        if len(rows) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """Write all buffered rows to the database."""
+        for statement, (table, rows) in self.buffers.items():
+            if not rows:
+                continue
+            start_time = time.perf_counter()
+            self.cursor.executemany(statement, rows)
+            elapsed_time = time.perf_counter() - start_time
+            table_stats = self.stats.setdefault(table, [0, 0, 0.0])
+            if statement.lstrip()[:6].upper() == "INSERT":
+                table_stats[0] += len(rows)
+            else:
+                table_stats[1] += max(self.cursor.rowcount, 0)
+            table_stats[2] += elapsed_time
+        self.buffers.clear()
+
+    def execute(self, statement, parameters=()):
+        """Flush buffered rows, then execute given statement and return the
+        cursor so that results can be fetched from it.
+        """
+        self.flush()
+        return self.cursor.execute(statement, parameters)
+
+    def update_column(self, table, column, key_column, key_to_value):
+        """Set given column of all rows in given table to the value which given
+        dictionary maps their key (the value of the key column) to. Rows with
+        keys not contained in the dictionary are left unchanged. The values
+        are loaded into a temporary table and joined in a single UPDATE.
+        """
+        self.flush()
+        start_time = time.perf_counter()
+        self.cursor.execute("DROP TABLE IF EXISTS temp.column_values")
+        self.cursor.execute(
+            "CREATE TEMP TABLE column_values (key PRIMARY KEY, value)")
+        self.cursor.executemany("INSERT INTO temp.column_values VALUES (?, ?)",
+                                key_to_value.items())
+        self.cursor.execute(
+            f"UPDATE {table} SET {column} = (SELECT value "
+            f"FROM temp.column_values WHERE key = {table}.{key_column}) "
+            f"WHERE {key_column} IN (SELECT key FROM temp.column_values)")
+        num_updated = max(self.cursor.rowcount, 0)
+        self.cursor.execute("DROP TABLE temp.column_values")
+        table_stats = self.stats.setdefault(table, [0, 0, 0.0])
+        table_stats[1] += num_updated
+        table_stats[2] += time.perf_counter() - start_time
+
+    def print_stats(self):
+        """Print the number of rows written per table and the throughput."""
+        print("Rows written per table:")
+        for table, (inserted, updated, seconds) in sorted(self.stats.items()):
+            print("  %-16s %8d inserted %8d updated  %s" % (table + ":",
+                  inserted, updated, format_throughput(
+                      inserted + updated, seconds, unit="rows",
+                      show_memory=False)))
+
+
+sql_literal_regex = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+sql_whitespace_regex = re.compile(r"\s+")
+sql_parameter_list_regex = re.compile(r"\?(?:\s*,\s*\?)+")
+
+
+@functools.lru_cache(maxsize=4096)
+def normalize_statement(statement):
+    """Return given SQL statement on a single line with all literals replaced
+    by parameters and lists of parameters collapsed, so that statements which
+    only differ in their (inlined) values are traced together.
+    """
+    statement = sql_literal_regex.sub("?", statement)
+    statement = sql_whitespace_regex.sub(" ", statement).strip()
+    return sql_parameter_list_regex.sub("?, ...", statement)
+
+
+class TracingCursor(sqlite3.Cursor):
+    """Cursor recording every statement it executes in the statement stats of
+    its connection (see `TracingConnection`).
+    """
+
+    def execute(self, statement, parameters=()):
+        start_time = time.perf_counter()
+        super().execute(statement, parameters)
+        self.connection.record_statement(statement, 1,
+            time.perf_counter() - start_time, self.rowcount)
+        return self
+
+    def executemany(self, statement, parameters):
+        if not hasattr(parameters, "__len__"):
+            parameters = list(parameters)
+        start_time = time.perf_counter()
+        super().executemany(statement, parameters)
+        self.connection.record_statement(statement, len(parameters),
+            time.perf_counter() - start_time, self.rowcount)
+        return self
+
+
+class TracingConnection(sqlite3.Connection):
+    """Database connection tracing all statements executed through it (pass
+    it as factory to `sqlite3.connect`). The statement stats map normalized
+    statements (see `normalize_statement`) to [calls, executions, seconds,
+    affected rows], where each set of parameters passed to `executemany`
+    counts as an execution. The time of queries only covers the execution up
+    to the first result row, fetching further rows is not included.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.statement_stats = dict()
+
+    def cursor(self, factory=TracingCursor):
+        return super().cursor(factory)
+
+    def execute(self, statement, parameters=()):
+        return self.cursor().execute(statement, parameters)
+
+    def executemany(self, statement, parameters):
+        return self.cursor().executemany(statement, parameters)
+
+    def record_statement(self, statement, executions, seconds, rows):
+        statement_stats = self.statement_stats.get(statement)
+        if statement_stats is None:
+            statement_stats = self.statement_stats.setdefault(
+                normalize_statement(statement), [0, 0, 0.0, 0])
+            # Statements are looked up by their original text first
+            self.statement_stats[statement] = statement_stats
+        statement_stats[0] += 1
+        statement_stats[1] += executions
+        statement_stats[2] += seconds
+        statement_stats[3] += max(rows, 0)
+
+
+def get_statement_stats(connection):
+    """Return the stats of distinct statements traced by given connection
+    (see `TracingConnection`), or None if the connection isn't tracing.
+    """
+    statement_stats = getattr(connection, "statement_stats", None)
+    if statement_stats is None:
+        return None
+    # Drop the aliases of statements under their original text
+    return dict((normalize_statement(statement), statement_stats)
+                for statement, statement_stats in statement_stats.items())
+
+
+def add_statement_stats(connection, statement_stats):
+    """Add given stats of traced statements (e.g. of a worker process) to the
+    statement stats of given tracing connection.
+    """
+    for statement, (calls, executions, seconds, rows) in \
+            statement_stats.items():
+        total_stats = connection.statement_stats.setdefault(
+            statement, [0, 0, 0.0, 0])
+        total_stats[0] += calls
+        total_stats[1] += executions
+        total_stats[2] += seconds
+        total_stats[3] += rows
+
+
+def print_statement_stats(statement_stats, limit=20, width=100):
+    """Print given stats of traced statements (see `get_statement_stats`),
+    limited to the given number of statements which took the most time.
+    """
+    ranked = sorted(statement_stats.items(), key=lambda item: -item[1][2])
+    print("Slowest SQL statements (%d of %d distinct, %d calls):" % (
+          min(limit, len(ranked)), len(ranked),
+          sum(calls for calls, _, _, _ in statement_stats.values())))
+    print("  %8s %10s %9s %10s  %s" % (
+          "calls", "executions", "seconds", "rows", "statement"))
+    for statement, (calls, executions, seconds, rows) in ranked[:limit]:
+        if len(statement) > width:
+            statement = statement[:width - 3] + "..."
+        print("  %8d %10d %9.3f %10d  %s" % (
+              calls, executions, seconds, rows, statement))
+
+
+@dataclass
+class Stage:
+    """A step of generating a content database. The function is called with
+    a bulk writer for the database (or without arguments if the stage doesn't
+    use the database). Dependencies are names of stages whose tables the stage
+    reads or modifies, the description is printed before the stage is run.
+    Inputs are the data files (or directories) read by the stage, outputs are
+    the files it writes or modifies apart from the database. Both are needed
+    to decide whether a stage can be skipped in incremental builds.
+    """
+    name: str
+    function: Callable
+    dependencies: tuple = ()
+    description: str = None
+    uses_database: bool = True
+    inputs: tuple = ()
+    outputs: tuple = ()
+
+
+def assign_stage_lanes(stages):
+    """Partition given stages into lanes, which can be run concurrently on
+    separate databases, and stages which need the merged database. A stage
+    without dependencies starts a new lane, a stage depending only on stages
+    of a single lane joins that lane. Stages depending on multiple lanes or on
+    stages which are not part of the build (i.e. on tables which already exist
+    in the database) are run on the merged database. Return the list of lanes
+    (each a list of stages) and the list of stages run after merging.
+    """
+    stage_names = set(stage.name for stage in stages)
+    stage_to_lane = dict()
+    lanes = []
+    merged_stages = []
+    for stage in stages:
+        dependency_lanes = set()
+        for name in stage.dependencies:
+            if name in stage_names and name not in stage_to_lane:
+                raise ValueError("Stage '%s' depends on stage '%s' which is "
+                                 "not run before it." % (stage.name, name))
+            # Stages which are not part of the build count as merged
+            dependency_lanes.add(stage_to_lane.get(name))
+        if not dependency_lanes:
+            lane = len(lanes)
+            lanes.append([])
+        elif len(dependency_lanes) == 1:
+            lane = dependency_lanes.pop()
+        else:
+            lane = None
+        stage_to_lane[stage.name] = lane
+        if lane is None:
+            merged_stages.append(stage)
+        else:
+            lanes[lane].append(stage)
+    return lanes, merged_stages
+
+
+def run_stage(stage, writer, profile_path=None):
+    """Print the description of given stage and run it using given writer.
+    Return a report (a dictionary) containing the wall time and CPU time of
+    the stage, the peak memory usage of the process running it (including
+    preceding stages in the same process), the rows it wrote per table and
+    the sizes of its output files.
+
+    If a profile path is given, the stage is run under cProfile and the
+    statistics are dumped into a file named after the stage in that
+    directory. The peak size of memory allocated by Python during the stage
+    (as traced by tracemalloc) is added to the report then.
+    """
+    if stage.description is not None:
+        print(stage.description)
+    table_stats_before = dict((table, list(table_stats))
+                              for table, table_stats in writer.stats.items())
+    profiler = None
+    if profile_path is not None:
+        profiler = cProfile.Profile()
+        tracemalloc.start()
+    start_time = time.perf_counter()
+    start_cpu_time = time.process_time()
+    if profiler is not None:
+        profiler.enable()
+    if stage.uses_database:
+        stage.function(writer)
+    else:
+        stage.function()
+    writer.flush()
+    if profiler is not None:
+        profiler.disable()
+    report = {
+        "name": stage.name,
+        "status": "run",
+        "wall_seconds": time.perf_counter() - start_time,
+        "cpu_seconds": time.process_time() - start_cpu_time,
+        "peak_memory_mb": peak_memory_usage(),
+        "tables": dict(),
+        "outputs": dict((os.path.basename(path), os.path.getsize(path))
+                        for path in stage.outputs if os.path.exists(path))
+    }
+    for table, table_stats in writer.stats.items():
+        before = table_stats_before.get(table, [0, 0, 0.0])
+        if table_stats != before:
+            report["tables"][table] = {
+                "inserted": table_stats[0] - before[0],
+                "updated": table_stats[1] - before[1],
+                "seconds": table_stats[2] - before[2]
+            }
+    if profiler is not None:
+        report["traced_peak_memory_mb"] = \
+            tracemalloc.get_traced_memory()[1] / (1024 * 1024)
+        tracemalloc.stop()
+        os.makedirs(profile_path, exist_ok=True)
+        profiler.dump_stats(os.path.join(profile_path, stage.name + ".prof"))
+    return report
+
+
+def run_stage_sequence(stages, writer, profile_path=None):
+    """Run given stages in order using given bulk writer and return their
+    reports (see `run_stage`).
+    """
+    reports = []
+    for number, stage in enumerate(stages):
+        if number > 0:
+            print()
+        reports.append(run_stage(stage, writer, profile_path=profile_path))
+    return reports
+
+
+def save_checkpoint(stage, key, connection, checkpoint_path):
+    """Save the database of given connection and the output files of given
+    stage into the directory with given path, replacing its contents. The
+    given key of the stage version is stored as well.
+    """
+    connection.commit()
+    if os.path.exists(checkpoint_path):
+        shutil.rmtree(checkpoint_path)
+    os.makedirs(checkpoint_path)
+    checkpoint = sqlite3.connect(
+        os.path.join(checkpoint_path, "database.sqlite3"))
+    connection.backup(checkpoint)
+    checkpoint.close()
+    for path in stage.outputs:
+        shutil.copy(path, checkpoint_path)
+    # Written last, so incomplete checkpoints are never used
+    with open(os.path.join(checkpoint_path, "key"), "w") as f:
+        f.write(key)
+
+
+def has_checkpoint(key, checkpoint_path):
+    """Return whether a complete checkpoint with given key of the stage
+    version exists in the directory with given path.
+    """
+    key_path = os.path.join(checkpoint_path, "key")
+    if not os.path.exists(key_path):
+        return False
+    with open(key_path) as f:
+        return f.read() == key
+
+
+def restore_checkpoint(stage, connection, checkpoint_path):
+    """Restore the database of given connection and the output files of given
+    stage from the checkpoint in the directory with given path.
+    """
+    checkpoint = sqlite3.connect(
+        os.path.join(checkpoint_path, "database.sqlite3"))
+    checkpoint.backup(connection)
+    checkpoint.close()
+    for path in stage.outputs:
+        shutil.copy(
+            os.path.join(checkpoint_path, os.path.basename(path)), path)
+
+
+def run_stage_lane(stages, database_path, batch_size, checkpoint_path=None,
+                   checkpoint_key=None, resume=False, capture_output=True,
+                   profile_path=None, trace=False):
+    """Run given stages in order on a new database with given path (usually in
+    a worker process). Return everything printed by the stages (if output is
+    captured), the number of rows written per table (see `BulkWriter.stats`)
+    and the reports of the stages (see `run_stage`). Progress messages which
+    have been overwritten (using carriage returns) are left out of the
+    captured output. If tracing is enabled, the stats of the statements run
+    on the database are returned as well (see `get_statement_stats`).
+
+    If a checkpoint path is given, the state after the first stage is saved
+    there (together with given key, see `save_checkpoint`). When resuming,
+    that state is restored instead of running the first stage again.
+    """
+    output = io.StringIO()
+    with (contextlib.redirect_stdout(output) if capture_output
+            else contextlib.nullcontext()):
+        connection = sqlite3.connect(database_path, factory=TracingConnection
+                                     if trace else sqlite3.Connection)
+        apply_build_pragmas(connection)
+        writer = BulkWriter(connection.cursor(), batch_size=batch_size)
+        reports = []
+        for number, stage in enumerate(stages):
+            if number > 0:
+                print()
+            if number == 0 and resume:
+                print("Restoring results of stage '%s' from build cache..."
+                      % stage.name, end="\r")
+                start_time = time.perf_counter()
+                restore_checkpoint(stage, connection, checkpoint_path)
+                reports.append({ "name": stage.name, "status": "restored",
+                                 "wall_seconds":
+                                    time.perf_counter() - start_time })
+                print("Restoring results of stage '%s' from build cache... "
+                      "Done." % stage.name)
+                continue
+            reports.append(
+                run_stage(stage, writer, profile_path=profile_path))
+            if number == 0 and checkpoint_path is not None:
+                start_time = time.perf_counter()
+                save_checkpoint(
+                    stage, checkpoint_key, connection, checkpoint_path)
+                reports[-1]["checkpoint_seconds"] = \
+                    time.perf_counter() - start_time
+        connection.commit()
+        writer.cursor.close()
+        connection.close()
+    lines = [line.rsplit("\r", 1)[-1]
+             for line in output.getvalue().split("\n")]
+    return ("\n".join(lines), writer.stats, reports,
+            get_statement_stats(connection))
+
+
+def merge_database(writer, filename):
+    """Copy all tables (including their indices) of the database with given
+    filename into the database of given bulk writer, replacing tables with
+    the same names. Virtual tables are created anew and the contents of their
+    shadow tables are copied as they are, so full-text indices are not built
+    a second time.
+    """
+    writer.flush()
+    connection = writer.cursor.connection
+    connection.commit()
+    connection.execute("ATTACH DATABASE ? AS staging", (filename,))
+    schema = connection.execute(
+        "SELECT type, name, sql FROM staging.sqlite_master "
+        "WHERE sql IS NOT NULL AND name NOT LIKE 'sqlite%' "
+        "ORDER BY rowid").fetchall()
+    virtual_tables = [name for type, name, sql in schema if type == "table"
+                      and sql.upper().startswith("CREATE VIRTUAL")]
+    shadow_tables = []
+    for type, name, sql in schema:
+        if type != "table":
+            continue
+        if any(name.startswith(table + "_") for table in virtual_tables):
+            shadow_tables.append(name)
+            continue
+        connection.execute("DROP TABLE IF EXISTS main.%s" % name)
+        connection.execute(sql)
+        if name not in virtual_tables:
+            connection.execute(
+                "INSERT INTO main.%s SELECT * FROM staging.%s" % (name, name))
+    for name in shadow_tables:
+        connection.execute("DELETE FROM main.%s" % name)
+        connection.execute(
+            "INSERT INTO main.%s SELECT * FROM staging.%s" % (name, name))
+    # Indices are only created once all rows have been copied
+    for type, name, sql in schema:
+        if type != "table":
+            connection.execute(sql)
+    connection.commit()
+    connection.execute("DETACH DATABASE staging")
+
+
+# Files in the build directory used for incremental builds (see `run_stages`)
+BUILD_MANIFEST_FILENAME = "build-manifest.json"
+BUILD_CACHE_DIRNAME = "build-cache"
+
+# Files in the build directory describing the performance of the last build
+BUILD_REPORT_FILENAME = "build-report.json"
+BUILD_PROFILES_DIRNAME = "build-profiles"
+
+# Directory next to output directories containing their build directories
+BUILD_DIRNAME = ".build"
+
+
+def get_build_path(output_path):
+    """Return the default build directory for the output directory with given
+    path, i.e. the directory with the same name in the directory '.build'
+    next to it. Build state is kept out of output directories, so that they
+    only contain the content which is released.
+    """
+    output_path = os.path.abspath(output_path)
+    return os.path.join(os.path.dirname(output_path), BUILD_DIRNAME,
+                        os.path.basename(output_path))
+
+
+def hash_file(path):
+    """Return the SHA-256 hash (as hex string) of the file with given path."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def hash_input(path, known_hashes, hashes):
+    """Return a hash of the contents of the input file or directory with given
+    path (for a directory, of the names and contents of all files in it).
+    Hashes map file paths to [size, modification time, hash]. Known hashes are
+    reused for files whose size and modification time haven't changed, all
+    hashes used are stored in given dictionary `hashes`.
+    """
+    path = os.path.abspath(path)
+    if os.path.isdir(path):
+        digest = hashlib.sha256()
+        for directory, subdirectories, filenames in os.walk(path):
+            subdirectories.sort()
+            for filename in sorted(filenames):
+                file_path = os.path.join(directory, filename)
+                digest.update(os.path.relpath(file_path, path).encode("utf-8"))
+                digest.update(hash_input(file_path, known_hashes, hashes)
+                              .encode("ascii"))
+        return digest.hexdigest()
+    file_stat = os.stat(path)
+    known_hash = known_hashes.get(path)
+    if known_hash is not None and \
+            known_hash[:2] == [file_stat.st_size, file_stat.st_mtime_ns]:
+        hashes[path] = known_hash
+    else:
+        hashes[path] = [file_stat.st_size, file_stat.st_mtime_ns,
+                        hash_file(path)]
+    return hashes[path][2]
+
+
+# Keyword arguments of stage functions which don't affect their results
+UNVERSIONED_ARGUMENTS = ("verbose", "jobs", "streaming")
+
+
+def get_stable_repr(value):
+    """Return a representation of given value which doesn't change between
+    runs of the interpreter (unlike the order of sets of strings).
+    """
+    if isinstance(value, (set, frozenset)):
+        return "{%s}" % ", ".join(sorted(get_stable_repr(x) for x in value))
+    if isinstance(value, (list, tuple)):
+        return "[%s]" % ", ".join(get_stable_repr(x) for x in value)
+    if isinstance(value, dict):
+        return "{%s}" % ", ".join("%s: %s" % (get_stable_repr(key),
+            get_stable_repr(value[key])) for key in value)
+    if isinstance(value, re.Pattern):
+        return "re.compile(%r, %d)" % (value.pattern, value.flags)
+    return repr(value)
+
+
+def get_code_sources(obj, filenames, sources):
+    """Add the source code of given function or class to dictionary `sources`
+    (mapping names qualified by the filename to sources), as well as the sources of all
+    functions and classes and the values of all constants it refers to by
+    global name, recursively. Only objects defined in files with given names
+    are considered, other modules are expected not to change between builds.
+    """
+    obj = inspect.unwrap(obj)
+    try:
+        filename = inspect.getsourcefile(obj)
+    except TypeError:  # Built-in function or class
+        return
+    if filename is None or os.path.abspath(filename) not in filenames:
+        return
+    filename = os.path.basename(filename)
+    name = "%s:%s" % (filename, obj.__qualname__)
+    if name in sources:
+        return
+    sources[name] = inspect.getsource(obj)
+    if inspect.isclass(obj):
+        functions = [value for value in vars(obj).values()
+                     if inspect.isfunction(value)]
+    else:
+        functions = [obj]
+    for function in functions:
+        global_names = set()
+        code_objects = [function.__code__]
+        while code_objects:
+            code = code_objects.pop()
+            global_names.update(code.co_names)
+            code_objects.extend(const for const in code.co_consts
+                                if inspect.iscode(const))
+        for global_name in sorted(global_names):
+            if global_name not in function.__globals__:
+                continue
+            value = function.__globals__[global_name]
+            if inspect.isfunction(value) or inspect.isclass(value):
+                get_code_sources(value, filenames, sources)
+            elif isinstance(value, (str, bytes, int, float, tuple, list,
+                                    dict, set, frozenset, re.Pattern)):
+                sources["%s:%s" % (filename, global_name)] = \
+                    get_stable_repr(value)
+
+
+def get_stage_code_version(stage):
+    """Return a hash of the code of given stage, i.e. of the sources of its
+    function and of all functions, classes and constants of the module
+    defining it and of this module which the function uses (see
+    `get_code_sources`), together with the arguments bound to the function
+    (except for those which don't affect the results of the stage). Changes
+    to code which the stage doesn't use therefore don't invalidate it.
+    """
+    function = stage.function
+    arguments = [[], dict()]
+    if isinstance(function, functools.partial):
+        arguments = [list(function.args), { name: value for name, value
+            in function.keywords.items() if name not in UNVERSIONED_ARGUMENTS }]
+        function = function.func
+    filenames = set(os.path.abspath(filename) for filename
+                    in (inspect.getsourcefile(function), __file__))
+    sources = dict()
+    get_code_sources(function, filenames, sources)
+    # Stages using the database also depend on how the writer stores rows
+    if stage.uses_database:
+        get_code_sources(BulkWriter, filenames, sources)
+    version_parts = [sorted(sources.items()), get_stable_repr(arguments)]
+    return hashlib.sha256(
+        json.dumps(version_parts).encode("utf-8")).hexdigest()
+
+
+def get_stage_versions(stages, known_hashes, hashes):
+    """Return a dictionary mapping names of given stages to their versions,
+    consisting of a hash of their code (see `get_stage_code_version`) and a
+    key which changes whenever the code, the contents of the inputs or the
+    key of a dependency change. Hashes of input files are handled as
+    described in `hash_input`.
+    """
+    versions = dict()
+    for stage in stages:
+        code = get_stage_code_version(stage)
+        key_parts = [stage.name, code]
+        key_parts.extend(hash_input(path, known_hashes, hashes)
+                         for path in stage.inputs if path is not None)
+        key_parts.extend(versions[name]["key"]
+                         for name in stage.dependencies if name in versions)
+        key = hashlib.sha256(json.dumps(key_parts).encode("ascii")).hexdigest()
+        versions[stage.name] = { "code": code, "key": key }
+    return versions
+
+
+def read_build_manifest(filename, writer):
+    """Return the build manifest in the file with given name. If there is no
+    such file or tables recorded in it are missing in the database of given
+    bulk writer, an empty manifest is returned (nothing can be reused).
+    """
+    empty_manifest = { "inputs": dict(), "stages": dict(), "tables": [] }
+    if not os.path.exists(filename):
+        return empty_manifest
+    with open(filename, encoding="utf-8") as f:
+        manifest = json.load(f)
+    tables = set(name for (name,) in writer.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'table'").fetchall())
+    if not tables.issuperset(manifest["tables"]):
+        return empty_manifest
+    return manifest
+
+
+def run_stages(stages, writer, jobs=1, incremental=False, build_path=None,
+               profile_path=None):
+    """Run given stages (see `Stage`) on the database of given bulk writer.
+    Stages must be given in an order which satisfies their dependencies.
+    Files needed for the build are kept in the build directory with given
+    path (by default the one of the database directory, see
+    `get_build_path`).
+    Return the reports of all stages (see `run_stage`, profiles are stored in
+    the directory with given path if any) and of merging lanes, in the order
+    in which they have been run.
+
+    Independent lanes of stages (see `assign_stage_lanes`) are run on staging
+    databases in the build directory, concurrently in worker processes if
+    more than one job is allowed. Their output is printed in the order of the
+    lanes, and staging databases are merged into the output database as soon
+    as their lane is finished. Stages which depend on
+    multiple lanes are run once all lanes are merged, they should only write
+    tables of their own. Builds which are neither incremental nor use multiple
+    jobs simply run all stages in the given order on the output database.
+
+    In incremental builds, a manifest in the build directory records the
+    versions of all stages (see `get_stage_versions`) and the hashes of their
+    inputs. Stages whose version is unchanged (and whose outputs still exist)
+    are skipped, their tables in the output database are kept. Since later
+    stages of a lane modify the tables of the first one, the state after the
+    first stage of each lane is saved in a cache directory, so that a lane
+    whose first stage is unchanged resumes from there. The manifest is removed
+    at the start of every build (and only written again by incremental ones),
+    so that it never describes an interrupted or non-incremental build.
+
+    If the connection of the writer traces statements (see
+    `TracingConnection`), so do the connections to the staging databases.
+    """
+    lanes, merged_stages = assign_stage_lanes(stages)
+    writer.flush()
+    if build_path is None:
+        database_list = \
+            writer.cursor.execute("PRAGMA database_list").fetchall()
+        database_path = next(path for _, name, path in database_list
+                             if name == "main")
+        build_path = get_build_path(os.path.dirname(database_path))
+    os.makedirs(build_path, exist_ok=True)
+    manifest_path = os.path.join(build_path, BUILD_MANIFEST_FILENAME)
+    checkpoints_path = os.path.join(build_path, BUILD_CACHE_DIRNAME)
+    if incremental:
+        manifest = read_build_manifest(manifest_path, writer)
+        input_hashes = dict()
+        print("Hashing input files...", end="\r")
+        versions = get_stage_versions(stages, manifest["inputs"], input_hashes)
+        print("Hashing input files... Done.")
+        print()
+    if os.path.exists(manifest_path):
+        os.remove(manifest_path)
+    if not incremental and (jobs <= 1 or len(lanes) <= 1):
+        return run_stage_sequence(stages, writer, profile_path=profile_path)
+
+    def is_unchanged(stage):
+        return (incremental and
+                manifest["stages"].get(stage.name) == versions[stage.name] and
+                all(os.path.exists(path) for path in stage.outputs))
+
+    def format_stage_names(stages):
+        return "stage%s %s" % ("s" if len(stages) > 1 else "",
+            ", ".join("'%s'" % stage.name for stage in stages))
+
+    trace = isinstance(writer.cursor.connection, TracingConnection)
+    # Determine how each lane is run: skipped, resumed or run completely
+    lane_tasks = []
+    for number, lane in enumerate(lanes):
+        if all(is_unchanged(stage) for stage in lane):
+            lane_tasks.append(None)
+            continue
+        checkpoint_path = None
+        checkpoint_key = None
+        resume = False
+        if incremental and len(lane) > 1:
+            checkpoint_path = os.path.join(checkpoints_path, lane[0].name)
+            checkpoint_key = versions[lane[0].name]["key"]
+            resume = (is_unchanged(lane[0]) and
+                      has_checkpoint(checkpoint_key, checkpoint_path))
+        lane_tasks.append((checkpoint_path, checkpoint_key, resume))
+    reports = []
+    concurrent_lanes = sum(task is not None for task in lane_tasks)
+    parallel = jobs > 1 and concurrent_lanes > 1
+    with tempfile.TemporaryDirectory(
+            dir=build_path) as staging_path, \
+            (concurrent.futures.ProcessPoolExecutor(
+                min(jobs, concurrent_lanes)) if parallel
+             else contextlib.nullcontext()) as executor:
+        staging_paths = [os.path.join(staging_path, "stage-%d.sqlite3" % n)
+                         for n in range(len(lanes))]
+        futures = dict()
+        if parallel:
+            for number, (lane, task) in enumerate(zip(lanes, lane_tasks)):
+                if task is not None:
+                    futures[number] = executor.submit(run_stage_lane, lane,
+                        staging_paths[number], writer.batch_size, *task,
+                        profile_path=profile_path, trace=trace)
+        for number, (lane, task) in enumerate(zip(lanes, lane_tasks)):
+            if number > 0:
+                print()
+            if task is None:
+                print("Skipping %s (unchanged since last build)."
+                      % format_stage_names(lane))
+                reports.extend({ "name": stage.name, "status": "skipped" }
+                               for stage in lane)
+                continue
+            if parallel:
+                output, stats, lane_reports, statement_stats = \
+                    futures[number].result()
+                print(output, end="")
+            else:
+                _, stats, lane_reports, statement_stats = run_stage_lane(
+                    lane, staging_paths[number], writer.batch_size, *task,
+                    capture_output=False, profile_path=profile_path,
+                    trace=trace)
+            reports.extend(lane_reports)
+            for table, table_stats in stats.items():
+                total_stats = writer.stats.setdefault(table, [0, 0, 0.0])
+                for index, value in enumerate(table_stats):
+                    total_stats[index] += value
+            if trace:
+                add_statement_stats(writer.cursor.connection, statement_stats)
+            message = "Merging tables of %s into database..." % (
+                format_stage_names(lane))
+            print(message, end="\r")
+            start_time = time.perf_counter()
+            merge_database(writer, staging_paths[number])
+            merge_seconds = time.perf_counter() - start_time
+            reports.append({ "name": "merge", "status": "run",
+                             "stages": [stage.name for stage in lane],
+                             "wall_seconds": merge_seconds })
+            print(message + " Done.")
+    for stage in merged_stages:
+        print()
+        if is_unchanged(stage):
+            print("Skipping %s (unchanged since last build)."
+                  % format_stage_names([stage]))
+            reports.append({ "name": stage.name, "status": "skipped" })
+        else:
+            reports.append(
+                run_stage(stage, writer, profile_path=profile_path))
+    if incremental:
+        writer.cursor.connection.commit()
+        tables = [name for (name,) in writer.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table' "
+            "AND name NOT LIKE 'sqlite%' ORDER BY name").fetchall()]
+        with open(manifest_path, "w", encoding="utf-8") as f:
+            json.dump({ "inputs": input_hashes, "stages": versions,
+                        "tables": tables }, f, indent=4)
+    return reports
+
+
+def write_build_report(filename, stage_reports, statement_stats=None, **info):
+    """Write a build report in JSON format into the file with given name. It
+    consists of given info (e.g. settings and total times), the peak memory
+    usage of the main process and given reports of stages (see `run_stages`).
+    Stats of traced statements are included if given, ordered by their time.
+    """
+    report = dict(info)
+    report["peak_memory_mb"] = peak_memory_usage()
+    report["stages"] = stage_reports
+    if statement_stats is not None:
+        report["statements"] = [
+            { "statement": statement, "calls": calls,
+              "executions": executions, "seconds": seconds, "rows": rows }
+            for statement, (calls, executions, seconds, rows) in sorted(
+                statement_stats.items(), key=lambda item: -item[1][2])]
+    with open(filename, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=4)
+
+
+def write_content_stats(writer, queries):
+    """Precompute aggregates of the content needed by the program at startup
+    and store them (encoded as JSON) in a table 'content_stats' using given
+    bulk writer. Queries are given by name of the aggregate. A query with a
+    single column yields a single value, a query with two columns yields a
+    mapping from values of the first column to values of the second one.
+    Queries on tables which don't exist in the database are skipped.
+    """
+    writer.execute("DROP TABLE IF EXISTS content_stats")
+    writer.execute("""
+        CREATE TABLE content_stats (
+            name TEXT PRIMARY KEY,
+            value TEXT
+        )""")
+    for name, query in queries.items():
+        try:
+            cursor = writer.execute(query)
+        except sqlite3.OperationalError as error:
+            if not str(error).startswith("no such table"):
+                raise
+            continue
+        rows = cursor.fetchall()
+        if len(cursor.description) == 1:
+            value = rows[0][0] if rows else None
+        else:
+            value = dict(rows)
+        writer.insert("content_stats", (name, json.dumps(value)))
+    writer.flush()
+
+
+def write_stroke_store(filename, character_to_strokes):
+    """Write a SQLite database with given filename containing one row per
+    character, so that the strokes of a single character can be looked up
+    without loading all of them. Strokes are given as JSON strings.
+    An existing file is replaced.
+    """
+    if os.path.exists(filename):
+        os.remove(filename)
+    connection = sqlite3.connect(filename)
+    apply_build_pragmas(connection)
+    # Rows are too large for a WITHOUT ROWID table to be compact
+    connection.execute("""
+        CREATE TABLE strokes (
+            character TEXT PRIMARY KEY,
+            strokes TEXT
+        )""")
+    connection.executemany("INSERT INTO strokes VALUES (?, ?)",
+                           sorted(character_to_strokes.items()))
+    connection.commit()
+    connection.close()
+
+
+def read_stroke_store(filename):
+    """Return a dictionary mapping characters to their strokes (as JSON
+    strings) from the stroke store with given filename.
+    """
+    connection = sqlite3.connect(filename)
+    try:
+        return dict(connection.execute(
+            "SELECT character, strokes FROM strokes ORDER BY character"))
+    finally:
+        connection.close()
+
+
+def write_strokes_json(filename, character_to_strokes):
+    """Write strokes (given as JSON strings) into a single JSON object keyed
+    by character, one entry per line. This is the format of stroke files
+    read by older program versions.
+    """
+    with open(filename, "w", encoding="utf-8") as f:
+        f.write("{\n")
+        for number, character in enumerate(sorted(character_to_strokes)):
+            if number > 0:
+                f.write(",\n")
+            f.write(json.dumps(character, ensure_ascii=False))
+            f.write(":")
+            f.write(character_to_strokes[character])
+        f.write("\n}\n")
+
+
+def write_legacy_strokes_json(store_filename, filename):
+    """Store the strokes from the stroke store with given filename in a single
+    JSON file with given filename as well (see `write_strokes_json`).
+    """
+    print("Storing strokes to file '%s'..." % filename, end="\r")
+    write_strokes_json(filename, read_stroke_store(store_filename))
+    print("Storing strokes to file '%s'... Done." % filename)
+
+
+def encode_id_list(ids):
+    """Encode a list of integer IDs as bytes, keeping their order. Each ID is
+    stored as difference to the previous one (zigzag-encoded, so that small
+    negative differences stay small as well) using a variable number of bytes
+    with 7 bits each (highest bit is set on all bytes except the last one).
+    """
+    output = bytearray()
+    previous = 0
+    for value in ids:
+        delta = value - previous
+        previous = value
+        number = delta << 1 if delta >= 0 else ((-delta) << 1) - 1
+        while number >= 0x80:
+            output.append((number & 0x7F) | 0x80)
+            number >>= 7
+        output.append(number)
+    return bytes(output)
+
+
+def decode_id_list(data):
+    """Decode a list of integer IDs encoded with `encode_id_list`."""
+    ids = []
+    previous = 0
+    number = 0
+    shift = 0
+    for byte in data:
+        number |= (byte & 0x7F) << shift
+        if byte & 0x80:
+            shift += 7
+            continue
+        previous += number >> 1 if number & 1 == 0 else -((number + 1) >> 1)
+        ids.append(previous)
+        number = 0
+        shift = 0
+    return ids
@@ -1,24 +1,32 @@
+-- Indices are prebuilt in the content database by the data generator, the
+-- program only creates those missing in older content databases
+
 -- Following are used to make searches without leading wildcard very efficient
-CREATE INDEX words_word ON words (word COLLATE NOCASE);
-CREATE INDEX translations_translation ON translations (translation COLLATE NOCASE);
-CREATE INDEX readings_reading ON readings (reading COLLATE NOCASE);
+CREATE INDEX IF NOT EXISTS words_word ON words (word COLLATE NOCASE);
+CREATE INDEX IF NOT EXISTS translations_translation ON translations (translation COLLATE NOCASE);
+CREATE INDEX IF NOT EXISTS readings_reading ON readings (reading COLLATE NOCASE);
 
 -- Following are used to efficiently get meanings + readings given dictionary id
-CREATE INDEX meanings_id ON meanings (id);
-CREATE INDEX readings_id ON readings (id);
+CREATE INDEX IF NOT EXISTS meanings_id ON meanings (id);
+CREATE INDEX IF NOT EXISTS readings_id ON readings (id);
 
 -- Following index is not needed since words are already in 'dictionary' table
--- CREATE INDEX words_id ON words (id);
+-- CREATE INDEX IF NOT EXISTS words_id ON words (id);
 
 -- Following indices are probably not worth it since names aren't searched often
--- CREATE INDEX proper_names_name ON proper_names (name COLLATE NOCASE);
--- CREATE INDEX proper_names_reading ON proper_names (reading COLLATE NOCASE);
+-- CREATE INDEX IF NOT EXISTS proper_names_name ON proper_names (name COLLATE NOCASE);
+-- CREATE INDEX IF NOT EXISTS proper_names_reading ON proper_names (reading COLLATE NOCASE);
+
+CREATE INDEX IF NOT EXISTS radicals_radical ON radicals (radical ASC);
+CREATE INDEX IF NOT EXISTS radicals_strokes ON radicals (strokes ASC);
 
-CREATE INDEX radicals_radical ON radicals (radical ASC);
-CREATE INDEX radicals_strokes ON radicals (strokes ASC);
+CREATE INDEX IF NOT EXISTS kanji_entry ON kanji (entry ASC);
+CREATE INDEX IF NOT EXISTS kanji_grade ON kanji (grade ASC);
+CREATE INDEX IF NOT EXISTS kanji_strokes ON kanji (strokes ASC);
+CREATE INDEX IF NOT EXISTS kanji_frequency ON kanji (frequency ASC);
+CREATE INDEX IF NOT EXISTS kanji_radical_id on kanji (radical_id ASC);
 
-CREATE INDEX kanji_entry ON kanji (entry ASC);
-CREATE INDEX kanji_grade ON kanji (grade ASC);
-CREATE INDEX kanji_strokes ON kanji (strokes ASC);
-CREATE INDEX kanji_frequency ON kanji (frequency ASC);
-CREATE INDEX kanji_radical_id on kanji (radical_id ASC);
+-- Following are used to look up kanji by reading or meaning (columns in these
+-- tables use NOCASE collation, so searches without leading wildcard use them)
+CREATE INDEX IF NOT EXISTS kanji_readings_reading ON kanji_readings (reading, type);
+CREATE INDEX IF NOT EXISTS kanji_meanings_meaning ON kanji_meanings (meaning);
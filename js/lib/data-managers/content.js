@@ -96,6 +96,9 @@ module.exports = function (paths, modules) {
     content.unload = function (language, secondaryLanguage) {
         const languagePair = `${language}-${secondaryLanguage}`;
         if (dataMap.hasOwnProperty(languagePair)) {
+            // Close database connections kept open by the content module
+            if (dataMap[languagePair].close !== undefined)
+                dataMap[languagePair].close();
             delete dataMap[languagePair];
         }
     };
@@ -114,6 +117,10 @@ module.exports = function (paths, modules) {
      * implemented in the language-specific code module. It takes the query
      * and an arbitrary options object as arguments and returns a list of
      * matching entries of the form { id, translations }.
+     * The query passed to the search function additionally contains a list
+     * "leadingWildcards" which tells for each translation whether the user
+     * started it with a wildcard (all translations are surrounded by
+     * wildcards before they are passed to the search function).
      * @param {Object} query - Object of form { translations, words }.
      * @returns {Array}
      */
@@ -160,6 +167,10 @@ module.exports = function (paths, modules) {
             translations: query.translations,
             words: query.words
         };
+        // Remember which translations start with a wildcard given by the user
+        // (search functions may treat the implicitly added one differently)
+        query.leadingWildcards = query.translations.map(
+            (t) => t.startsWith("%"));
         // Add wildcard to both sides of each translation
         query.translations = query.translations.map(
             (t) => (t.startsWith("%")?"":"%") + t + (t.endsWith("%")?"":"%"));
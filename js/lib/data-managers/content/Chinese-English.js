@@ -62,6 +62,40 @@ module.exports = async function (paths, contentPaths, modules) {
         }
     }
 
+    const toneMarkRegex = /[āáǎàēéěèīíǐìōóǒòūúǔùǖǘǚǜ]/
+
+    /**
+     * Return an SQL condition and its argument for matching dictionary entries
+     * whose pinyin (or pinyin of one of their variants) matches given words.
+     * Pinyin search keys are precomputed by the data generator:
+     *   toneless: "beijing", marked: "běijīng", syllables: "bei3 jing1"
+     * Key columns are indexed, so patterns without leading wildcard are fast.
+     * @param {Array[String]} words - Pinyin with tone numbers, tone marks or
+     *     without tones, possibly containing SQL wildcards.
+     * @returns {Array} Of the form [condition, argument].
+     */
+    function getPinyinCondition(words) {
+        let column
+        let pattern = words.join(" ").toLowerCase()
+        if (toneMarkRegex.test(pattern)) {
+            column = "marked"
+            pattern = pattern.replace(/[\s']/g, "")
+        } else if (words.length === 1 && !/[1-5']/.test(pattern)) {
+            column = "toneless"
+        } else {
+            // Syllables with tone numbers are separated by spaces (tone
+            // numbers mark the end of a syllable, neutral tones are omitted)
+            column = "syllables"
+            pattern = pattern.replace(/'/g, " ")
+                .replace(/([1-5])(?=[^\s%])/g, "$1 ")
+                .split(/\s+/).filter(s => s.length > 0)
+                .map(s => /[1-5%]$/.test(s) ? s : s + "%")
+                .join(" ").replace(/5/g, "")
+        }
+        return [`id IN (SELECT id FROM pinyin_keys WHERE ${column} LIKE ?)`,
+                pattern]
+    }
+
     // Used by the content.searchDictionary function
     async function searchFunction(query) {
         if (query.words.length === 0 && query.translations.length === 0)
@@ -69,23 +103,27 @@ module.exports = async function (paths, contentPaths, modules) {
         const whereClauses = []
         const queryArguments = []
         if (query.words) {
+            // Words written in latin letters (incl. tone marks) are pinyin
+            const pinyinWords = []
             for (const word of query.words) {
                 const containsNoHanzi =
-                    word.split("").every(c => c.codePointAt(0) < 256)
-                const sqlFields = []
-                const sqlArgs = []
+                    word.split("").every(c => c.codePointAt(0) < 0x250)
                 if (containsNoHanzi) {
-                    sqlFields.push("pinyin", "(';' || variants || ';')")
-                    sqlArgs.push(word, `%|${word};%`)
-                } else {
-                    sqlFields.push(
-                        "simp", "trad", "(';' || variants || ';')", "variants")
-                    sqlArgs.push(word, word, `%;${word}|%`, `%|${word}|%`)
+                    pinyinWords.push(word)
+                    continue
                 }
+                const sqlFields = [
+                    "simp", "trad", "(';' || variants || ';')", "variants"]
+                const sqlArgs = [word, word, `%;${word}|%`, `%|${word}|%`]
                 const sql = sqlFields.map(p => p + " LIKE ?").join(" OR ")
                 whereClauses.push("(" + sql + ")")
                 queryArguments.push(...sqlArgs)
             }
+            if (pinyinWords.length > 0) {
+                const [condition, argument] = getPinyinCondition(pinyinWords)
+                whereClauses.push(condition)
+                queryArguments.push(argument)
+            }
         }
         if (query.translations) {
             for (const translation of query.translations) {
@@ -144,22 +182,34 @@ module.exports = async function (paths, contentPaths, modules) {
     async function guessDictionaryIdForVocabItem(word) {
         const readings = await modules.vocab.getReadings(word)
         if (readings.length === 0) return guessDictionaryIdForNewWord(word)
+        // Precomputed tone-mark pinyin is lowercase
+        const lowercaseReadings = readings.map(r => r.toLowerCase())
         let rows = await data.query(
-            "SELECT trad, simp, pinyin, variants FROM dictionary " +
+            "SELECT id, trad, simp, pinyin, variants FROM dictionary " +
             "WHERE (simp = ? OR trad = ? " +
             "OR (';' || variants || ';') LIKE ? OR variants LIKE ?) " +
             "ORDER BY hsk ASC, net_rank ASC",
             word, word, `;${word}|`, `|${word}|`)
         if (rows.length === 0) return null
+        // Get pinyin (converted to tone marks and lowercased) of these
+        // entries and their variants from the precomputed search keys
+        const keyRows = await data.query(
+            "SELECT id, position, marked FROM pinyin_keys WHERE id IN " +
+            `(${rows.map(() => "?").join(", ")})`, ...rows.map(row => row.id))
+        const convertedPinyin = new Map()
+        for (const { id, position, marked } of keyRows) {
+            convertedPinyin.set(`${id}|${position}`, marked)
+        }
         for (const row of rows) {
-            const wordsAndReadings = [[row.trad, row.simp, row.pinyin]]
+            const wordsAndReadings = [[row.trad, row.simp]]
             if (row.variants !== null) {
                 wordsAndReadings.push(
                     ...row.variants.split(";").map(v => v.split("|")))
             }
-            const isMatching = wordsAndReadings.some(([trad, simp, pinyin]) =>
+            const isMatching = wordsAndReadings.some(([trad, simp], position) =>
                 (word === trad || word === simp) &&
-                readings.some(reading => reading === pinyin.toPinyin()))
+                lowercaseReadings.includes(
+                    convertedPinyin.get(`${row.id}|${position}`)))
             if (isMatching)
                 return row.trad + "|" + row.simp + "|" + row.pinyin
         }
@@ -228,32 +278,40 @@ module.exports = async function (paths, contentPaths, modules) {
         return row
     }
 
+    /**
+     * Return a list of strokes for given hanzi (each of the form
+     * { stroke, parts, start }), or null if there is no stroke info for it.
+     */
+    async function getHanziStrokes(hanzi) {
+        const rows = await strokesDb.all(
+            "SELECT strokes FROM strokes WHERE character = ?", hanzi)
+        return rows.length > 0 ? JSON.parse(rows[0].strokes) : null
+    }
+
     async function isKnownHanzi(hanzi) {
         const rows = await data.query(
             "SELECT COUNT(hanzi) AS amount FROM hanzi WHERE hanzi = ?", hanzi)
         return rows[0].amount > 0
     }
 
-    function getExampleWordsForHanzi(hanzi) {
-        return modules.content.searchDictionary({ words: ["*" + hanzi + "*"] })
+    async function getExampleWordsForHanzi(hanzi) {
+        const rows = await data.query(
+            `SELECT d.trad, d.simp, d.pinyin
+             FROM example_words e JOIN dictionary d ON d.id = e.id
+             WHERE e.hanzi = ? ORDER BY e.position`, hanzi)
+        return rows.map(({ trad, simp, pinyin }) =>
+            trad + "|" + simp + "|" + pinyin)
     }
 
     /**
      * Load content from database into an in-memory database.
      */
     async function loadDatabaseIntoMemory() {
-        const db = utility.promisifyDatabase(new sqlite3.Database(":memory:"));
-        // Temporarily attach content data database to in-memory one,
-        // create tables and copy over data
-        await db.run("ATTACH DATABASE ? AS ?",
-            contentPaths.database, "content");
-        const tablesInfo = await db.all(
-            "SELECT name, sql FROM content.sqlite_master WHERE type='table'");
-        for (const { name, sql } of tablesInfo) {
-            await db.exec(sql);
-            await db.run(`INSERT INTO ${name} SELECT * FROM content.${name}`);
-        }
-        await db.run("DETACH DATABASE ?", "content");
+        const memoryDb = new sqlite3.Database(":memory:")
+        // Copy content database (including its prebuilt indices) into the
+        // in-memory database page by page
+        await utility.restoreDatabaseFromFile(memoryDb, contentPaths.database)
+        const db = utility.promisifyDatabase(memoryDb)
         // Attach user database (to later run SQL queries involving both db's),
         // provide function to re-attach database to access the most recent data
         await db.run("ATTACH DATABASE ? AS ?",
@@ -268,25 +326,33 @@ module.exports = async function (paths, contentPaths, modules) {
     }
 
     const { queryFunction, updateUserData } = await loadDatabaseIntoMemory();
+    // Strokes are only needed for one hanzi at a time, keep them on disk
+    const strokesDb = utility.promisifyDatabase(new sqlite3.Database(
+        contentPaths.hanziStrokes, sqlite3.OPEN_READONLY))
+
+    // Aggregates over the content are precomputed by the data generator
+    const contentStats = {}
+    const statsRows = await queryFunction(
+        "SELECT name, value FROM content_stats")
+    for (const { name, value } of statsRows) {
+        contentStats[name] = JSON.parse(value)
+    }
 
     // Get the amount of words per HSK level
-    const hskQuery = "SELECT COUNT(*) AS c FROM dictionary WHERE hsk = ?"
-    const hskSizePerLevel = {}
+    const wordsPerHskLevel = contentStats.words_per_hsk_level || {}
     const hskSizeAccumulative = {}
     for (let level = 1; level <= 7; ++level) {
-        hskSizePerLevel[level] = (await queryFunction(hskQuery, level))[0].c
-        hskSizeAccumulative[level] = level === 1 ? hskSizePerLevel[level] :
-            hskSizeAccumulative[level - 1] + hskSizePerLevel[level]
+        const size = wordsPerHskLevel[level] || 0
+        hskSizeAccumulative[level] = level === 1 ? size :
+            hskSizeAccumulative[level - 1] + size
     }
     // Register a non-existing HSK level for entries that don't have one
     hskSizeAccumulative[8] = hskSizeAccumulative[7] + 1000
 
-    // Calculate the maximum value for all frequency indicators
-    const maxValueRows = await queryFunction(
-        "SELECT MAX(net_rank) as maxNetRank FROM dictionary")
+    // Maximum value for all frequency indicators
     const maxFreqValues = {
         hskLevel: 7,
-        netRank: maxValueRows[0].maxNetRank
+        netRank: contentStats.max_net_rank
     }
 
     // Define function to require a new version of a file (not cached version)
@@ -298,11 +364,11 @@ module.exports = async function (paths, contentPaths, modules) {
     data = Object.freeze({
         query: queryFunction,
         updateUserData,
+        close: () => strokesDb.close(),
 
         // Data objects
         hskSizeAccumulative: Object.freeze(hskSizeAccumulative),
         maxFreqValues: Object.freeze(maxFreqValues),
-        hanziStrokes: Object.freeze(requireNew(contentPaths.hanziStrokes)),
 
         // Dictionary related
         containsDictionary: true,
@@ -318,6 +384,7 @@ module.exports = async function (paths, contentPaths, modules) {
         isKnownHanzi,
         getExampleWordsForHanzi,
         getHanziInfo,
+        getHanziStrokes,
         // getHanziMeanings,
         // getHanziLists,
         // searchHanzi
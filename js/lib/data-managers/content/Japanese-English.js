@@ -5,6 +5,7 @@ const fs = require("fs");
 
 module.exports = async function (paths, contentPaths, modules) {
     let data;
+    let hasTranslationsIndex = false;
 
     function isKnownKanji(character) {
         return data.query(
@@ -48,6 +49,22 @@ module.exports = async function (paths, contentPaths, modules) {
         });
     };
 
+    /**
+     * Return a list of strokes for given kanji (each of the form
+     * { stroke, parts }), or null if there is no stroke info for the kanji.
+     */
+    async function getKanjiStrokes(kanji) {
+        const rows = await strokesDb.all(
+            "SELECT strokes FROM strokes WHERE character = ?", kanji);
+        return rows.length > 0 ? JSON.parse(rows[0].strokes) : null;
+    }
+
+    async function getExampleWordIds(kanji) {
+        const rows = await data.query(
+            "SELECT ids FROM example_words WHERE kanji = ?", kanji);
+        return rows.length > 0 ? utility.decodeIdList(rows[0].ids) : [];
+    }
+
     async function getKanjiLists({
             splittingCriterion, includeAdded=true, includeJouyou=true,
             includeJinmeiyou=true, includeHyougai=true, stepSize }={}) {
@@ -595,20 +612,22 @@ module.exports = async function (paths, contentPaths, modules) {
                 `SELECT entry, frequency,
                         (meanings || ';' || meanings_search) AS allMeanings
                  FROM kanji
-                 WHERE (';' || meanings || ';') LIKE '%;${meaning};%' 
-                 OR (';' || meanings_search || ';') LIKE '%;${meaning};%'`));
+                 WHERE entry IN (SELECT kanji FROM kanji_meanings
+                                 WHERE meaning LIKE ?)`, meaning));
         }
         for (const onYomi of query.onYomi) {
             promises.push(data.query(
                 `SELECT entry, frequency FROM kanji
-                 WHERE (';' || on_yomi || ';') LIKE '%;${onYomi};%'
-                 OR (';' || on_yomi_search || ';') LIKE '%;${onYomi};%'`));
+                 WHERE entry IN (SELECT kanji FROM kanji_readings
+                                 WHERE reading LIKE ? AND type = 'on')`,
+                onYomi));
         }
         for (const kunYomi of query.kunYomi) {
             promises.push(data.query(
                 `SELECT entry, frequency FROM kanji
-                 WHERE (';' || kun_yomi || ';') LIKE '%;${kunYomi};%'
-                 OR (';' || kun_yomi_search || ';') LIKE '%;${kunYomi};%'`));
+                 WHERE entry IN (SELECT kanji FROM kanji_readings
+                                 WHERE reading LIKE ? AND type = 'kun')`,
+                kunYomi));
         }
         const subMatches = await Promise.all(promises);
 
@@ -694,6 +713,32 @@ module.exports = async function (paths, contentPaths, modules) {
         }
     }
 
+    /**
+     * Convert a pattern for matching translations (containing SQL wildcards)
+     * into a full-text query matching the words in the pattern as a phrase.
+     * The last word may be incomplete if the pattern ends with a wildcard.
+     * Note that the phrase must start at a word boundary, so a leading
+     * wildcard is only dropped if it has been added implicitly. If the user
+     * started the pattern with a wildcard, it must match within words.
+     * @param {String} pattern - Pattern as used with the LIKE operator.
+     * @param {Boolean} leadingWildcard - Whether the pattern entered by the
+     *     user started with a wildcard.
+     * @returns {String|null} Null if the pattern contains wildcards within
+     *     the text, starts with a wildcard entered by the user or contains no
+     *     words, which can't be expressed as full-text query.
+     */
+    function translationPatternToFtsQuery(pattern, leadingWildcard) {
+        if (leadingWildcard) return null;
+        let text = pattern.startsWith("%") ? pattern.slice(1) : pattern;
+        const isPrefix = text.endsWith("%");
+        if (isPrefix) text = text.slice(0, -1);
+        if (text.includes("%") || text.includes("_")) return null;
+        const words = text.toLowerCase().split(/[^\p{L}\p{N}]+/u)
+                          .filter((word) => word.length > 0);
+        if (words.length === 0) return null;
+        return `"${words.join(" ")}"` + (isPrefix ? "*" : "");
+    }
+
     async function searchDictionaryVariant1(query) {
         if (query.words.length === 0 && query.translations.length === 0)
             return [];
@@ -722,12 +767,27 @@ module.exports = async function (paths, contentPaths, modules) {
                 + Array(query.words.length).fill("word LIKE ?")
                   .join(" AND ") + ")");
         }
-        // Matching translations
+        // Matching translations (use full-text index to find candidates
+        // if possible, otherwise all translations need to be scanned)
         if (query.translations.length > 0) {
-            selectClauses.push(
-                "(SELECT DISTINCT id FROM translations WHERE "
-                + Array(query.translations.length).fill("translation LIKE ?")
-                  .join(" AND ") + ")");
+            const likeClauses = Array(query.translations.length)
+                .fill("translation LIKE ?").join(" AND ");
+            const leadingWildcards = query.leadingWildcards !== undefined ?
+                query.leadingWildcards : query.translations.map(() => false);
+            const ftsQueries = hasTranslationsIndex ?
+                query.translations.map((pattern, i) =>
+                    translationPatternToFtsQuery(pattern, leadingWildcards[i]))
+                : [null];
+            if (!ftsQueries.includes(null)) {
+                selectClauses.push(
+                    "(SELECT DISTINCT id FROM translations_fts WHERE "
+                    + "translations_fts MATCH ? AND " + likeClauses + ")");
+                queryArguments.push(ftsQueries.join(" AND "));
+            } else {
+                selectClauses.push(
+                    "(SELECT DISTINCT id FROM translations WHERE "
+                    + likeClauses + ")");
+            }
             queryArguments.push(...query.translations);
         }
 
@@ -857,25 +917,17 @@ module.exports = async function (paths, contentPaths, modules) {
      * @returns {Function} - Function to query the in-memory database.
      */
     async function loadDatabaseIntoMemory() {
-        const db = utility.promisifyDatabase(new sqlite3.Database(":memory:"));
-        // Attach content and user data database to in-memory one
-        await db.run("ATTACH DATABASE ? AS ?",
-            contentPaths.database, "content");
-        await db.run("ATTACH DATABASE ? AS ?",
-            paths.languageData("Japanese").database, "trainer");
-        // Create tables of content database in in-memory database and
-        // copy over all data
-        const tablesInfo = await db.all(
-            "SELECT name, sql FROM content.sqlite_master WHERE type='table'");
-        for (const { name, sql } of tablesInfo) {
-            await db.exec(sql);
-            await db.run(`INSERT INTO ${name} SELECT * FROM content.${name}`);
-        }
-        // Create indices of content database in in-memory database
+        const memoryDb = new sqlite3.Database(":memory:");
+        // Copy content database (including its prebuilt indices) into the
+        // in-memory database page by page, so that nothing has to be rebuilt
+        await utility.restoreDatabaseFromFile(memoryDb, contentPaths.database);
+        const db = utility.promisifyDatabase(memoryDb);
+        // Only create indices missing in the content database (if any)
         const createIndicesSql = fs.readFileSync(paths.japaneseIndices, "utf8");
         await db.exec(createIndicesSql);
-        // Detach content database again
-        await db.run("DETACH DATABASE ?", "content");
+        // Attach user data database to in-memory one
+        await db.run("ATTACH DATABASE ? AS ?",
+            paths.languageData("Japanese").database, "trainer");
         const queryFunction = (query, ...params) => db.all(query, ...params);
         const updateUserData = async () => {
             await db.run("DETACH DATABASE ?", "trainer");
@@ -886,70 +938,68 @@ module.exports = async function (paths, contentPaths, modules) {
     }
 
     const { queryFunction, updateUserData } = await loadDatabaseIntoMemory();
-    const [amountPerGrade, amountPerLevel] = await Promise.all([
-        // Get information about kanji grades and jlpt levels
-        queryFunction(`SELECT grade, COUNT(*) AS amount FROM kanji
-                       GROUP BY grade`),
-        queryFunction(`SELECT jlpt AS level, COUNT(*) AS amount
-                       FROM kanji WHERE jlpt IS NOT NULL
-                       GROUP BY jlpt`)
-    ]);
+    // Strokes are only needed for one kanji at a time, keep them on disk
+    const strokesDb = utility.promisifyDatabase(new sqlite3.Database(
+        contentPaths.kanjiStrokes, sqlite3.OPEN_READONLY));
+    // Older content versions don't contain a full-text index for translations
+    const [{ amount: numTranslationsIndices }] = await queryFunction(
+        `SELECT COUNT(*) AS amount FROM sqlite_master
+         WHERE type = 'table' AND name = 'translations_fts'`);
+    hasTranslationsIndex = numTranslationsIndices > 0;
+    // Aggregates over the content are precomputed by the data generator
+    const contentStats = {};
+    const statsRows = await queryFunction(
+        "SELECT name, value FROM content_stats");
+    for (const { name, value } of statsRows) {
+        contentStats[name] = JSON.parse(value);
+    }
     // Get the amount of words per JLPT level
-    const jlptQuery="SELECT COUNT(*) AS c FROM dictionary WHERE jlpt_level = ?";
-    const jlptSizePerLevel = {};
+    const wordsPerJlptLevel = contentStats.words_per_jlpt_level || {};
     const jlptSizeAccumulative = {};
     for (let level = 5; level >= 1; --level) {
-        jlptSizePerLevel[level] = (await queryFunction(jlptQuery, level))[0].c;
-        jlptSizeAccumulative[level] = level === 5 ? jlptSizePerLevel[level] :
-            jlptSizeAccumulative[level + 1] + jlptSizePerLevel[level];
+        const size = wordsPerJlptLevel[level] || 0;
+        jlptSizeAccumulative[level] = level === 5 ? size :
+            jlptSizeAccumulative[level + 1] + size;
     }
     // Register a non-existing JLPT level for entries that don't have one
     jlptSizeAccumulative[0] = jlptSizeAccumulative[1] + 1000
-    // Create mapping from jouyou grade to amount
-    const kanjiPerGrade = {};
-    for (const { grade, amount } of amountPerGrade) {
-        kanjiPerGrade[grade] = amount;
-    }
-    // Create mapping from jlpt level to amount
-    const kanjiPerJlpt = {};
-    for (const { level, amount } of amountPerLevel) {
-        kanjiPerJlpt[level] = amount;
-    }
+    // Mappings from jouyou grade and jlpt level to amount of kanji
+    const kanjiPerGrade = contentStats.kanji_per_grade || {};
+    const kanjiPerJlpt = contentStats.kanji_per_jlpt_level || {};
     // Define function to require a new version of a file (not cached version)
     function requireNew(path) {
         delete require.cache[require.resolve(path)];
         return require(path);
     }
-    // Calculate the maximum value for all frequency indicators
-    const maxValueRows = await queryFunction(
-        "SELECT MAX(news_rank) as mn, MAX(book_rank) as mb FROM dictionary")
+    // Maximum value for all frequency indicators
     const maxFreqValues = {
-        newsRank: maxValueRows[0].mn,
-        bookRank: maxValueRows[0].mb
+        newsRank: contentStats.max_news_rank,
+        bookRank: contentStats.max_book_rank
     }
     // Gather all the content into a frozen object
     data = Object.freeze({
         query: queryFunction,
         updateUserData,
+        close: () => strokesDb.close(),
 
         // Data objects
         maxFreqValues: Object.freeze(maxFreqValues),
         numKanjiPerGrade: Object.freeze(kanjiPerGrade),
         numKanjiPerJlptLevel: Object.freeze(kanjiPerJlpt),
         jlptSizeAccumulative: Object.freeze(jlptSizeAccumulative),
-        kanjiStrokes: Object.freeze(requireNew(contentPaths.kanjiStrokes)),
         numericKanji: Object.freeze(requireNew(contentPaths.numbers)),
         counterKanji: Object.freeze(requireNew(contentPaths.counters)),
         codeToText: Object.freeze(requireNew(contentPaths.dictCodeToText)),
         nameTagToText: Object.freeze(requireNew(contentPaths.nameTagToText)),
         kokujiList: Object.freeze(
             new Set(fs.readFileSync(contentPaths.kokujiList, "utf8"))),
-        exampleWordIds: Object.freeze(requireNew(contentPaths.exampleWordIds)),
 
         // Kanji related
         isKnownKanji,
         getKanjiInfo,
         getKanjiMeanings,
+        getKanjiStrokes,
+        getExampleWordIds,
         getKanjiLists,
         searchKanji,
 
@@ -197,19 +197,18 @@ module.exports = function (basePath) {
         "Japanese": {
             "English": {
                 database: "Japanese-English.sqlite3",
-                kanjiStrokes: "kanji-strokes.json",
+                kanjiStrokes: "kanji-strokes.sqlite3",
                 numbers: "numeric-kanji.json",
                 counters: "counter-kanji.json",
                 dictCodeToText: "dict-code-to-text.json",
                 nameTagToText: "name-tag-to-text.json",
-                kokujiList: "kokuji.txt",
-                exampleWordIds: "example-words-index.json"
+                kokujiList: "kokuji.txt"
             }
         },
         "Chinese": {
             "English": {
                 database: "Chinese-English.sqlite3",
-                hanziStrokes: "hanzi-strokes.json"
+                hanziStrokes: "hanzi-strokes.sqlite3"
             }
         }
     };
@@ -1155,6 +1155,53 @@ function promisifyDatabase(db) {
     return dbInterface;
 }
 
+/**
+ * Decode a list of integer IDs stored as bytes by the content generator.
+ * Each ID is stored as difference to the previous one (zigzag-encoded) using
+ * a variable number of bytes with 7 bits each (highest bit is set on all
+ * bytes except the last one).
+ * @param {Buffer|Uint8Array} bytes
+ * @returns {Array[Number]}
+ */
+function decodeIdList(bytes) {
+    const ids = [];
+    let previous = 0;
+    let number = 0;
+    let factor = 1;
+    for (const byte of bytes) {
+        number += (byte & 0x7F) * factor;
+        if (byte & 0x80) {
+            factor *= 128;
+            continue;
+        }
+        previous += number % 2 === 0 ? number / 2 : -(number + 1) / 2;
+        ids.push(previous);
+        number = 0;
+        factor = 1;
+    }
+    return ids;
+}
+
+/**
+ * Copy all pages of the database file at given path into the main database
+ * of the given sqlite3 database object (e.g. an in-memory database).
+ * Prebuilt indices and query planner statistics are copied along with data.
+ * @param {sqlite3.Database} db
+ * @param {String} filepath
+ * @returns {Promise}
+ */
+function restoreDatabaseFromFile(db, filepath) {
+    return new Promise((resolve, reject) => {
+        const backup = db.backup(filepath, "main", "main", false, (err) => {
+            if (err) return reject(err);
+            backup.step(-1, (err) => {
+                if (err) return reject(err);
+                backup.finish((err) => err ? reject(err) : resolve());
+            });
+        });
+    });
+}
+
 // Used in the function `sortMatches` below
 function isMatchType(matchType, queryValue, entryValue) {
     const cleanedQuery = queryValue.replace(/^%+/, "").replace(/%+$/, "");
@@ -1399,6 +1446,8 @@ module.exports.getTimeline = getTimeline;
 module.exports.getTimelineMarkers = getTimelineMarkers;
 module.exports.getDistantColors = getDistantColors;
 module.exports.promisifyDatabase = promisifyDatabase;
+module.exports.restoreDatabaseFromFile = restoreDatabaseFromFile;
+module.exports.decodeIdList = decodeIdList;
 module.exports.sortMatches = sortMatches;
 
 // DOM related functions
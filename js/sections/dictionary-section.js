@@ -279,8 +279,9 @@ async function processWordQuery(query) {
 const searchFunction = (query, type, category) => {
     const searchProperNames = category === "names"
     if (type === "word") {
+        // Latin letters (including pinyin tone marks) are below U+0250
         const containsNoHanzi =
-            query.split("").every(c => c.codePointAt(0) < 256)
+            query.split("").every(c => c.codePointAt(0) < 0x250)
         if (dataManager.currentLanguage === "Chinese" && containsNoHanzi) {
             // Interpret "v" as "ü" in pinyin searches
             query = query.replace("v", "ü")
@@ -117,7 +117,7 @@ class KanjiInfoPanel extends Widget {
             viewElement: this.$("example-words"),
             getData: async (char) => {
                 if (dataManager.currentLanguage === "Japanese") {
-                    return dataManager.content.exampleWordIds[char]
+                    return dataManager.content.getExampleWordIds(char)
                 } else {
                     return dataManager.content.getExampleWordsForHanzi(char)
                 }
@@ -410,17 +410,20 @@ class KanjiInfoPanel extends Widget {
         }
     }
 
-    displayStrokeGraphics() {
+    async displayStrokeGraphics() {
         if (this.$("kanji").isHidden()) return;
-        const kanjiStrokes = dataManager.currentLanguage === "Japanese" ?
-            dataManager.content.kanjiStrokes : dataManager.content.hanziStrokes
+        const kanji = this.currentKanji;
+        const strokes = dataManager.currentLanguage === "Japanese" ?
+            await dataManager.content.getKanjiStrokes(kanji) :
+            await dataManager.content.getHanziStrokes(kanji);
+        // Another kanji might have been loaded in the meantime
+        if (kanji !== this.currentKanji) return;
         this.$("stroke-graphics").empty();
         // If no stroke info is available, display a note
-        const strokesAvailable = kanjiStrokes.hasOwnProperty(this.currentKanji);
+        const strokesAvailable = strokes !== null;
         this.$("stroke-graphics").toggleDisplay(strokesAvailable);
         this.$("strokes-not-available-info").toggleDisplay(!strokesAvailable);
         if (!strokesAvailable) return;
-        const strokes = kanjiStrokes[this.currentKanji];
         this.$("complete-kanji-svg").empty();
         // Adjust svg diagram for the whole kanji
         utility.finishEventQueue().then(() => {